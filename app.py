@@ -1,9 +1,21 @@
 from flask import Flask, jsonify
 from controllers.email_controller import EmailController, email_bp
 from controllers.smtp_controller import SmtpController, smtp_bp
+from controllers.stats_controller import StatsController, stats_bp
+from controllers.suppression_controller import SuppressionController, suppression_bp
 from services.email_service import EmailService
 from services.queue_service import EmailQueue
+from services.smtp_router import smtp_router
+from services.smtp_selector import smtp_selector
+from services.config_cache import smtp_config_cache
+from services.status_events import status_events
+from services.status_writer import status_writer
+from services.db_router import db_router
+from services.delivery_stats import delivery_stats
+from services.suppression import suppression_list
+from services.idempotency import idempotency_store
 from models.smtp_config import initialize_db
+from models.email_model import db, build_database
 from config import get_config
 import atexit
 
@@ -18,16 +30,88 @@ def create_app():
     # Initialize database
     initialize_db()
     
+    # Apply SMTP routing weights
+    smtp_router.configure(
+        alpha=app.config['ROUTING_EWMA_ALPHA'],
+        failure_weight=app.config['ROUTING_FAILURE_WEIGHT'],
+        utilization_weight=app.config['ROUTING_UTILIZATION_WEIGHT'],
+        default_latency=app.config['ROUTING_DEFAULT_LATENCY'],
+        failure_cost=app.config['ROUTING_FAILURE_COST']
+    )
+    smtp_selector.refresh_interval = app.config['SMTP_SELECTOR_REFRESH']
+    smtp_config_cache.ttl = app.config['SMTP_CONFIG_CACHE_TTL']
+    smtp_config_cache.version_check_interval = app.config['SMTP_CONFIG_VERSION_CHECK']
+    status_events.configure(history_size=app.config['EVENTS_HISTORY_SIZE'])
+    
+    # Send read-only endpoints to the replicas, if any
+    if app.config['DB_REPLICAS']:
+        db_router.configure(
+            replicas=[build_database(location) for location in app.config['DB_REPLICAS']],
+            read_your_writes=app.config['READ_YOUR_WRITES_SECONDS'],
+            max_lag=app.config['REPLICA_MAX_LAG'],
+            lag_check_interval=app.config['REPLICA_LAG_CHECK_INTERVAL']
+        )
+    
+    # Suppression list, checked in memory when emails are created and sent
+    suppression_list.refresh_interval = app.config['SUPPRESSION_REFRESH_INTERVAL']
+    suppression_list.bounce_days = app.config['SUPPRESSION_BOUNCE_DAYS']
+    
+    # Idempotency keys of POST /api/emails: recent ones cached in memory, all of them expiring
+    idempotency_store.max_entries = app.config['IDEMPOTENCY_CACHE_SIZE']
+    idempotency_store.ttl = app.config['IDEMPOTENCY_KEY_TTL']
+    
     # Setup queue service
     queue_service = EmailQueue(
         worker_count=app.config['QUEUE_WORKERS'],
-        max_retries=app.config['MAX_RETRIES']
+        max_retries=app.config['MAX_RETRIES'],
+        send_deadline=app.config['SEND_DEADLINE'],
+        watchdog_interval=app.config['WATCHDOG_INTERVAL']
     )
     
     # Setup email service with queue
     email_service = EmailService(queue_service)
     
-    # Start queue workers
+    # Optionally batch concurrent email inserts into shared commits
+    if app.config['INGEST_GROUP_COMMIT']:
+        ingest_writer = email_service.enable_group_commit(
+            batch_size=app.config['INGEST_BATCH_SIZE'],
+            max_delay=app.config['INGEST_MAX_DELAY_MS'] / 1000.0
+        )
+        atexit.register(ingest_writer.stop)
+    
+    # Optionally move old sent and failed emails out of the hot table
+    if app.config['RETENTION_ENABLED']:
+        retention_job = email_service.enable_retention(
+            max_age_days=app.config['RETENTION_DAYS'],
+            target=app.config['RETENTION_TARGET'],
+            directory=app.config['RETENTION_ARCHIVE_DIR'],
+            batch_size=app.config['RETENTION_BATCH_SIZE'],
+            batch_pause=app.config['RETENTION_BATCH_PAUSE_MS'] / 1000.0,
+            interval=app.config['RETENTION_INTERVAL']
+        )
+        atexit.register(retention_job.stop)
+    
+    # Release scheduled emails to the queue when they are due
+    scheduler = email_service.enable_scheduler(
+        window=app.config['SCHEDULER_WINDOW'],
+        max_loaded=app.config['SCHEDULER_MAX_LOADED'],
+        batch_size=app.config['SCHEDULER_BATCH_SIZE']
+    )
+    atexit.register(scheduler.stop)
+    
+    # Optionally buffer the workers' status changes into grouped UPDATEs
+    if app.config['STATUS_WRITE_BEHIND']:
+        status_writer.flush_interval = app.config['STATUS_FLUSH_INTERVAL_MS'] / 1000.0
+        status_writer.start()
+        atexit.register(status_writer.stop)  # atexit runs in reverse, so after the workers stopped
+    
+    # Roll delivery statistics up in the background
+    delivery_stats.flush_interval = app.config['STATS_FLUSH_INTERVAL']
+    delivery_stats.start()
+    atexit.register(delivery_stats.stop)
+    
+    # Queue again what a previous run left queued, then start queue workers
+    email_service.recover_queued()
     queue_service.start_workers()
     
     # Register function to stop workers on app shutdown
@@ -40,9 +124,24 @@ def create_app():
     smtp_controller = SmtpController(email_service)
     smtp_controller.register_routes(smtp_bp)
     
+    stats_controller = StatsController(email_service)
+    stats_controller.register_routes(stats_bp)
+    
+    suppression_controller = SuppressionController(email_service)
+    suppression_controller.register_routes(suppression_bp)
+    
     # Register blueprints
     app.register_blueprint(email_bp, url_prefix='/api')
     app.register_blueprint(smtp_bp, url_prefix='/api')
+    app.register_blueprint(stats_bp, url_prefix='/api')
+    app.register_blueprint(suppression_bp, url_prefix='/api')
+    
+    # Request-scoped database connections: opened by the first query, handed back to the pool when the request ends
+    @app.teardown_request
+    def close_db(exc):
+        if not db.is_closed():
+            db.close()
+        db_router.close()
     
     # Error handlers
     @app.errorhandler(404)
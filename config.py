@@ -13,6 +13,80 @@ class Config:
     # Queue configuration
     QUEUE_WORKERS = int(os.environ.get('QUEUE_WORKERS', 2))
     MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 3))
+    
+    # Watchdog configuration: sends running longer than SEND_DEADLINE seconds are abandoned and requeued
+    SEND_DEADLINE = int(os.environ.get('SEND_DEADLINE', 300))
+    WATCHDOG_INTERVAL = int(os.environ.get('WATCHDOG_INTERVAL', 5))
+    
+    # SMTP routing weights (see services/smtp_router.py)
+    ROUTING_EWMA_ALPHA = float(os.environ.get('ROUTING_EWMA_ALPHA', 0.2))
+    ROUTING_FAILURE_WEIGHT = float(os.environ.get('ROUTING_FAILURE_WEIGHT', 1.0))
+    ROUTING_UTILIZATION_WEIGHT = float(os.environ.get('ROUTING_UTILIZATION_WEIGHT', 1.0))
+    ROUTING_DEFAULT_LATENCY = float(os.environ.get('ROUTING_DEFAULT_LATENCY', 1.0))
+    ROUTING_FAILURE_COST = float(os.environ.get('ROUTING_FAILURE_COST', 30.0))
+    # Seconds between full reloads of the in-memory SMTP selector (picks up other processes' changes)
+    SMTP_SELECTOR_REFRESH = int(os.environ.get('SMTP_SELECTOR_REFRESH', 60))
+    
+    # SMTP config snapshot cache: entry lifetime and how often to check other processes' edits
+    SMTP_CONFIG_CACHE_TTL = int(os.environ.get('SMTP_CONFIG_CACHE_TTL', 300))
+    SMTP_CONFIG_VERSION_CHECK = int(os.environ.get('SMTP_CONFIG_VERSION_CHECK', 5))
+    
+    # Maximum number of emails accepted by POST /api/emails/batch
+    BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 10000))
+    # Lines inserted per transaction by POST /api/emails/stream
+    STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 500))
+    # Maximum number of IDs accepted by /api/emails/status-batch
+    STATUS_BATCH_MAX = int(os.environ.get('STATUS_BATCH_MAX', 5000))
+    
+    # Status event stream (/api/emails/events)
+    EVENTS_HISTORY_SIZE = int(os.environ.get('EVENTS_HISTORY_SIZE', 10000))
+    EVENTS_BUFFER_SIZE = int(os.environ.get('EVENTS_BUFFER_SIZE', 1000))
+    EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+    EVENTS_STREAM_MAX_SECONDS = float(os.environ.get('EVENTS_STREAM_MAX_SECONDS', 300))
+    EVENTS_POLL_MAX_WAIT = float(os.environ.get('EVENTS_POLL_MAX_WAIT', 30))
+    
+    # Write-behind buffer for email status changes made by the queue workers
+    STATUS_WRITE_BEHIND = os.environ.get('STATUS_WRITE_BEHIND', 'false').lower() == 'true'
+    STATUS_FLUSH_INTERVAL_MS = float(os.environ.get('STATUS_FLUSH_INTERVAL_MS', 5))
+    
+    # Seconds between writes of the delivery statistics rollups (/api/stats)
+    STATS_FLUSH_INTERVAL = float(os.environ.get('STATS_FLUSH_INTERVAL', 1))
+    
+    # Suppression list: seconds between reads of other processes' changes, and days a hard bounce stays
+    # suppressed (0 for good)
+    SUPPRESSION_REFRESH_INTERVAL = float(os.environ.get('SUPPRESSION_REFRESH_INTERVAL', 5))
+    SUPPRESSION_BOUNCE_DAYS = int(os.environ.get('SUPPRESSION_BOUNCE_DAYS', 0))
+    
+    # Scheduled emails (send_at): seconds ahead held in memory, most held at once, and released per transaction
+    SCHEDULER_WINDOW = float(os.environ.get('SCHEDULER_WINDOW', 300))
+    SCHEDULER_MAX_LOADED = int(os.environ.get('SCHEDULER_MAX_LOADED', 10000))
+    SCHEDULER_BATCH_SIZE = int(os.environ.get('SCHEDULER_BATCH_SIZE', 500))
+    
+    # Idempotency keys of POST /api/emails: seconds they are remembered, and how many are cached in memory
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400))
+    IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+    
+    # Read replicas (comma-separated host[:port], or SQLite paths with DB_BACKEND=sqlite) for read-only endpoints
+    DB_REPLICAS = [location.strip() for location in os.environ.get('DB_REPLICAS', '').split(',') if location.strip()]
+    # Rows written by this process are read from the primary for this many seconds
+    READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+    # Replicas further behind than this are skipped; lag is checked every REPLICA_LAG_CHECK_INTERVAL seconds
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+    REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 5))
+    
+    # Retention: sent and failed emails older than RETENTION_DAYS move to an archive table or NDJSON files
+    RETENTION_ENABLED = os.environ.get('RETENTION_ENABLED', 'false').lower() == 'true'
+    RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 90))
+    RETENTION_TARGET = os.environ.get('RETENTION_TARGET', 'table')  # table or files
+    RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR', 'archive')
+    RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+    RETENTION_BATCH_PAUSE_MS = float(os.environ.get('RETENTION_BATCH_PAUSE_MS', 200))
+    RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
+    
+    # Group commit for POST /api/emails: rows are committed together every few milliseconds or N rows
+    INGEST_GROUP_COMMIT = os.environ.get('INGEST_GROUP_COMMIT', 'false').lower() == 'true'
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 200))
+    INGEST_MAX_DELAY_MS = float(os.environ.get('INGEST_MAX_DELAY_MS', 5))
 
 class DevelopmentConfig(Config):
     """Development configuration"""
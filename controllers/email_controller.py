@@ -1,8 +1,14 @@
-from flask import Blueprint, request, jsonify
-from services.email_service import EmailService
-from utils.validators import validate_email_input
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from services.email_service import EmailService, EmailNotPendingError
+from services.suppression import RecipientsSuppressedError
+from services.idempotency import IdempotencyKeyReusedError
+from utils.validators import validate_email_input, validate_email_update
+from peewee import DoesNotExist
 from functools import wraps
+import json
 import os
+import time
+from datetime import datetime
 email_bp = Blueprint('email', __name__)
 API_KEY = os.getenv('APIKEY')
 
@@ -23,17 +29,32 @@ class EmailController:
     def register_routes(self, blueprint: Blueprint):
         """Register routes to blueprint"""
         blueprint.route('/emails', methods=['POST'])(require_api_key(self.create_email))
+        blueprint.route('/emails/batch', methods=['POST'])(require_api_key(self.create_emails_batch))
+        blueprint.route('/emails/stream', methods=['POST'])(require_api_key(self.create_emails_stream))
         blueprint.route('/emails/<int:email_id>', methods=['GET'])(require_api_key(self.get_email))
+        blueprint.route('/emails/<int:email_id>', methods=['DELETE'])(require_api_key(self.cancel_email))
+        blueprint.route('/emails/<int:email_id>', methods=['PATCH'])(require_api_key(self.update_email))
+        blueprint.route('/emails/status-batch', methods=['GET', 'POST'])(require_api_key(self.get_email_statuses))
         blueprint.route('/emails/status/<status>', methods=['GET'])(require_api_key(self.get_emails_by_status))
+        blueprint.route('/emails/recipients', methods=['GET'])(require_api_key(self.get_emails_by_recipient))
+        blueprint.route('/emails/events', methods=['GET'])(require_api_key(self.stream_status_events))
+        blueprint.route('/emails/events/poll', methods=['GET'])(require_api_key(self.poll_status_events))
     
     def create_email(self):
         """Create a new email"""
         data = request.json
         
+        # The Idempotency-Key header is an alternative to the idempotency_key field
+        if isinstance(data, dict) and request.headers.get('Idempotency-Key'):
+            data['idempotency_key'] = request.headers['Idempotency-Key']
+        
         # Validate input
         validation_result = validate_email_input(data)
         if not validation_result['valid']:
-            return jsonify({'error': validation_result['message']}), 400
+            error = {'error': validation_result['message']}
+            if 'invalid_addresses' in validation_result:
+                error['invalid_addresses'] = validation_result['invalid_addresses']
+            return jsonify(error), 400
         
         try:
             email_id = self.email_service.create_email(
@@ -43,17 +64,150 @@ class EmailController:
                 smtp_config_id=data.get('smtp_config_id'),
                 cc=data.get('cc'),
                 bcc=data.get('bcc'),
-                priority=data.get('priority', 1)
+                priority=data.get('priority', 1),
+                campaign=data.get('campaign'),
+                idempotency_key=data.get('idempotency_key'),
+                send_at=data.get('send_at')
             )
             
+            if data.get('send_at') and data['send_at'] > datetime.now():
+                return jsonify({
+                    'message': 'Email created and scheduled successfully',
+                    'email_id': email_id,
+                    'send_at': data['send_at'].isoformat()
+                }), 201
+            
             return jsonify({
                 'message': 'Email created and queued successfully',
                 'email_id': email_id
             }), 201
             
+        except RecipientsSuppressedError as e:
+            return jsonify({'error': str(e), 'suppressed': e.addresses}), 422
+        except IdempotencyKeyReusedError as e:
+            return jsonify({'error': str(e)}), 422
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
+    def create_emails_batch(self):
+        """Create many emails in one request"""
+        data = request.json
+        items = data.get('emails') if isinstance(data, dict) else data
+        
+        if not isinstance(items, list) or len(items) == 0:
+            return jsonify({'error': "Request body must be a non-empty list of emails"}), 400
+        
+        max_size = current_app.config.get('BATCH_MAX_SIZE', 10000)
+        if len(items) > max_size:
+            return jsonify({'error': f"Batch size exceeds the maximum of {max_size} emails"}), 413
+        
+        # Validate every item up front, only the valid ones are created
+        results = [None] * len(items)
+        valid_items = []
+        valid_indexes = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = {'index': index, 'error': "Email must be an object"}
+                continue
+            
+            validation_result = validate_email_input(item)
+            if not validation_result['valid']:
+                results[index] = {'index': index, 'error': validation_result['message']}
+                continue
+            
+            valid_items.append(item)
+            valid_indexes.append(index)
+        
+        try:
+            if valid_items:
+                for index, result in zip(valid_indexes, self.email_service.create_emails_batch(valid_items)):
+                    result['index'] = index
+                    results[index] = result
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        
+        created = sum(1 for result in results if 'email_id' in result)
+        if created == len(results):
+            status_code = 201
+        elif created:
+            status_code = 207
+        else:
+            status_code = 400
+        
+        return jsonify({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        }), status_code
+    
+    def create_emails_stream(self):
+        """Create emails from a newline-delimited JSON body, streaming back one result per line"""
+        chunk_size = current_app.config.get('STREAM_CHUNK_SIZE', 500)
+        stream = request.stream
+        
+        def generate():
+            # Lines waiting for the next insert: (line number, item or None, error or None)
+            pending = []
+            totals = {'created': 0, 'failed': 0}
+            
+            for line_no, raw_line in enumerate(stream, start=1):
+                line = raw_line.strip()
+                if not line:
+                    continue
+                
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    pending.append((line_no, None, f"Invalid JSON: {e}"))
+                else:
+                    error = None
+                    if not isinstance(item, dict):
+                        error = "Email must be an object"
+                    else:
+                        validation_result = validate_email_input(item)
+                        if not validation_result['valid']:
+                            error = validation_result['message']
+                    pending.append((line_no, None if error else item, error))
+                
+                if len(pending) >= chunk_size:
+                    yield from self._flush_stream_chunk(pending, totals)
+                    pending = []
+            
+            yield from self._flush_stream_chunk(pending, totals)
+            yield json.dumps({'summary': totals}) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    def _flush_stream_chunk(self, pending, totals):
+        """Insert the valid lines of a chunk and yield one NDJSON result per line, in order"""
+        items = [item for _, item, _ in pending if item is not None]
+        
+        created = []
+        failure = None
+        if items:
+            try:
+                created = self.email_service.create_emails_batch(items)
+            except Exception as e:
+                # A failed chunk is reported per line and the stream carries on
+                failure = str(e)
+        created = iter(created)
+        
+        for line_no, item, error in pending:
+            result = {'line': line_no}
+            if item is None:
+                result['error'] = error
+            elif failure is not None:
+                result['error'] = failure
+            else:
+                outcome = next(created)
+                if 'email_id' in outcome:
+                    result['email_id'] = outcome['email_id']
+                else:
+                    result['error'] = outcome['error']
+            
+            totals['created' if 'email_id' in result else 'failed'] += 1
+            yield json.dumps(result) + '\n'
+    
     def get_email(self, email_id):
         """Get email details by ID"""
         try:
@@ -62,11 +216,190 @@ class EmailController:
         except Exception as e:
             return jsonify({'error': str(e)}), 404
     
+    def cancel_email(self, email_id):
+        """Cancel a scheduled or queued email"""
+        try:
+            self.email_service.cancel_email(email_id)
+            return jsonify({'message': 'Email cancelled', 'email_id': email_id}), 200
+        except DoesNotExist:
+            return jsonify({'error': f"Email {email_id} not found"}), 404
+        except EmailNotPendingError as e:
+            return jsonify({'error': str(e), 'status': e.status}), 409
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
+    def update_email(self, email_id):
+        """Change the priority of a scheduled or queued email"""
+        data = request.json
+        validation_result = validate_email_update(data)
+        if not validation_result['valid']:
+            return jsonify({'error': validation_result['message']}), 400
+        
+        try:
+            self.email_service.update_email_priority(email_id, data['priority'])
+            return jsonify({'message': 'Email updated', 'email_id': email_id, 'priority': data['priority']}), 200
+        except DoesNotExist:
+            return jsonify({'error': f"Email {email_id} not found"}), 404
+        except EmailNotPendingError as e:
+            return jsonify({'error': str(e), 'status': e.status}), 409
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
+    def get_email_statuses(self):
+        """Get the status of many emails at once, by ?ids=1,2,3 or a JSON body {"ids": [...]}"""
+        try:
+            if request.method == 'POST':
+                data = request.json
+                raw_ids = data.get('ids') if isinstance(data, dict) else None
+                if not isinstance(raw_ids, list):
+                    return jsonify({'error': "Body must be an object with an 'ids' list"}), 400
+            else:
+                raw_ids = [part for part in request.args.get('ids', '').split(',') if part.strip()]
+            email_ids = [int(email_id) for email_id in raw_ids]
+        except (ValueError, TypeError):
+            return jsonify({'error': "IDs must be integers"}), 400
+        
+        if not email_ids:
+            return jsonify({'error': "At least one ID is required"}), 400
+        
+        max_ids = current_app.config.get('STATUS_BATCH_MAX', 5000)
+        if len(email_ids) > max_ids:
+            return jsonify({'error': f"At most {max_ids} IDs can be requested at once"}), 413
+        
+        try:
+            return jsonify(self.email_service.get_email_statuses(email_ids)), 200
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
     def get_emails_by_status(self, status):
-        """Get emails by status"""
+        """Get emails by status, paginated with a cursor returned in the X-Next-Cursor header"""
+        limit = request.args.get('limit', 100, type=int)
+        if limit < 1:
+            return jsonify({'error': "Limit must be at least 1"}), 400
+        # Larger pages used to be accepted; serve them as a full page of 1000 with a cursor to the rest
+        limit = min(limit, 1000)
+        
+        # Only pass the filters the client asked for
+        filters = {}
+        try:
+            if request.args.get('cursor'):
+                filters['cursor'] = request.args['cursor']
+            for name in ('smtp_config_id', 'priority'):
+                if request.args.get(name):
+                    filters[name] = int(request.args[name])
+            for name in ('created_after', 'created_before'):
+                if request.args.get(name):
+                    filters[name] = datetime.fromisoformat(request.args[name])
+        except ValueError as e:
+            return jsonify({'error': f"Invalid filter: {e}"}), 400
+        
+        try:
+            emails = self.email_service.get_emails_by_status(status, limit, **filters)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        
+        response = jsonify(emails)
+        if len(emails) == limit:
+            last = emails[-1]
+            response.headers['X-Next-Cursor'] = self.email_service.encode_cursor(last['created_at'], last['id'])
+        return response, 200
+    
+    def get_emails_by_recipient(self):
+        """Get the emails sent to ?address= or ?domain=, newest first, paginated like the status listing"""
+        limit = request.args.get('limit', 100, type=int)
+        if limit < 1 or limit > 1000:
+            return jsonify({'error': "Limit must be between 1 and 1000"}), 400
+        
+        filters = {}
+        for name in ('address', 'domain'):
+            if request.args.get(name):
+                filters[name] = request.args[name]
         try:
-            limit = request.args.get('limit', 100, type=int)
-            emails = self.email_service.get_emails_by_status(status, limit)
-            return jsonify(emails), 200
+            if request.args.get('cursor'):
+                filters['cursor'] = int(request.args['cursor'])
+            rows = self.email_service.get_emails_by_recipient(limit=limit, **filters)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': str(e)}), 500
+        
+        response = jsonify(rows)
+        if len(rows) == limit:
+            response.headers['X-Next-Cursor'] = str(rows[-1]['id'])
+        return response, 200
+    
+    def _subscribe_from_request(self):
+        """Subscribe with the filters and cursor of the current request"""
+        filters = {}
+        if request.args.get('ids'):
+            filters['email_ids'] = [int(part) for part in request.args['ids'].split(',') if part.strip()]
+        if request.args.get('campaign'):
+            filters['campaign'] = request.args['campaign']
+        if request.args.get('smtp_config_id'):
+            filters['smtp_config_id'] = int(request.args['smtp_config_id'])
+        
+        # EventSource sends the ID of the last event it saw when it reconnects
+        cursor = request.args.get('cursor') or request.headers.get('Last-Event-ID')
+        if cursor:
+            filters['cursor'] = cursor
+        
+        buffer_size = current_app.config.get('EVENTS_BUFFER_SIZE', 1000)
+        return self.email_service.subscribe_status_events(buffer_size=buffer_size, **filters)
+    
+    def stream_status_events(self):
+        """Stream status transitions as Server-Sent Events"""
+        try:
+            subscription = self._subscribe_from_request()
+        except ValueError as e:
+            return jsonify({'error': f"Invalid filter: {e}"}), 400
+        
+        heartbeat = current_app.config.get('EVENTS_HEARTBEAT', 15)
+        max_seconds = current_app.config.get('EVENTS_STREAM_MAX_SECONDS', 300)
+        
+        def generate():
+            # Streams end after max_seconds; EventSource reconnects and resumes with Last-Event-ID
+            deadline = time.monotonic() + max_seconds
+            try:
+                yield "retry: 1000\n\n"
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    
+                    events, gap = subscription.get(timeout=min(heartbeat, remaining))
+                    if gap:
+                        yield f"id: {subscription.cursor}\nevent: gap\ndata: {{}}\n\n"
+                    for event in events:
+                        yield (f"id: {subscription.bus.make_cursor(event.seq)}\nevent: status\n"
+                               f"data: {json.dumps(event.to_dict())}\n\n")
+                    if not events and not gap:
+                        # Keeps proxies from closing the connection and moves the client's cursor
+                        yield f": keep-alive\nid: {subscription.cursor}\n\n"
+            finally:
+                subscription.close()
+        
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    
+    def poll_status_events(self):
+        """Long-poll for status transitions after a cursor"""
+        max_wait = current_app.config.get('EVENTS_POLL_MAX_WAIT', 30)
+        try:
+            wait = min(float(request.args.get('wait', max_wait)), max_wait)
+            subscription = self._subscribe_from_request()
+        except ValueError as e:
+            return jsonify({'error': f"Invalid filter: {e}"}), 400
+        
+        try:
+            events, gap = subscription.get(timeout=max(wait, 0))
+            return jsonify({
+                'events': [event.to_dict() for event in events],
+                'cursor': subscription.cursor,
+                'gap': gap
+            }), 200
+        finally:
+            subscription.close()
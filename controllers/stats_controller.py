@@ -0,0 +1,54 @@
+from flask import Blueprint, request, jsonify
+from services.email_service import EmailService
+from functools import wraps
+from datetime import datetime, timedelta
+import os
+stats_bp = Blueprint('stats', __name__)
+API_KEY = os.getenv('APIKEY')
+
+# Longest period a single stats request may cover
+MAX_RANGE = timedelta(days=366)
+
+def require_api_key(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('X-API-KEY')
+        if key != API_KEY:
+            return jsonify({'error': 'Unauthorized'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+class StatsController:
+    """Controller for delivery statistics endpoints"""
+
+    def __init__(self, email_service: EmailService):
+        self.email_service = email_service
+
+    def register_routes(self, blueprint: Blueprint):
+        """Register routes to blueprint"""
+        blueprint.route('/stats', methods=['GET'])(require_api_key(self.get_stats))
+
+    def get_stats(self):
+        """Get delivery counters and time-to-send percentiles, by ?from=&to= (ISO dates, default the last
+        24 hours), optional ?smtp_config_id= and ?granularity=hour|day|total"""
+        try:
+            end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else datetime.now()
+            start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else end - timedelta(days=1)
+            smtp_config_id = int(request.args['smtp_config_id']) if request.args.get('smtp_config_id') else None
+        except ValueError as e:
+            return jsonify({'error': f"Invalid filter: {e}"}), 400
+
+        if start >= end:
+            return jsonify({'error': "'from' must be before 'to'"}), 400
+        if end - start > MAX_RANGE:
+            return jsonify({'error': f"Range must not exceed {MAX_RANGE.days} days"}), 400
+
+        try:
+            stats = self.email_service.get_delivery_stats(
+                start, end, smtp_config_id=smtp_config_id, granularity=request.args.get('granularity', 'day')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        return jsonify(stats), 200
@@ -0,0 +1,134 @@
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from services.email_service import EmailService
+from utils.validators import validate_suppression
+from functools import wraps
+import json
+import os
+suppression_bp = Blueprint('suppression', __name__)
+API_KEY = os.getenv('APIKEY')
+
+def require_api_key(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('X-API-KEY')
+        if key != API_KEY:
+            return jsonify({'error': 'Unauthorized'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+class SuppressionController:
+    """Controller for suppression list endpoints"""
+
+    def __init__(self, email_service: EmailService):
+        self.email_service = email_service
+
+    def register_routes(self, blueprint: Blueprint):
+        """Register routes to blueprint"""
+        blueprint.route('/suppressions', methods=['POST'])(require_api_key(self.add_suppressions))
+        blueprint.route('/suppressions/import', methods=['POST'])(require_api_key(self.import_suppressions))
+        blueprint.route('/suppressions/export', methods=['GET'])(require_api_key(self.export_suppressions))
+        blueprint.route('/suppressions/<path:address>', methods=['GET'])(require_api_key(self.get_suppression))
+        blueprint.route('/suppressions/<path:address>', methods=['DELETE'])(require_api_key(self.remove_suppression))
+
+    def add_suppressions(self):
+        """Suppress one address or domain, or a list of them"""
+        data = request.json
+        entries = data if isinstance(data, list) else [data]
+
+        max_size = current_app.config.get('BATCH_MAX_SIZE', 10000)
+        if len(entries) > max_size:
+            return jsonify({'error': f"Batch size exceeds the maximum of {max_size} suppressions"}), 413
+
+        for index, entry in enumerate(entries):
+            validation_result = validate_suppression(entry)
+            if not validation_result['valid']:
+                return jsonify({'error': validation_result['message'], 'index': index}), 400
+
+        try:
+            count = self.email_service.add_suppressions(entries)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        return jsonify({'suppressed': count}), 201
+
+    def import_suppressions(self):
+        """Suppress the entries of a newline-delimited JSON body, written STREAM_CHUNK_SIZE at a time"""
+        chunk_size = current_app.config.get('STREAM_CHUNK_SIZE', 500)
+        imported = 0
+        errors = []
+        chunk = []
+
+        def flush(chunk):
+            try:
+                return self.email_service.add_suppressions([entry for _, entry in chunk])
+            except Exception as e:
+                errors.extend({'line': line_no, 'error': str(e)} for line_no, _ in chunk)
+                return 0
+
+        for line_no, raw_line in enumerate(request.stream, start=1):
+            line = raw_line.strip()
+            if not line:
+                continue
+
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                errors.append({'line': line_no, 'error': f"Invalid JSON: {e}"})
+                continue
+
+            validation_result = validate_suppression(entry)
+            if not validation_result['valid']:
+                errors.append({'line': line_no, 'error': validation_result['message']})
+                continue
+
+            chunk.append((line_no, entry))
+            if len(chunk) >= chunk_size:
+                imported += flush(chunk)
+                chunk = []
+
+        if chunk:
+            imported += flush(chunk)
+
+        if not errors:
+            status_code = 200
+        elif imported:
+            status_code = 207
+        else:
+            status_code = 400
+
+        return jsonify({
+            'imported': imported,
+            'failed': len(errors),
+            'errors': sorted(errors, key=lambda error: error['line'])
+        }), status_code
+
+    def export_suppressions(self):
+        """Stream every active suppression as newline-delimited JSON, in the format import takes"""
+        suppressions = self.email_service.export_suppressions()
+
+        def generate():
+            for suppression in suppressions:
+                yield json.dumps(suppression) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    def get_suppression(self, address):
+        """Get the suppression covering an address, its own or its domain's"""
+        try:
+            suppression = self.email_service.get_suppression(address)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        if suppression is None:
+            return jsonify({'error': f"{address} is not suppressed"}), 404
+        return jsonify(suppression), 200
+
+    def remove_suppression(self, address):
+        """Lift the suppression of an address or domain"""
+        try:
+            removed = self.email_service.remove_suppression(address)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        if not removed:
+            return jsonify({'error': f"{address} is not suppressed"}), 404
+        return jsonify({'message': f"{address} is no longer suppressed"}), 200
@@ -0,0 +1,4 @@
+from models.migrations import main
+
+if __name__ == '__main__':
+    main()
@@ -4,15 +4,24 @@
 from models.email_model import db
 
 # Import models
-from models.email_model import EmailMessage
+from models.email_model import EmailMessage, ContentBlob, EmailRecipient, ArchivedEmail, DeliveryStat, Suppression, IdempotencyKey
 from models.smtp_config import SmtpConfig
 
 # Import initialization function
 from models.smtp_config import initialize_db
+from models.migrations import SchemaVersion, run_migrations
 
 __all__ = [
     'db',
     'EmailMessage',
+    'ContentBlob',
+    'EmailRecipient',
+    'ArchivedEmail',
+    'DeliveryStat',
+    'Suppression',
+    'IdempotencyKey',
     'SmtpConfig',
-    'initialize_db'
+    'initialize_db',
+    'SchemaVersion',
+    'run_migrations'
 ]
\ No newline at end of file
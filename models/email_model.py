@@ -1,31 +1,227 @@
 from peewee import *
+from playhouse.pool import PooledMySQLDatabase
+from collections import Counter
 from datetime import datetime
+import hashlib
 import json,os
+import time
+import zlib
 
 
-db = MySQLDatabase(os.getenv('DB_NAME'), user='mailon', password=os.getenv('DB_PASSWORD', ''),
-                   host=os.getenv('DB_HOST'), port=int(os.getenv('DB_PORT',3306)), charset='utf8mb4', autocommit=True)
+class HealthCheckedPooledMySQLDatabase(PooledMySQLDatabase):
+    """Connection pool that pings pooled connections before handing them out (unless health_check is off)"""
+    def __init__(self, database, health_check=True, **kwargs):
+        self.health_check = health_check
+        super().__init__(database, **kwargs)
+    
+    def _is_closed(self, conn):
+        return super()._is_closed(conn) if self.health_check else False
+
+def build_database(location=None):
+    """Create the database from the environment.
+    
+    DB_BACKEND=mysql (default) uses a connection pool unless DB_POOL=false. Connections
+    are returned to the pool when a request ends or a worker has been idle, recycled
+    after DB_POOL_STALE_TIMEOUT seconds and pinged before reuse, so the server never
+    sees a connection it already dropped. DB_BACKEND=sqlite opens DB_PATH in WAL mode,
+    for single-node deployments and benchmarks.
+    
+    location overrides DB_HOST (host or host:port) or DB_PATH, e.g. to open a replica.
+    """
+    backend = os.getenv('DB_BACKEND', 'mysql').lower()
+    if backend == 'sqlite':
+        return SqliteDatabase(location or os.getenv('DB_PATH', 'mailerservice.db'), check_same_thread=False, pragmas={
+            'journal_mode': 'wal',  # Readers don't block the writer and vice versa
+            'synchronous': 'normal',  # Durable across application crashes, fsync only at checkpoints
+            'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000)),
+            'cache_size': -64 * 1024  # 64MB page cache
+        })
+    if backend != 'mysql':
+        raise ValueError(f"Unknown DB_BACKEND: {backend}")
+    
+    host, _, port = (location or os.getenv('DB_HOST') or '').partition(':')
+    options = dict(user='mailon', password=os.getenv('DB_PASSWORD', ''), host=host or None,
+                   port=int(port or os.getenv('DB_PORT', 3306)), charset='utf8mb4', autocommit=True)
+    if os.getenv('DB_POOL', 'true').lower() != 'true':
+        return MySQLDatabase(os.getenv('DB_NAME'), **options)
+    
+    return HealthCheckedPooledMySQLDatabase(
+        os.getenv('DB_NAME'),
+        max_connections=int(os.getenv('DB_POOL_MAX_CONNECTIONS', 32)),
+        stale_timeout=int(os.getenv('DB_POOL_STALE_TIMEOUT', 300)),  # Keep below the server's wait_timeout
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),  # Wait this long for a free connection
+        health_check=os.getenv('DB_POOL_HEALTH_CHECK', 'true').lower() == 'true',
+        **options
+    )
+
+db = build_database()
+
+class ThreadConnection:
+    """Connection lifecycle of a long-running worker thread.
+    
+    The thread keeps its connection between tasks and calls refresh() before each one;
+    after max_idle seconds without work the connection is handed back, so the next
+    query checks out a fresh (pinged) one instead of hitting a connection the server
+    has dropped. The connection is closed when the thread leaves the with block.
+    """
+    def __init__(self, database=None, max_idle=60.0):
+        self.database = database or db
+        self.max_idle = max_idle
+        self.last_used = time.monotonic()
+    
+    def __enter__(self):
+        self.last_used = time.monotonic()
+        return self
+    
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.last_used > self.max_idle and not self.database.is_closed():
+            self.database.close()
+        self.last_used = now
+    
+    def __exit__(self, *exc_info):
+        if not self.database.is_closed():
+            self.database.close()
+
+_status_listeners = []
+
+def add_status_listener(listener):
+    """Register a callable to be invoked with each EmailMessage after its status changed"""
+    if listener not in _status_listeners:
+        _status_listeners.append(listener)
+
+def notify_status_listeners(email):
+    for listener in _status_listeners:
+        listener(email)
 
 class BaseModel(Model):
     class Meta:
         database = db
 
+class ContentBlob(BaseModel):
+    """Deduplicated, compressed message body, shared by every email with the same content"""
+    hash = CharField(max_length=64, primary_key=True)  # SHA-256 of the UTF-8 body
+    data = BlobField()  # zlib-compressed body
+    size = IntegerField()  # Uncompressed size in bytes
+    ref_count = IntegerField(default=0)  # Number of emails using this body
+    created_at = DateTimeField(default=datetime.now)
+    
+    @staticmethod
+    def hash_content(content):
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def store(cls, content):
+        """Store a body (or add a reference to it) and return its hash"""
+        return cls.store_many([content])[0]
+    
+    @classmethod
+    def store_many(cls, contents):
+        """Store many bodies with one upsert per distinct body and return their hashes in order"""
+        hashes = [cls.hash_content(content) for content in contents]
+        references = Counter(hashes)
+        
+        rows = []
+        for content, content_hash in dict(zip(contents, hashes)).items():
+            encoded = content.encode('utf-8')
+            rows.append({
+                'hash': content_hash,
+                'data': zlib.compress(encoded),
+                'size': len(encoded),
+                'ref_count': references[content_hash]
+            })
+        
+        if isinstance(cls._meta.database, MySQLDatabase):
+            added = fn.VALUES(cls.ref_count)
+            query = cls.insert_many(rows).on_conflict(update={cls.ref_count: cls.ref_count + added})
+        else:
+            query = cls.insert_many(rows).on_conflict(
+                conflict_target=[cls.hash], update={cls.ref_count: cls.ref_count + EXCLUDED.ref_count}
+            )
+        query.execute()
+        
+        return hashes
+    
+    @classmethod
+    def load(cls, content_hash):
+        """Return the decompressed body stored under a hash"""
+        data = cls.select(cls.data).where(cls.hash == content_hash).scalar()
+        if data is None:
+            raise cls.DoesNotExist(f"No content stored under {content_hash}")
+        return zlib.decompress(data).decode('utf-8')
+    
+    @classmethod
+    def release(cls, content_hashes):
+        """Drop one reference per hash, deleting bodies nobody uses any more"""
+        for content_hash, count in Counter(content_hashes).items():
+            cls.update(ref_count=cls.ref_count - count).where(cls.hash == content_hash).execute()
+        cls.delete().where((cls.hash.in_(list(set(content_hashes)))) & (cls.ref_count <= 0)).execute()
+
 class EmailMessage(BaseModel):
     subject = CharField()
     sender = CharField()
     sender_name = CharField(null=True)  # Optional sender name
-    recipients = CharField()  # JSON string of recipients
-    cc = CharField(null=True)  # JSON string of CC recipients
-    bcc = CharField(null=True)  # JSON string of BCC recipients
-    html_content = TextField()
-    status = CharField(default='queued')  # queued, sending, sent, failed
+    recipients = CharField(max_length=2000)  # JSON string of recipients, also stored in EmailRecipient
+    cc = CharField(max_length=2000, null=True)  # JSON string of CC recipients
+    bcc = CharField(max_length=2000, null=True)  # JSON string of BCC recipients
+    html_body = TextField(column_name='html_content', default='')  # Inline body of emails stored before content blobs
+    content_hash = CharField(max_length=64, null=True)  # ContentBlob holding the body
+    status = CharField(default='queued')  # scheduled, queued, sending, sent, failed, cancelled
     error_message = TextField(null=True)
+    error_code = CharField(null=True)  # Structured failure code, e.g. permanent.550 or network
     smtp_config_id = IntegerField()  # Reference to SMTP configuration
+    campaign = CharField(null=True)  # Optional label grouping emails sent together
     priority = IntegerField(default=1)  # Priority: 1 (highest) to 5 (lowest)
     retry_count = IntegerField(default=0)  # Number of retry attempts
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
     sent_at = DateTimeField(null=True)
+    send_at = DateTimeField(null=True)  # Requested delivery time of a scheduled email
+    
+    class Meta:
+        # Keep in sync with models/migrations.py, which adds them to existing databases
+        indexes = (
+            (('status', 'priority', 'created_at'), False),
+            (('status', 'created_at'), False),
+            (('smtp_config_id', 'status'), False),
+            (('status', 'send_at'), False),
+        )
+    
+    @property
+    def html_content(self):
+        """Message body, loaded from its content blob on first access"""
+        if getattr(self, '_html_content', None) is None:
+            if self.content_hash:
+                self._html_content = ContentBlob.load(self.content_hash)
+            else:
+                self._html_content = self.html_body
+        return self._html_content
+    
+    @html_content.setter
+    def html_content(self, content):
+        self._html_content = content
+        self._content_changed = True
+    
+    def save(self, *args, **kwargs):
+        """Save the email, moving a newly set body into its content blob"""
+        if not getattr(self, '_content_changed', False):
+            return super().save(*args, **kwargs)
+        
+        content_hash = ContentBlob.hash_content(self._html_content)
+        with self._meta.database.atomic():
+            if content_hash != self.content_hash:
+                ContentBlob.store(self._html_content)
+                if self.content_hash:
+                    ContentBlob.release([self.content_hash])
+                self.content_hash = content_hash
+                self.html_body = ''
+            self._content_changed = False
+            return super().save(*args, **kwargs)
+    
+    @classmethod
+    def select_metadata(cls):
+        """Select every column except the inline body"""
+        return cls.select(*[field for field in cls._meta.sorted_fields if field is not cls.html_body])
     
     def get_recipients_list(self):
         """Convert recipients JSON string to list"""
@@ -39,20 +235,224 @@ class EmailMessage(BaseModel):
         """Convert BCC JSON string to list"""
         return json.loads(self.bcc) if self.bcc else []
     
-    def update_status(self, status, error_message=None):
-        """Update email status"""
+    def apply_status(self, status, error_message=None, error_code=None):
+        """Set the status columns in memory and return the names of the ones that changed"""
+        now = datetime.now()
         self.status = status
-        self.updated_at = datetime.now()
+        self.updated_at = now
+        fields = ['status', 'updated_at']
         
         if status == 'sent':
-            self.sent_at = datetime.now()
+            self.sent_at = now
+            fields.append('sent_at')
         
         if error_message:
             self.error_message = error_message
-            
-        self.save()
+            fields.append('error_message')
+        
+        if error_code:
+            self.error_code = error_code
+            fields.append('error_code')
+        
+        return fields
+    
+    def update_status(self, status, error_message=None, error_code=None):
+        """Update email status, writing only the columns that changed"""
+        self.save(only=self.apply_status(status, error_message, error_code))
+        notify_status_listeners(self)
+
+    @classmethod
+    def switch_status(cls, email_id, expected, status):
+        """Set an email's status only if it is one of expected, with one conditional UPDATE; returns whether it was"""
+        return cls.update(status=status, updated_at=datetime.now()).where(
+            (cls.id == email_id) & cls.status.in_(expected)
+        ).execute() == 1
     
     def increment_retry(self):
         """Increment retry count"""
         self.retry_count += 1
-        self.save()
\ No newline at end of file
+        self.save(only=['retry_count'])
+
+
+class ArchivedEmail(BaseModel):
+    """EmailMessage row moved out of the hot table by the retention job (see services/retention.py)"""
+    id = IntegerField(primary_key=True)  # ID the email had in EmailMessage
+    subject = CharField()
+    sender = CharField()
+    sender_name = CharField(null=True)
+    recipients = CharField(max_length=2000)
+    cc = CharField(max_length=2000, null=True)
+    bcc = CharField(max_length=2000, null=True)
+    html_body = TextField(column_name='html_content', default='')
+    content_hash = CharField(max_length=64, null=True)  # Still holds its ContentBlob reference
+    status = CharField()
+    error_message = TextField(null=True)
+    error_code = CharField(null=True)
+    smtp_config_id = IntegerField()
+    campaign = CharField(null=True)
+    priority = IntegerField(default=1)
+    retry_count = IntegerField(default=0)
+    created_at = DateTimeField(index=True)
+    updated_at = DateTimeField()
+    sent_at = DateTimeField(null=True)
+    send_at = DateTimeField(null=True)
+    archived_at = DateTimeField(default=datetime.now)
+    
+    def to_email(self):
+        """Return the archived row as an unsaved EmailMessage"""
+        fields = {name: getattr(self, name) for name in EmailMessage._meta.fields}
+        return EmailMessage(**fields)
+
+
+class DeliveryStat(BaseModel):
+    """Delivery counters of one SMTP configuration over one hour, kept up to date as emails change state"""
+    # Upper bounds in seconds of the time-to-send histogram buckets; the last bucket is unbounded
+    LATENCY_BUCKETS = (1, 5, 15, 60, 300, 900, 3600, None)
+    
+    smtp_config_id = IntegerField()
+    hour = DateTimeField()  # Start of the hour
+    sent = IntegerField(default=0)  # Emails delivered
+    failed = IntegerField(default=0)  # Failed send attempts
+    retried = IntegerField(default=0)  # Failed emails requeued for another attempt
+    given_up = IntegerField(default=0)  # Emails that failed for good
+    latency_sum = FloatField(default=0)  # Total seconds from creation to delivery of the sent emails
+    latency_1 = IntegerField(default=0)  # Sent within 1s of creation
+    latency_5 = IntegerField(default=0)
+    latency_15 = IntegerField(default=0)
+    latency_60 = IntegerField(default=0)
+    latency_300 = IntegerField(default=0)
+    latency_900 = IntegerField(default=0)
+    latency_3600 = IntegerField(default=0)
+    latency_inf = IntegerField(default=0)  # Sent more than an hour after creation
+    
+    class Meta:
+        indexes = (
+            (('smtp_config_id', 'hour'), True),
+            (('hour',), False),
+        )
+    
+    @classmethod
+    def latency_fields(cls):
+        return [getattr(cls, f"latency_{bound or 'inf'}") for bound in cls.LATENCY_BUCKETS]
+    
+    @classmethod
+    def latency_field(cls, seconds):
+        """Histogram column counting a time-to-send of the given seconds"""
+        for bound, field in zip(cls.LATENCY_BUCKETS, cls.latency_fields()):
+            if bound is None or seconds <= bound:
+                return field
+    
+    @classmethod
+    def counter_fields(cls):
+        return [field for field in cls._meta.sorted_fields if field.name not in ('id', 'smtp_config_id', 'hour')]
+    
+    @classmethod
+    def increment_many(cls, rows):
+        """Add counter deltas to their (smtp_config_id, hour) rows with one upsert"""
+        if not rows:
+            return
+        
+        if isinstance(cls._meta.database, MySQLDatabase):
+            update = {field: field + fn.VALUES(field) for field in cls.counter_fields()}
+            query = cls.insert_many(rows).on_conflict(update=update)
+        else:
+            update = {field: field + getattr(EXCLUDED, field.column_name) for field in cls.counter_fields()}
+            query = cls.insert_many(rows).on_conflict(conflict_target=[cls.smtp_config_id, cls.hour], update=update)
+        query.execute()
+
+
+class EmailRecipient(BaseModel):
+    """One address of an email, with the server's reply for it"""
+    email_id = IntegerField(index=True)  # Reference to EmailMessage
+    kind = CharField(max_length=3)  # to, cc or bcc
+    address = CharField(index=True)  # Lowercased address
+    domain = CharField(index=True)  # Lowercased domain part of the address
+    status = CharField(default='pending')  # pending, accepted, deferred (4xx), refused (5xx) or suppressed
+    smtp_code = IntegerField(null=True)  # Reply code for a refused address
+    smtp_reply = TextField(null=True)  # Reply text for a refused address
+    updated_at = DateTimeField(default=datetime.now)
+    
+    @staticmethod
+    def normalize(address):
+        """Return the lowercased address and its domain"""
+        address = address.strip().lower()
+        return address, address.rpartition('@')[2]
+    
+    @classmethod
+    def rows_for(cls, email_id, recipients, cc=None, bcc=None):
+        """Build the rows of an email's recipients"""
+        now = datetime.now()
+        rows = []
+        for kind, addresses in (('to', recipients), ('cc', cc or []), ('bcc', bcc or [])):
+            for raw in addresses:
+                address, domain = cls.normalize(raw)
+                rows.append({'email_id': email_id, 'kind': kind, 'address': address, 'domain': domain,
+                             'status': 'pending', 'updated_at': now})
+        return rows
+    
+    @classmethod
+    def record_suppressed(cls, email_id, addresses):
+        """Mark addresses left out of a send because they are suppressed"""
+        addresses = [cls.normalize(address)[0] for address in addresses]
+        cls.update(status='suppressed', updated_at=datetime.now()) \
+            .where((cls.email_id == email_id) & cls.address.in_(addresses)).execute()
+    
+    @classmethod
+    def record_delivery(cls, email_id, refused):
+        """Record sendmail's outcome: the refused addresses with their replies, every other one accepted"""
+        now = datetime.now()
+        refused = {cls.normalize(address)[0]: reply for address, reply in (refused or {}).items()}
+        
+        with cls._meta.database.atomic():
+            accepted = cls.update(status='accepted', smtp_code=None, smtp_reply=None, updated_at=now) \
+                .where((cls.email_id == email_id) & (cls.status != 'suppressed'))
+            if refused:
+                accepted = accepted.where(cls.address.not_in(list(refused)))
+            accepted.execute()
+            
+            for address, (code, reply) in refused.items():
+                if isinstance(reply, bytes):
+                    reply = reply.decode('utf-8', errors='replace')
+                cls.update(
+                    status='deferred' if 400 <= code < 500 else 'refused',
+                    smtp_code=code, smtp_reply=str(reply), updated_at=now
+                ).where((cls.email_id == email_id) & (cls.address == address)).execute()
+
+
+class Suppression(BaseModel):
+    """An address, or a whole domain, that must not be sent to"""
+    REASONS = ('hard_bounce', 'unsubscribe', 'complaint', 'manual')
+    
+    address = CharField(unique=True)  # Lowercased address, or a bare domain for domain-wide entries
+    scope = CharField(max_length=7)  # address or domain
+    reason = CharField(max_length=20)  # hard_bounce, unsubscribe, complaint or manual
+    expires_at = DateTimeField(null=True)  # Never expires when empty
+    created_at = DateTimeField(default=datetime.now)
+    updated_at = DateTimeField(default=datetime.now, index=True)  # Lets other processes pick up changes
+    
+    @staticmethod
+    def normalize(value):
+        """Return the lowercased address or domain and its scope"""
+        value = value.strip().lower()
+        return value, 'address' if '@' in value else 'domain'
+    
+    @classmethod
+    def upsert_many(cls, rows):
+        """Insert suppressions, replacing the reason and expiry of addresses already listed"""
+        if not rows:
+            return
+        
+        columns = [cls.scope, cls.reason, cls.expires_at, cls.updated_at]
+        if isinstance(cls._meta.database, MySQLDatabase):
+            query = cls.insert_many(rows).on_conflict(preserve=columns)
+        else:
+            query = cls.insert_many(rows).on_conflict(conflict_target=[cls.address], preserve=columns)
+        query.execute()
+
+
+class IdempotencyKey(BaseModel):
+    """Client-supplied key of an email creation request, so a retried request returns the first email"""
+    key = CharField(unique=True)
+    email_id = IntegerField()  # Email created by the first request with this key
+    fingerprint = CharField(max_length=64)  # SHA-256 of the request, to catch a key reused for another email
+    created_at = DateTimeField(default=datetime.now, index=True)  # Keys expire some time after this
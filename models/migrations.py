@@ -0,0 +1,196 @@
+"""Versioned schema migrations.
+
+Migrations run in order at startup (see initialize_db) or from the command line:
+
+    python migrate.py              # apply pending migrations
+    python migrate.py status       # list applied and pending migrations
+
+Migrations run before the tables are created and only touch tables that already
+exist, so a fresh database just gets the versions recorded and is then created from the
+current models, which declare every column and index the migrations add. Column
+definitions are frozen here rather than read from the models, so old migrations keep
+meaning the same thing when the models move on.
+"""
+import argparse
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+from peewee import CharField, DateTimeField, IntegerField, MySQLDatabase, Database
+from playhouse.migrate import SchemaMigrator, make_index_name, migrate as apply_operations
+
+from models.email_model import BaseModel, db
+
+logger = logging.getLogger('migrations')
+
+# Name of the MySQL advisory lock that keeps concurrently starting processes from migrating twice
+MIGRATION_LOCK = 'mailerservice_migrations'
+
+
+class SchemaVersion(BaseModel):
+    version = IntegerField(primary_key=True)
+    description = CharField()
+    applied_at = DateTimeField(default=datetime.now)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[SchemaMigrator, Database], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    """Register a migration function under the next schema version"""
+    def decorator(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"Migration {version} is out of order")
+        MIGRATIONS.append(Migration(version, description, func))
+        return func
+    return decorator
+
+
+def add_column_if_missing(migrator: SchemaMigrator, database: Database, table: str, column: str, field):
+    if not database.table_exists(table):
+        return
+    if column not in {c.name for c in database.get_columns(table)}:
+        logger.info(f"Adding column {table}.{column}")
+        apply_operations(migrator.add_column(table, column, field))
+
+
+def add_index_if_missing(migrator: SchemaMigrator, database: Database, table: str, columns: Sequence[str]):
+    """Create an index, without blocking writes on MySQL"""
+    if not database.table_exists(table):
+        return
+    name = make_index_name(table, columns)
+    if name in {index.name for index in database.get_indexes(table)}:
+        return
+
+    logger.info(f"Adding index {name}")
+    if isinstance(database, MySQLDatabase):
+        # Fail instead of silently falling back to a table-locking copy
+        column_list = ', '.join(database.quote(column) for column in columns)
+        database.execute_sql(
+            f"CREATE INDEX {database.quote(name)} ON {database.quote(table)} ({column_list}) "
+            f"ALGORITHM=INPLACE LOCK=NONE"
+        )
+    else:
+        apply_operations(migrator.add_index(table, columns))
+
+
+@migration(1, "Add columns introduced after the initial schema")
+def add_late_columns(migrator, database):
+    # These columns predate versioned migrations and shipped without one, so an existing database
+    # only gets them from here: upgrade it straight to a version that has this migration
+    # Nullable columns are added in place; MySQL 8 adds them instantly
+    add_column_if_missing(migrator, database, 'emailmessage', 'error_code', CharField(null=True))
+    add_column_if_missing(migrator, database, 'emailmessage', 'campaign', CharField(null=True))
+
+    # smtpconfig is small, the backfill of these defaults is cheap
+    add_column_if_missing(migrator, database, 'smtpconfig', 'connect_timeout', IntegerField(default=10))
+    add_column_if_missing(migrator, database, 'smtpconfig', 'command_timeout', IntegerField(default=30))
+    add_column_if_missing(migrator, database, 'smtpconfig', 'data_timeout', IntegerField(default=120))
+    add_column_if_missing(migrator, database, 'smtpconfig', 'version', IntegerField(default=1))
+
+
+@migration(2, "Index emails by status, priority, age and SMTP configuration")
+def add_email_indexes(migrator, database):
+    # Status listings filtered by priority and the scans for queued work
+    add_index_if_missing(migrator, database, 'emailmessage', ('status', 'priority', 'created_at'))
+    # Status listings in keyset order (created_at, id)
+    add_index_if_missing(migrator, database, 'emailmessage', ('status', 'created_at'))
+    # Per-account listings and failover lookups
+    add_index_if_missing(migrator, database, 'emailmessage', ('smtp_config_id', 'status'))
+
+
+@migration(3, "Store message bodies in deduplicated content blobs")
+def add_content_hash(migrator, database):
+    # The contentblob table itself is created from the model; old rows keep their inline body
+    add_column_if_missing(migrator, database, 'emailmessage', 'content_hash', CharField(max_length=64, null=True))
+
+
+@migration(4, "Widen the JSON recipient columns")
+def widen_recipient_columns(migrator, database):
+    # The emailrecipient table is created from the model. Growing a utf8mb4 VARCHAR(255) keeps
+    # its two length bytes, so MySQL only changes metadata; SQLite does not enforce lengths.
+    if not isinstance(database, MySQLDatabase) or not database.table_exists('emailmessage'):
+        return
+    database.execute_sql(
+        "ALTER TABLE `emailmessage` MODIFY `recipients` VARCHAR(2000) NOT NULL, "
+        "MODIFY `cc` VARCHAR(2000) NULL, MODIFY `bcc` VARCHAR(2000) NULL, ALGORITHM=INPLACE, LOCK=NONE"
+    )
+
+
+@migration(5, "Schedule emails for a later delivery time")
+def add_send_at(migrator, database):
+    # Nullable, so added in place; existing emails are simply not scheduled
+    add_column_if_missing(migrator, database, 'emailmessage', 'send_at', DateTimeField(null=True))
+    add_column_if_missing(migrator, database, 'archivedemail', 'send_at', DateTimeField(null=True))
+    # The scheduler's scans for emails due within its window
+    add_index_if_missing(migrator, database, 'emailmessage', ('status', 'send_at'))
+
+
+@contextmanager
+def migration_lock(database: Database, timeout: int = 300):
+    """Serialize migrations across processes (MySQL advisory lock, no-op elsewhere)"""
+    if not isinstance(database, MySQLDatabase):
+        yield
+        return
+
+    acquired = database.execute_sql("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, timeout)).fetchone()[0]
+    if not acquired:
+        raise RuntimeError("Timed out waiting for another process to finish migrating")
+    try:
+        yield
+    finally:
+        database.execute_sql("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+
+
+def applied_versions(database: Database = db) -> List[int]:
+    with database.bind_ctx([SchemaVersion]):
+        SchemaVersion.create_table(safe=True)
+        return [row.version for row in SchemaVersion.select(SchemaVersion.version).order_by(SchemaVersion.version)]
+
+
+def run_migrations(database: Database = db, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to target (default: all) and return the versions applied"""
+    applied = []
+    with migration_lock(database):
+        done = set(applied_versions(database))
+        migrator = SchemaMigrator.from_database(database)
+
+        for item in MIGRATIONS:
+            if item.version in done or (target is not None and item.version > target):
+                continue
+
+            logger.info(f"Applying migration {item.version}: {item.description}")
+            # MySQL commits DDL implicitly; each step is idempotent so a partial run can simply be repeated
+            item.apply(migrator, database)
+            with database.bind_ctx([SchemaVersion]):
+                SchemaVersion.create(version=item.version, description=item.description)
+            applied.append(item.version)
+
+    return applied
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description="Apply or inspect schema migrations")
+    parser.add_argument('command', nargs='?', choices=('migrate', 'status'), default='migrate')
+    parser.add_argument('--target', type=int, help="Stop after this schema version")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db.connect(reuse_if_open=True)
+    try:
+        if args.command == 'status':
+            done = set(applied_versions(db))
+            for item in MIGRATIONS:
+                print(f"{'applied' if item.version in done else 'pending':8} {item.version:4}  {item.description}")
+        else:
+            applied = run_migrations(db, target=args.target)
+            print(f"Applied {len(applied)} migration(s)" + (f": {applied}" if applied else ""))
+    finally:
+        db.close()
@@ -1,6 +1,30 @@
 from peewee import *
-from datetime import datetime
-from models.email_model import BaseModel, db,EmailMessage
+from datetime import datetime, time, timedelta
+from models.email_model import BaseModel, db,EmailMessage, ContentBlob, EmailRecipient, ArchivedEmail, DeliveryStat, Suppression, IdempotencyKey
+
+# Callables notified with the SmtpConfig instance after every save
+_change_listeners = []
+
+def add_change_listener(listener):
+    """Register a callable to be invoked with each SmtpConfig after it is saved"""
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+def _notify_change_listeners(config):
+    for listener in _change_listeners:
+        listener(config)
+
+# Callables notified with (config id, count, time) after reserve_send or release_send moved the counters
+_send_listeners = []
+
+def add_send_listener(listener):
+    """Register a callable to be invoked when a send is counted (count 1) or given back (count -1)"""
+    if listener not in _send_listeners:
+        _send_listeners.append(listener)
+
+def _notify_send_listeners(config_id, count, now):
+    for listener in _send_listeners:
+        listener(config_id, count, now)
 
 class SmtpConfig(BaseModel):
     name = CharField(unique=True)  # Friendly name for this SMTP configuration
@@ -15,14 +39,48 @@ class SmtpConfig(BaseModel):
     active = BooleanField(default=True)  # Is this config active?
     daily_limit = IntegerField(default=2000)  # Daily sending limit
     hourly_limit = IntegerField(default=100)  # Hourly sending limit
+    connect_timeout = IntegerField(default=10)  # Seconds to wait for the TCP/SSL connection
+    command_timeout = IntegerField(default=30)  # Seconds to wait for each SMTP command reply
+    data_timeout = IntegerField(default=120)  # Seconds to wait while transmitting the message
     sent_count_today = IntegerField(default=0)  # Count of emails sent today
     sent_count_hour = IntegerField(default=0)  # Count of emails sent this hour
     last_sent = DateTimeField(null=True)  # Last time an email was sent
     last_reset_daily = DateTimeField(default=datetime.now)  # Last daily counter reset
     last_reset_hourly = DateTimeField(default=datetime.now)  # Last hourly counter reset
+    version = IntegerField(default=1)  # Bumped on every edit so cached copies can be invalidated
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
     
+    def save(self, *args, **kwargs):
+        """Save the config and notify change listeners"""
+        result = super().save(*args, **kwargs)
+        _notify_change_listeners(self)
+        return result
+    
+    @classmethod
+    def edit(cls, config_id, **values):
+        """Write only the given columns, bump the version and notify change listeners.
+        
+        The send counters are left to reserve_send and release_send, so an edit never
+        writes back counters read before a send counted meanwhile. Returns whether the
+        config exists."""
+        values = {cls._meta.fields[key]: value for key, value in values.items() if key in cls._meta.fields}
+        values[cls.updated_at] = datetime.now()
+        values[cls.version] = cls.version + 1
+        if not cls.update(values).where(cls.id == config_id).execute():
+            return False
+        _notify_change_listeners(cls.get_by_id(config_id))
+        return True
+    
+    @classmethod
+    def get_counters(cls, config_id):
+        """Load only the activity, limit and counter columns of a config"""
+        return cls.select(
+            cls.id, cls.active, cls.daily_limit, cls.hourly_limit,
+            cls.sent_count_today, cls.sent_count_hour,
+            cls.last_reset_daily, cls.last_reset_hourly
+        ).where(cls.id == config_id).get()
+    
     def can_send(self):
         """Check if this SMTP config can send more emails"""
         now = datetime.now()
@@ -39,36 +97,85 @@ class SmtpConfig(BaseModel):
     
     def increment_sent_count(self):
         """Increment sent counters"""
-        now = datetime.now()
-        
-        # Reset counters if needed
-        self._reset_counters(now)
-        
-        # Increment counters
-        self.sent_count_today += 1
-        self.sent_count_hour += 1
-        self.last_sent = now
-        self.updated_at = now
-        self.save()
+        type(self)._counter_update(datetime.now(), 1).where(type(self).id == self.id).execute()
+        self._refresh_counters()
+        _notify_change_listeners(self)
     
     def _reset_counters(self, now):
         """Reset counters if needed"""
-        # Check if we need to reset daily counter
-        if now.date() > self.last_reset_daily.date():
-            self.sent_count_today = 0
-            self.last_reset_daily = now
-            self.save()
+        type(self)._counter_update(now, 0).where(type(self).id == self.id).execute()
+        self._refresh_counters()
+    
+    def _refresh_counters(self):
+        """Reload the counter columns after an UPDATE done in SQL"""
+        fields = ('sent_count_today', 'sent_count_hour', 'last_reset_daily', 'last_reset_hourly', 'last_sent')
+        model = type(self)
+        row = model.select(*[getattr(model, field) for field in fields]).where(model.id == self.id).tuples().get()
+        for field, value in zip(fields, row):
+            setattr(self, field, value)
+    
+    @classmethod
+    def _counter_update(cls, now, count):
+        """UPDATE adding count to both counters, zeroing the ones whose window has passed first.
+        
+        MySQL applies SET assignments left to right and later ones see earlier results; peewee
+        emits them in field declaration order, so the counters (declared first) still compare
+        against the old reset times."""
+        daily_reset = cls.last_reset_daily < datetime.combine(now.date(), time.min)
+        hourly_reset = cls.last_reset_hourly <= now - timedelta(hours=1)
         
-        # Check if we need to reset hourly counter
-        hour_diff = (now - self.last_reset_hourly).total_seconds() / 3600
-        if hour_diff >= 1:
-            self.sent_count_hour = 0
-            self.last_reset_hourly = now
-            self.save()
+        values = {
+            cls.sent_count_today: Case(None, [(daily_reset, count)], cls.sent_count_today + count),
+            cls.sent_count_hour: Case(None, [(hourly_reset, count)], cls.sent_count_hour + count),
+            cls.last_reset_daily: Case(None, [(daily_reset, now)], cls.last_reset_daily),
+            cls.last_reset_hourly: Case(None, [(hourly_reset, now)], cls.last_reset_hourly),
+        }
+        if count:
+            values[cls.last_sent] = now
+            values[cls.updated_at] = now
+        return cls.update(values)
+    
+    @classmethod
+    def reserve_send(cls, config_id, now=None):
+        """Count one send against the limits if the config is active and has quota left.
+        
+        One conditional UPDATE does the window resets, the limit check and the increment,
+        so concurrent workers can never overshoot a limit. Returns whether quota was taken."""
+        now = now or datetime.now()
+        daily_reset = cls.last_reset_daily < datetime.combine(now.date(), time.min)
+        hourly_reset = cls.last_reset_hourly <= now - timedelta(hours=1)
+        
+        reserved = cls._counter_update(now, 1).where(
+            (cls.id == config_id) &
+            (cls.active == True) &
+            (Case(None, [(daily_reset, 0)], cls.sent_count_today) < cls.daily_limit) &
+            (Case(None, [(hourly_reset, 0)], cls.sent_count_hour) < cls.hourly_limit)
+        ).execute() == 1
+        
+        # Keep in-process listeners (the SMTP selector) in step with the new counters. A taken
+        # reservation is applied as is; a refused one is rare and its current counters are read
+        if reserved:
+            _notify_send_listeners(config_id, 1, now)
+        else:
+            _notify_change_listeners(cls.get_counters(config_id))
+        return reserved
+    
+    @classmethod
+    def release_send(cls, config_id):
+        """Give back quota taken by reserve_send for a message that was not sent"""
+        cls.update({
+            cls.sent_count_today: Case(None, [(cls.sent_count_today > 0, cls.sent_count_today - 1)], 0),
+            cls.sent_count_hour: Case(None, [(cls.sent_count_hour > 0, cls.sent_count_hour - 1)], 0),
+        }).where(cls.id == config_id).execute()
+        _notify_send_listeners(config_id, -1, datetime.now())
 
 # Initialize database and create tables
 def initialize_db():
+    from models.migrations import run_migrations
     db.connect()
-    db.create_tables([EmailMessage, SmtpConfig], safe=True)
+    # Bring existing tables up to date first, then create whatever doesn't exist yet
+    run_migrations(db)
+    db.create_tables([EmailMessage, SmtpConfig, ContentBlob, EmailRecipient, ArchivedEmail, DeliveryStat, Suppression,
+                      IdempotencyKey], safe=True)
     db.close()
 initialize_db()
\ No newline at end of file
@@ -0,0 +1,90 @@
+import threading
+import time
+import logging
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from models.smtp_config import SmtpConfig
+
+logger = logging.getLogger('config_cache')
+
+
+class SmtpConfigSnapshot(NamedTuple):
+    """Immutable copy of the SmtpConfig fields needed to connect and address mail"""
+    id: int
+    name: str
+    email_address: str
+    display_name: Optional[str]
+    smtp_host: str
+    smtp_port: int
+    username: str
+    password: str
+    use_tls: bool
+    use_ssl: bool
+    active: bool
+    connect_timeout: int
+    command_timeout: int
+    data_timeout: int
+    version: int
+
+
+class SmtpConfigCache:
+    """Read-through cache of SmtpConfig snapshots.
+
+    Entries expire after ttl seconds. Changes made in this process are invalidated
+    explicitly; changes made by other processes are detected by comparing the
+    version column of all configs, at most once every version_check_interval seconds.
+    Sending counters are not cached, they change on every send.
+    """
+
+    def __init__(self, ttl: float = 300.0, version_check_interval: float = 5.0):
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[SmtpConfigSnapshot, float]] = {}
+        self._checked_at = time.monotonic()
+
+    def get(self, config_id: int) -> SmtpConfigSnapshot:
+        """Return the snapshot of a config, loading it on a miss (raises SmtpConfig.DoesNotExist)"""
+        self._check_versions()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(config_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                return entry[0]
+
+        fields = [getattr(SmtpConfig, field) for field in SmtpConfigSnapshot._fields]
+        row = SmtpConfig.select(*fields).where(SmtpConfig.id == config_id).tuples().get()
+        snapshot = SmtpConfigSnapshot(*row)
+
+        with self._lock:
+            self._entries[config_id] = (snapshot, now)
+        return snapshot
+
+    def invalidate(self, config_id: Optional[int] = None):
+        """Drop one config, or everything when no ID is given"""
+        with self._lock:
+            if config_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(config_id, None)
+
+    def _check_versions(self):
+        """Evict snapshots whose config was changed or deleted by another process"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._entries or now - self._checked_at < self.version_check_interval:
+                return
+            self._checked_at = now
+
+        versions = dict(SmtpConfig.select(SmtpConfig.id, SmtpConfig.version).tuples())
+
+        with self._lock:
+            for config_id, (snapshot, _) in list(self._entries.items()):
+                if versions.get(config_id) != snapshot.version:
+                    del self._entries[config_id]
+                    logger.info(f"SMTP config {config_id} changed, dropped cached snapshot")
+
+
+# Shared by all EmailService instances in this process
+smtp_config_cache = SmtpConfigCache()
@@ -0,0 +1,154 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Sequence
+
+from peewee import Database, MySQLDatabase
+
+from models.email_model import EmailMessage, add_status_listener
+from models.smtp_config import SmtpConfig, add_change_listener, add_send_listener
+
+logger = logging.getLogger('db_router')
+
+
+def mysql_replica_lag(database: Database) -> Optional[float]:
+    """Seconds a replica is behind its source, 0 for non-MySQL stand-ins, None if replication is broken"""
+    if not isinstance(database, MySQLDatabase):
+        return 0.0
+
+    cursor = database.execute_sql("SHOW REPLICA STATUS")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    columns = [column[0] for column in cursor.description]
+    lag = dict(zip(columns, row)).get('Seconds_Behind_Source')
+    return float(lag) if lag is not None else None
+
+
+class DatabaseRouter:
+    """Sends read-only queries to replicas, keeping reads of recent writes on the primary.
+
+    Service reads pass their query through read(); it is bound to a replica unless one
+    of the rows it asks for was written by this process in the last read_your_writes
+    seconds, or no replica is within max_lag seconds of the primary. Queries left on the
+    primary use the model's own database, so nothing changes without replicas. Writes
+    are learnt from the status and SMTP config listeners and from record_write().
+
+    Replica lag is checked every lag_check_interval seconds; replicas that lag too much,
+    or can't be reached, are skipped until the next check. Listing reads without IDs
+    always go to a healthy replica and may be up to max_lag seconds behind.
+    """
+
+    def __init__(self, replicas: Sequence[Database] = (), read_your_writes: float = 5.0, max_lag: float = 5.0,
+                 lag_check_interval: float = 5.0, lag_probe: Callable[[Database], Optional[float]] = mysql_replica_lag,
+                 max_tracked: int = 100000):
+        self.read_your_writes = read_your_writes
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.lag_probe = lag_probe
+        self.max_tracked = max_tracked
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[tuple, float]" = OrderedDict()  # (table, id) -> time of last write
+        self.configure(replicas)
+
+    def configure(self, replicas: Sequence[Database] = (), read_your_writes: Optional[float] = None,
+                  max_lag: Optional[float] = None, lag_check_interval: Optional[float] = None):
+        with self._lock:
+            self.replicas: List[Database] = list(replicas)
+            self._healthy: List[Database] = list(replicas)
+            self._next_lag_check = 0.0
+            self._turn = 0
+            if read_your_writes is not None:
+                self.read_your_writes = read_your_writes
+            if max_lag is not None:
+                self.max_lag = max_lag
+            if lag_check_interval is not None:
+                self.lag_check_interval = lag_check_interval
+
+    def reset(self):
+        """Forget the replicas and the recent writes"""
+        self.configure(())
+        with self._lock:
+            self._recent.clear()
+
+    def record_write(self, table: str, ids: Iterable[int]):
+        """Remember rows just written, so reads of them stay on the primary for a while"""
+        if not self.replicas:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            for row_id in ids:
+                key = (table, row_id)
+                self._recent[key] = now
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.max_tracked:
+                self._recent.popitem(last=False)
+
+    def _recently_written(self, table: str, ids: Iterable[int], now: float) -> bool:
+        cutoff = now - self.read_your_writes
+        # Drop expired entries from the old end first
+        while self._recent:
+            key, written_at = next(iter(self._recent.items()))
+            if written_at >= cutoff:
+                break
+            self._recent.popitem(last=False)
+        return any((table, row_id) in self._recent for row_id in ids)
+
+    def _check_lag(self):
+        """Probe every replica and keep the ones close enough to the primary"""
+        healthy = []
+        for replica in self.replicas:
+            try:
+                lag = self.lag_probe(replica)
+            except Exception as e:
+                logger.warning(f"Replica {replica.database} is unreachable: {str(e)}")
+                continue
+            if lag is None or lag > self.max_lag:
+                logger.warning(f"Replica {replica.database} is lagging ({lag}s), reading from the primary")
+                continue
+            healthy.append(replica)
+        with self._lock:
+            self._healthy = healthy
+
+    def replica_for(self, table: str, ids: Optional[Iterable[int]] = None) -> Optional[Database]:
+        """Pick the replica to read the given rows from, or None to read from the primary"""
+        if not self.replicas:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            # One thread probes, the others keep using the last result meanwhile
+            check_lag = now >= self._next_lag_check
+            if check_lag:
+                self._next_lag_check = now + self.lag_check_interval
+        if check_lag:
+            self._check_lag()
+
+        with self._lock:
+            if not self._healthy:
+                return None
+            if ids is not None and self._recently_written(table, ids, now):
+                return None
+
+            self._turn = (self._turn + 1) % len(self._healthy)
+            return self._healthy[self._turn]
+
+    def read(self, query, ids: Optional[Iterable[int]] = None):
+        """Bind a read-only query to a replica when that is safe; it stays on the primary otherwise"""
+        replica = self.replica_for(query.model._meta.table_name, ids)
+        return query.bind(replica) if replica is not None else query
+
+    def close(self):
+        """Close this thread's replica connections (handing them back to their pools)"""
+        for replica in self.replicas:
+            if not replica.is_closed():
+                replica.close()
+
+
+# Shared by the whole process; replicas are added by create_app (see DB_REPLICAS)
+db_router = DatabaseRouter()
+add_status_listener(lambda email: db_router.record_write(EmailMessage._meta.table_name, [email.id]))
+add_change_listener(lambda config: db_router.record_write(SmtpConfig._meta.table_name, [config.id]))
+add_send_listener(lambda config_id, count, now: db_router.record_write(SmtpConfig._meta.table_name, [config_id]))
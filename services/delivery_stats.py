@@ -0,0 +1,211 @@
+import threading
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.email_model import DeliveryStat, ThreadConnection, db
+from services.db_router import db_router
+
+logger = logging.getLogger('delivery_stats')
+
+GRANULARITIES = ('hour', 'day', 'total')
+PERCENTILES = (50, 90, 99)
+
+
+def _hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def latency_percentile(buckets: List[int], percentile: float) -> Optional[float]:
+    """Estimate a time-to-send percentile in seconds from histogram counts, interpolating within a bucket"""
+    total = sum(buckets)
+    if not total:
+        return None
+
+    rank = total * percentile / 100.0
+    seen = 0
+    lower = 0
+    for bound, count in zip(DeliveryStat.LATENCY_BUCKETS, buckets):
+        if count and seen + count >= rank:
+            if bound is None:
+                return float(lower)  # Only known to be above the last bound
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound or lower
+    return float(lower)
+
+
+class DeliveryStats:
+    """Hourly delivery counters per SMTP configuration, maintained as emails change state.
+
+    Transitions are added to in-memory counters and flushed every flush_interval
+    seconds with one upsert per (smtp_config_id, hour), so recording costs no query on
+    the send path. Without the flush thread every transition is written right away.
+    Reports read the rollup rows (plus what is not flushed yet), never EmailMessage,
+    so they cost the same at any table size.
+    """
+
+    def __init__(self, flush_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[int, datetime], Dict[str, float]] = {}
+        self._stopped = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the flush thread"""
+        if self.running:
+            return
+
+        self.running = True
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._flush_process)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Delivery stats flushing every {self.flush_interval}s")
+
+    def stop(self):
+        """Stop the flush thread and write what is still pending"""
+        self.running = False
+        self._stopped.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        self.thread = None
+        self.flush()
+
+    def reset(self):
+        """Drop counters that were not flushed yet"""
+        with self._lock:
+            self._pending.clear()
+
+    def _add(self, smtp_config_id: int, moment: Optional[datetime], **deltas: float):
+        key = (smtp_config_id, _hour(moment or datetime.now()))
+        with self._lock:
+            counters = self._pending.setdefault(key, defaultdict(float))
+            for name, delta in deltas.items():
+                counters[name] += delta
+        if not self.running:
+            self.flush()
+
+    def record_sent(self, smtp_config_id: int, created_at: datetime, sent_at: datetime):
+        seconds = max(0.0, (sent_at - created_at).total_seconds())
+        self._add(smtp_config_id, sent_at, **{'sent': 1, 'latency_sum': seconds,
+                                              DeliveryStat.latency_field(seconds).name: 1})
+
+    def record_failed(self, smtp_config_id: int, moment: Optional[datetime] = None):
+        self._add(smtp_config_id, moment, failed=1)
+
+    def record_retry(self, smtp_config_id: int, moment: Optional[datetime] = None):
+        self._add(smtp_config_id, moment, retried=1)
+
+    def record_given_up(self, smtp_config_id: int, moment: Optional[datetime] = None):
+        self._add(smtp_config_id, moment, given_up=1)
+
+    def flush(self):
+        """Write the pending counters, keeping them for the next flush if that fails"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        rows = [
+            dict(counters, smtp_config_id=smtp_config_id, hour=hour)
+            for (smtp_config_id, hour), counters in pending.items()
+        ]
+        # Every row of one INSERT needs the same columns
+        names = {field.name for field in DeliveryStat.counter_fields()}
+        for row in rows:
+            for name in names:
+                row.setdefault(name, 0)
+
+        try:
+            with db.atomic():
+                DeliveryStat.increment_many(rows)
+        except Exception as e:
+            logger.error(f"Error writing delivery stats: {str(e)}")
+            with self._lock:
+                for key, counters in pending.items():
+                    merged = self._pending.setdefault(key, defaultdict(float))
+                    for name, delta in counters.items():
+                        merged[name] += delta
+
+    def _flush_process(self):
+        """Flush loop"""
+        with ThreadConnection() as connection:
+            while not self._stopped.wait(self.flush_interval):
+                connection.refresh()
+                self.flush()
+
+    def summary(self, start: datetime, end: datetime, smtp_config_id: Optional[int] = None,
+                granularity: str = 'day') -> Dict[str, Any]:
+        """Delivery counters and time-to-send percentiles per SMTP configuration and period"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+        query = DeliveryStat.select().where((DeliveryStat.hour >= _hour(start)) & (DeliveryStat.hour < end))
+        if smtp_config_id is not None:
+            query = query.where(DeliveryStat.smtp_config_id == smtp_config_id)
+        rows = [
+            (row['smtp_config_id'], row['hour'], row)
+            for row in db_router.read(query).dicts().iterator()
+        ]
+
+        # Include what has been recorded but not flushed yet
+        with self._lock:
+            for (config_id, hour), counters in self._pending.items():
+                if _hour(start) <= hour < end and smtp_config_id in (None, config_id):
+                    rows.append((config_id, hour, dict(counters)))
+
+        names = [field.name for field in DeliveryStat.counter_fields()]
+        series: Dict[Tuple[int, Optional[datetime]], Dict[str, float]] = {}
+        totals = dict.fromkeys(names, 0)
+        for config_id, hour, counters in rows:
+            if granularity == 'hour':
+                period = hour
+            elif granularity == 'day':
+                period = hour.replace(hour=0)
+            else:
+                period = None
+            bucket = series.setdefault((config_id, period), dict.fromkeys(names, 0))
+            for name in names:
+                bucket[name] += counters.get(name, 0)
+                totals[name] += counters.get(name, 0)
+
+        return {
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'granularity': granularity,
+            'series': [
+                dict(self._describe(counters), smtp_config_id=config_id,
+                     period=period.isoformat() if period else None)
+                for (config_id, period), counters in sorted(
+                    series.items(), key=lambda item: (item[0][1] or datetime.min, item[0][0])
+                )
+            ],
+            'totals': self._describe(totals)
+        }
+
+    @staticmethod
+    def _describe(counters: Dict[str, float]) -> Dict[str, Any]:
+        buckets = [int(counters[field.name]) for field in DeliveryStat.latency_fields()]
+        sent = int(counters['sent'])
+        return {
+            'sent': sent,
+            'failed': int(counters['failed']),
+            'retried': int(counters['retried']),
+            'given_up': int(counters['given_up']),
+            'time_to_send': {
+                'mean': counters['latency_sum'] / sent if sent else None,
+                **{f'p{percentile}': latency_percentile(buckets, percentile) for percentile in PERCENTILES},
+                'histogram': {
+                    f"le_{bound}s" if bound else 'inf': count
+                    for bound, count in zip(DeliveryStat.LATENCY_BUCKETS, buckets)
+                }
+            }
+        }
+
+
+# Shared by the whole process; flushed in the background once started (see create_app)
+delivery_stats = DeliveryStats()
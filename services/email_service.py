@@ -2,14 +2,31 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import json
+import base64
+import binascii
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import threading
 import logging
-from peewee import DoesNotExist, fn,FloatField,Case,SQL
+import socket
+import time
+from peewee import DoesNotExist, IntegrityError, fn,FloatField,Case,SQL, MySQLDatabase, chunked
 
-from models.email_model import EmailMessage, db
+from models.email_model import EmailMessage, ContentBlob, EmailRecipient, db, notify_status_listeners
 from models.smtp_config import SmtpConfig
+from services import smtp_errors
+from services.smtp_router import smtp_router
+from services.smtp_selector import smtp_selector, RoutingEntry
+from services.config_cache import smtp_config_cache, SmtpConfigSnapshot
+from services.ingest_writer import IngestWriter
+from services.status_events import status_events, Subscription
+from services.status_writer import status_writer
+from services.retention import RetentionJob, TableArchive, FileArchive
+from services.db_router import db_router
+from services.delivery_stats import delivery_stats
+from services.suppression import suppression_list, RecipientsSuppressedError
+from services.idempotency import idempotency_store, request_fingerprint, IdempotencyKeyReusedError
+from services.scheduler import EmailScheduler
 
 # Configure logging
 logging.basicConfig(
@@ -18,89 +35,275 @@ logging.basicConfig(
 )
 logger = logging.getLogger('email_service')
 
+# Rows per INSERT statement when creating emails in bulk
+INSERT_CHUNK_SIZE = 500
+
+# MySQL databases whose multi-row INSERTs get consecutive IDs, checked once per database
+_consecutive_ids: Dict[MySQLDatabase, bool] = {}
+
+
+def consecutive_insert_ids(database: MySQLDatabase) -> bool:
+    """Whether a multi-row INSERT on this MySQL server is given one consecutive block of IDs.
+    
+    Only then can the IDs be derived from the first one. That takes auto_increment_increment 1 (not
+    Galera or group replication) and an InnoDB lock mode that doesn't interleave concurrent inserts."""
+    consecutive = _consecutive_ids.get(database)
+    if consecutive is None:
+        increment, lock_mode = database.execute_sql(
+            "SELECT @@auto_increment_increment, @@innodb_autoinc_lock_mode").fetchone()
+        consecutive = int(increment) == 1 and int(lock_mode) in (0, 1)
+        if not consecutive:
+            logger.warning(f"auto_increment_increment is {increment} and innodb_autoinc_lock_mode {lock_mode}, "
+                           f"emails created in bulk are inserted one row at a time")
+        _consecutive_ids[database] = consecutive
+    return consecutive
+
+# Statuses of emails not handed to a worker yet, which can still be cancelled or reprioritized
+PENDING_STATUSES = ('scheduled', 'queued')
+
+class EmailNotPendingError(ValueError):
+    """An email was changed after it was already taken for sending or finished"""
+    
+    def __init__(self, email_id: int, status: str):
+        self.email_id = email_id
+        self.status = status
+        super().__init__(f"Email {email_id} is {status} and can no longer be changed")
+
 class EmailSender:
     """Email sending service using SMTP"""
     
+    # Open SMTP connections by email ID, so a stuck attempt can be aborted
+    _active_connections: Dict[int, smtplib.SMTP] = {}
+    _connections_lock = threading.Lock()
+    # Connections closed by abort(), whose emails were handed back to the queue
+    _aborted_connections: set = set()
+    
+    @staticmethod
+    def _connect(smtp_config: SmtpConfigSnapshot) -> smtplib.SMTP:
+        """Open an SMTP connection honouring the config's timeouts"""
+        if smtp_config.use_ssl:
+            server = smtplib.SMTP_SSL(smtp_config.smtp_host, smtp_config.smtp_port,
+                                      timeout=smtp_config.connect_timeout)
+        else:
+            server = smtplib.SMTP(smtp_config.smtp_host, smtp_config.smtp_port,
+                                  timeout=smtp_config.connect_timeout)
+        
+        # Every command after the greeting uses the command timeout
+        EmailSender._set_timeout(server, smtp_config.command_timeout)
+        
+        if not smtp_config.use_ssl and smtp_config.use_tls:
+            server.starttls()
+        
+        return server
+    
+    @staticmethod
+    def _set_timeout(server: smtplib.SMTP, timeout: float) -> None:
+        """Apply a socket timeout to an open SMTP connection"""
+        if server.sock is not None:
+            server.sock.settimeout(timeout)
+    
+    @staticmethod
+    def abort(email_id: int, requeue: bool = False) -> bool:
+        """Close the socket of an in-flight send so the blocked worker is released.
+        
+        With requeue the email is switched back to 'queued' under the connections lock, so the
+        attempt either sees the abort once its message is out or is never requeued."""
+        with EmailSender._connections_lock:
+            server = EmailSender._active_connections.get(email_id)
+            if server is None or server.sock is None:
+                return False
+            if requeue:
+                EmailMessage.switch_status(email_id, ('sending',), 'queued')
+            del EmailSender._active_connections[email_id]
+            EmailSender._aborted_connections.add(server)
+        
+        try:
+            server.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        server.close()
+        logger.warning(f"Aborted SMTP connection for email {email_id}")
+        return True
+    
+    @staticmethod
+    def _record_sent(email: EmailMessage, refusal: Optional[smtp_errors.SmtpFailure]) -> None:
+        """Write the 'sent' status of a delivered email, waiting for it to be committed.
+        
+        The message is already out, so a failed write must never turn into a send failure and a retry:
+        it is tried once more directly, and otherwise only logged."""
+        error_message, error_code = (refusal.message, refusal.error_code) if refusal else (None, None)
+        try:
+            status_writer.submit(email, 'sent', error_message, error_code, wait=True)
+        except Exception as e:
+            logger.error(f"Error writing the sent status of email {email.id}, writing it directly: {str(e)}")
+            try:
+                email.update_status('sent', error_message, error_code)
+            except Exception as update_error:
+                logger.error(f"Email {email.id} was sent but its status could not be written: {str(update_error)}")
+    
     @staticmethod
     def send_email(email_id: int) -> Tuple[bool, str]:
         """Send an email by ID from the database"""
+        smtp_config_id = None
+        reserved_config_id = None
+        started = None
+        server = None
         try:
-            with db.atomic():
-                # Get email from database
-                email = EmailMessage.get_by_id(email_id)
-                
-                if email.status == 'sent':
-                    return True, "Email already sent"
-                
-                # Get SMTP configuration
-                smtp_config = SmtpConfig.get_by_id(email.smtp_config_id)
-                
-                if not smtp_config.active:
-                    return False, "SMTP configuration is inactive"
-                
-                if not smtp_config.can_send():
-                    return False, "SMTP sending limits reached"
-                
-                # Update email status to sending
-                email.update_status('sending')
-                
-                # Create message
-                msg = MIMEMultipart('alternative')
-                msg['Subject'] = email.subject
-                
-                # Set sender with display name if available
-                if smtp_config.display_name:
-                    msg['From'] = f"{smtp_config.display_name} <{smtp_config.email_address}>"
-                else:
-                    msg['From'] = smtp_config.email_address
-                
-                # Set recipients
-                recipients_list = email.get_recipients_list()
-                msg['To'] = ', '.join(recipients_list)
-                
-                # Set CC if available
-                cc_list = email.get_cc_list()
-                if cc_list:
-                    msg['Cc'] = ', '.join(cc_list)
-                
-                # Get BCC list if available
-                bcc_list = email.get_bcc_list()
-                
-                # Attach HTML content
-                html_part = MIMEText(email.html_content, 'html')
-                msg.attach(html_part)
-                
-                # Get all recipients for sending
-                all_recipients = recipients_list + cc_list + bcc_list
-                
-                # Connect to SMTP server and send
-                if smtp_config.use_ssl:
-                    server = smtplib.SMTP_SSL(smtp_config.smtp_host, smtp_config.smtp_port)
-                else:
-                    server = smtplib.SMTP(smtp_config.smtp_host, smtp_config.smtp_port)
-                    
-                    if smtp_config.use_tls:
-                        server.starttls()
-                
+            # Get email from database. No transaction here: row locks must not be held across the SMTP exchange
+            email = EmailMessage.get_by_id(email_id)
+            
+            if email.status == 'sent':
+                return True, "Email already sent"
+            
+            # Cancelled while it waited in this or another process's queue
+            if email.status == 'cancelled':
+                return True, "Email was cancelled"
+            
+            # Get SMTP configuration from the snapshot cache
+            smtp_config = smtp_config_cache.get(email.smtp_config_id)
+            
+            if not smtp_config.active:
+                return False, "SMTP configuration is inactive"
+            
+            # Claim the email right away, not written behind: a cancel, or another copy of it in a queue,
+            # must find it no longer queued before anything is sent
+            if not EmailMessage.switch_status(email_id, ('queued',), 'sending'):
+                return True, "Email is no longer queued"
+            email.status = 'sending'
+            notify_status_listeners(email)
+            
+            recipients_list = email.get_recipients_list()
+            cc_list = email.get_cc_list()
+            bcc_list = email.get_bcc_list()
+            
+            # Addresses may have been suppressed since the email was queued
+            suppressed = suppression_list.suppressed(recipients_list + cc_list + bcc_list)
+            if suppressed:
+                EmailRecipient.record_suppressed(email_id, suppressed)
+                suppressed = set(suppressed)
+                recipients_list = [address for address in recipients_list if address not in suppressed]
+                cc_list = [address for address in cc_list if address not in suppressed]
+                bcc_list = [address for address in bcc_list if address not in suppressed]
+                if not recipients_list and not cc_list and not bcc_list:
+                    logger.info(f"Email {email_id} not sent: every recipient is suppressed")
+                    status_writer.submit(email, 'failed', "All recipients are suppressed", smtp_errors.SUPPRESSED,
+                                         wait=True)
+                    return False, "All recipients are suppressed"
+            
+            # Take one unit of quota with a single conditional UPDATE, safe across workers and processes
+            if not SmtpConfig.reserve_send(smtp_config.id):
+                EmailMessage.switch_status(email_id, ('sending',), 'queued')
+                return False, "SMTP sending limits reached"
+            reserved_config_id = smtp_config.id
+            
+            # Create message
+            msg = MIMEMultipart('alternative')
+            msg['Subject'] = email.subject
+            
+            # Set sender with display name if available
+            if smtp_config.display_name:
+                msg['From'] = f"{smtp_config.display_name} <{smtp_config.email_address}>"
+            else:
+                msg['From'] = smtp_config.email_address
+            
+            # Set recipients
+            msg['To'] = ', '.join(recipients_list)
+            
+            # Set CC if available
+            if cc_list:
+                msg['Cc'] = ', '.join(cc_list)
+            
+            # Attach HTML content
+            html_part = MIMEText(email.html_content, 'html')
+            msg.attach(html_part)
+            
+            # Get all recipients for sending
+            all_recipients = recipients_list + cc_list + bcc_list
+            
+            # Connect to SMTP server and send
+            smtp_config_id = smtp_config.id
+            started = time.monotonic()
+            server = EmailSender._connect(smtp_config)
+            with EmailSender._connections_lock:
+                EmailSender._active_connections[email_id] = server
+            
+            try:
                 server.login(smtp_config.username, smtp_config.password)
-                server.sendmail(smtp_config.email_address, all_recipients, msg.as_string())
-                server.quit()
-                
-                # Update email status and SMTP counters
-                email.update_status('sent')
-                smtp_config.increment_sent_count()
                 
-                return True, "Email sent successfully"
+                # The message transfer gets its own, usually longer, timeout
+                EmailSender._set_timeout(server, smtp_config.data_timeout)
+                refused = server.sendmail(smtp_config.email_address, all_recipients, msg.as_string())
                 
+                # The message is out: the watchdog must no longer abort and requeue it
+                with EmailSender._connections_lock:
+                    EmailSender._active_connections.pop(email_id, None)
+                    aborted = server in EmailSender._aborted_connections
+                    EmailSender._aborted_connections.discard(server)
+                if aborted:
+                    # Requeued just as the server accepted it: claim it back so the queued retry is skipped
+                    if not EmailMessage.switch_status(email_id, ('queued',), 'sending'):
+                        logger.error(f"Email {email_id} was delivered while its retry was already sending it")
+                else:
+                    try:
+                        server.quit()
+                    except (smtplib.SMTPException, OSError) as quit_error:
+                        logger.warning(f"Error closing the SMTP session of email {email_id}: {str(quit_error)}")
+            finally:
+                with EmailSender._connections_lock:
+                    EmailSender._active_connections.pop(email_id, None)
+                server.close()
+            
+            smtp_router.record(smtp_config_id, time.monotonic() - started, True)
+            reserved_config_id = None  # The message is out, the quota stays used
+            
+            # Some recipients may have been refused while others were accepted
+            refused = refused if isinstance(refused, dict) else {}
+            refusal = smtp_errors.classify_refusals(refused)
+            EmailRecipient.record_delivery(email_id, refused)
+            suppression_list.record_bounces(refused)
+            
+            if refusal:
+                logger.warning(f"Email {email_id} partially delivered: {refusal.message}")
+            EmailSender._record_sent(email, refusal)
+            delivery_stats.record_sent(smtp_config_id, email.created_at, email.sent_at or datetime.now())
+            
+            return True, "Email sent successfully"
+            
         except Exception as e:
-            error_message = str(e)
-            logger.error(f"Error sending email {email_id}: {error_message}")
+            failure = smtp_errors.classify_exception(e)
+            error_message = failure.message
+            logger.error(f"Error sending email {email_id} ({failure.error_code}): {error_message}")
+            
+            # The message didn't go out, give the reserved quota back
+            if reserved_config_id is not None:
+                try:
+                    SmtpConfig.release_send(reserved_config_id)
+                except Exception as release_error:
+                    logger.error(f"Error releasing SMTP quota: {str(release_error)}")
+            
+            # The watchdog aborted this attempt and already queued the email again
+            with EmailSender._connections_lock:
+                aborted = server is not None and server in EmailSender._aborted_connections
+                EmailSender._aborted_connections.discard(server)
+            if aborted:
+                return False, error_message
+            
+            # Only failures caused by the server count against its routing score
+            if started is not None:
+                smtp_router.record(smtp_config_id, time.monotonic() - started,
+                                   not smtp_errors.is_relay_failure(failure.error_code))
+                smtp_selector.rescore(smtp_config_id)
             
             # Update email status to failed
             try:
-                with db.atomic():
-                    email = EmailMessage.get_by_id(email_id)
-                    email.update_status('failed', error_message)
+                if isinstance(e, smtplib.SMTPRecipientsRefused):
+                    EmailRecipient.record_delivery(email_id, e.recipients)
+                    suppression_list.record_bounces(e.recipients)
+                email = EmailMessage.select_metadata().where(EmailMessage.id == email_id).get()
+                # An aborted attempt may finish after its retry already succeeded
+                if email.status != 'sent':
+                    status_writer.submit(email, 'failed', error_message, failure.error_code, wait=True)
+                    delivery_stats.record_failed(email.smtp_config_id)
             except Exception as update_error:
                 logger.error(f"Error updating email status: {str(update_error)}")
                 
@@ -112,6 +315,9 @@ class EmailService:
     
     def __init__(self, queue_service=None):
         self.queue_service = queue_service
+        self.ingest_writer = None  # Optional group-commit writer, see enable_group_commit
+        self.archive = None  # Where old emails are looked up once archived, see enable_retention
+        self.scheduler = None  # Releases scheduled emails to the queue, see enable_scheduler
         
         # If queue service provided, set this service as its email service
         if queue_service:
@@ -121,8 +327,24 @@ class EmailService:
                     html_content: str, smtp_config_id: int = None,
                     cc: Optional[List[str]] = None, 
                     bcc: Optional[List[str]] = None,
-                    priority: int = 1) -> int:
-        """Create a new email in the database"""
+                    priority: int = 1, campaign: Optional[str] = None,
+                    idempotency_key: Optional[str] = None, send_at: Optional[datetime] = None) -> int:
+        """Create a new email in the database, leaving out suppressed recipients.
+        
+        An email with a future send_at is scheduled instead of queued. With an idempotency key,
+        a request repeating an earlier one returns the email it created."""
+        fingerprint = None
+        if idempotency_key is not None:
+            fingerprint = request_fingerprint({
+                'subject': subject, 'recipients': recipients, 'html_content': html_content,
+                'smtp_config_id': smtp_config_id, 'cc': cc, 'bcc': bcc, 'priority': priority, 'campaign': campaign,
+                'send_at': send_at
+            })
+            email_id = self._replay(idempotency_key, fingerprint, cached_only=True)
+            if email_id is not None:
+                return email_id
+        
+        recipients, cc, bcc = self._drop_suppressed(recipients, cc, bcc)
         
         # If no SMTP config provided, get the best available one
         if smtp_config_id is None:
@@ -131,24 +353,254 @@ class EmailService:
                 raise ValueError("No available SMTP configuration found")
             smtp_config_id = smtp_config.id
         
-        with db.atomic():
-            email = EmailMessage.create(
-                subject=subject,
-                sender="",  # Will be determined by SMTP config
-                recipients=json.dumps(recipients),
-                cc=json.dumps(cc) if cc else None,
-                bcc=json.dumps(bcc) if bcc else None,
-                html_content=html_content,
-                status='queued',
-                smtp_config_id=smtp_config_id,
-                priority=priority
-            )
+        row = self._build_email_row(subject, recipients, html_content, smtp_config_id, cc, bcc, priority, campaign,
+                                    send_at)
+        
+        # Share the commit with concurrent requests when group commit is enabled; a key must share the email's own
+        if self.ingest_writer and idempotency_key is None:
+            return self.ingest_writer.submit(row)
+        
+        for attempt in range(2):
+            try:
+                with EmailMessage._meta.database.atomic():
+                    email = EmailMessage.create(**row)
+                    EmailRecipient.insert_many(EmailRecipient.rows_for(email.id, recipients, cc, bcc)).execute()
+                    if idempotency_key is not None:
+                        stored_key = idempotency_store.insert(idempotency_key, email.id, fingerprint)
+                    db_router.record_write(EmailMessage._meta.table_name, [email.id])
+                    
+                    # Add to queue if queue service is available
+                    if self.queue_service and row['status'] == 'queued':
+                        self.queue_service.enqueue(email.id, priority)
+                break
+            except IntegrityError:
+                # The key was used before (or by a concurrent request that committed first), this one was rolled back
+                if idempotency_key is None:
+                    raise
+                email_id = self._replay(idempotency_key, fingerprint)
+                if email_id is not None:
+                    return email_id
+                if attempt:
+                    raise
+                # The key had expired and lookup deleted it, insert again
+        
+        if idempotency_key is not None:
+            idempotency_store.committed(idempotency_key, stored_key)
+        if row['status'] == 'scheduled' and self.scheduler:
+            self.scheduler.schedule(email.id, send_at)
+        return email.id
+    
+    @staticmethod
+    def _replay(idempotency_key: str, fingerprint: str, cached_only: bool = False) -> Optional[int]:
+        """The email already created with this key, if any; raises IdempotencyKeyReusedError for another request"""
+        if cached_only:
+            stored_key = idempotency_store.cached(idempotency_key)
+        else:
+            stored_key = idempotency_store.lookup(idempotency_key)
+        if stored_key is None:
+            return None
+        if stored_key.fingerprint != fingerprint:
+            raise IdempotencyKeyReusedError(idempotency_key)
+        
+        logger.info(f"Repeated request with idempotency key {idempotency_key!r}, returning email {stored_key.email_id}")
+        return stored_key.email_id
+    
+    def enable_group_commit(self, batch_size: int = 200, max_delay: float = 0.005) -> IngestWriter:
+        """Route create_email through a batching writer that commits many rows at once"""
+        def insert_rows(rows):
+            with db.atomic():
+                return self._insert_emails(rows)
+        
+        self.ingest_writer = IngestWriter(insert_rows, self._dispatch, batch_size=batch_size, max_delay=max_delay)
+        self.ingest_writer.start()
+        return self.ingest_writer
+    
+    def enable_retention(self, max_age_days: int = 90, target: str = 'table', directory: str = 'archive',
+                         batch_size: int = 500, batch_pause: float = 0.2, interval: float = 3600.0) -> RetentionJob:
+        """Start archiving old sent and failed emails to a table or to NDJSON files, and read them back from there"""
+        if target == 'files':
+            self.archive = FileArchive(directory)
+        elif target == 'table':
+            self.archive = TableArchive()
+        else:
+            raise ValueError(f"Unknown archive target: {target}")
+        
+        job = RetentionJob(self.archive, max_age_days=max_age_days, batch_size=batch_size,
+                           batch_pause=batch_pause, interval=interval)
+        job.start()
+        return job
+    
+    def enable_scheduler(self, window: float = 300.0, max_loaded: int = 10000, batch_size: int = 500) -> EmailScheduler:
+        """Start releasing scheduled emails to the queue when their send_at comes"""
+        self.scheduler = EmailScheduler(self.queue_service, window=window, max_loaded=max_loaded,
+                                        batch_size=batch_size)
+        self.scheduler.start()
+        return self.scheduler
+    
+    def recover_queued(self, chunk_size: int = 1000) -> int:
+        """Queue the emails left 'queued' in the database by a previous run, e.g. released by the scheduler
+        but not sent before a restart, and return how many were found.
+        
+        Several processes recovering the same emails is harmless: workers claim an email before sending it."""
+        if not self.queue_service:
+            return 0
+        
+        recovered = 0
+        last_id = 0
+        while True:
+            rows = list(EmailMessage
+                        .select(EmailMessage.id, EmailMessage.priority)
+                        .where((EmailMessage.status == 'queued') & (EmailMessage.id > last_id))
+                        .order_by(EmailMessage.id)
+                        .limit(chunk_size)
+                        .tuples())
+            if not rows:
+                break
+            self.queue_service.enqueue_many(rows)
+            recovered += len(rows)
+            last_id = rows[-1][0]
+        
+        if recovered:
+            logger.info(f"Recovered {recovered} queued emails")
+        return recovered
+    
+    def create_emails_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Create many validated emails in one transaction and queue them.
+        
+        Returns one result per item, in input order, with either an email_id or an error."""
+        results: List[Dict[str, Any]] = [{'index': index} for index in range(len(items))]
+        
+        # Pick the SMTP configuration once for every item that doesn't name one
+        default_config = None
+        if any(item.get('smtp_config_id') is None for item in items):
+            default_config = self._get_best_smtp_config()
+        
+        rows = []
+        row_indexes = []
+        for index, item in enumerate(items):
+            smtp_config_id = item.get('smtp_config_id')
+            if smtp_config_id is None:
+                if not default_config:
+                    results[index]['error'] = "No available SMTP configuration found"
+                    continue
+                smtp_config_id = default_config.id
             
-            # Add to queue if queue service is available
-            if self.queue_service:
-                self.queue_service.enqueue(email.id, priority)
+            try:
+                recipients, cc, bcc = self._drop_suppressed(item['recipients'], item.get('cc'), item.get('bcc'))
+            except RecipientsSuppressedError as e:
+                results[index]['error'] = str(e)
+                continue
             
-            return email.id
+            rows.append(self._build_email_row(
+                item['subject'], recipients, item['html_content'], smtp_config_id,
+                cc, bcc, item.get('priority', 1), item.get('campaign'), item.get('send_at')
+            ))
+            row_indexes.append(index)
+        
+        if not rows:
+            return results
+        
+        with db.atomic():
+            email_ids = self._insert_emails(rows)
+        
+        for index, email_id in zip(row_indexes, email_ids):
+            results[index]['email_id'] = email_id
+        
+        # Queue only after the transaction committed, so workers can see the rows
+        self._dispatch(rows, email_ids)
+        
+        return results
+    
+    def _dispatch(self, rows: List[Dict[str, Any]], email_ids: List[int]):
+        """Queue newly committed emails, or hand them to the scheduler if they are scheduled"""
+        queued = [(email_id, row['priority']) for email_id, row in zip(email_ids, rows) if row['status'] == 'queued']
+        if queued and self.queue_service:
+            self.queue_service.enqueue_many(queued)
+        
+        if self.scheduler:
+            for email_id, row in zip(email_ids, rows):
+                if row['status'] == 'scheduled':
+                    self.scheduler.schedule(email_id, row['send_at'])
+    
+    @staticmethod
+    def _drop_suppressed(recipients: List[str], cc: Optional[List[str]] = None,
+                         bcc: Optional[List[str]] = None) -> Tuple[List[str], Optional[List[str]], Optional[List[str]]]:
+        """Remove suppressed addresses, raising RecipientsSuppressedError when none is left"""
+        suppressed = suppression_list.suppressed(list(recipients) + list(cc or []) + list(bcc or []))
+        if not suppressed:
+            return recipients, cc, bcc
+        
+        suppressed_set = set(suppressed)
+        recipients = [address for address in recipients if address not in suppressed_set]
+        cc = [address for address in cc if address not in suppressed_set] if cc else cc
+        bcc = [address for address in bcc if address not in suppressed_set] if bcc else bcc
+        if not recipients and not cc and not bcc:
+            raise RecipientsSuppressedError(suppressed)
+        
+        logger.info(f"Left out {len(suppressed)} suppressed recipients")
+        return recipients, cc, bcc
+    
+    @staticmethod
+    def _build_email_row(subject: str, recipients: List[str], html_content: str,
+                         smtp_config_id: int, cc: Optional[List[str]] = None,
+                         bcc: Optional[List[str]] = None, priority: int = 1,
+                         campaign: Optional[str] = None, send_at: Optional[datetime] = None) -> Dict[str, Any]:
+        """Build the column values of a new email, scheduled if send_at is still to come and queued otherwise"""
+        now = datetime.now()
+        return {
+            'subject': subject,
+            'sender': "",  # Will be determined by SMTP config
+            'recipients': json.dumps(recipients),
+            'cc': json.dumps(cc) if cc else None,
+            'bcc': json.dumps(bcc) if bcc else None,
+            'html_content': html_content,
+            'status': 'scheduled' if send_at and send_at > now else 'queued',
+            'send_at': send_at,
+            'smtp_config_id': smtp_config_id,
+            'priority': int(priority),
+            'campaign': campaign,
+            'created_at': now,
+            'updated_at': now
+        }
+    
+    @staticmethod
+    def _insert_emails(rows: List[Dict[str, Any]]) -> List[int]:
+        """Insert email rows with multi-row INSERTs and return their IDs in order.
+        
+        Must be called inside a transaction."""
+        # Bodies go to the content blob table once per distinct body, rows keep only the hash
+        content_hashes = ContentBlob.store_many([row['html_content'] for row in rows])
+        rows = [
+            dict({key: value for key, value in row.items() if key != 'html_content'}, content_hash=content_hash)
+            for row, content_hash in zip(rows, content_hashes)
+        ]
+        
+        email_ids = []
+        for chunk in chunked(rows, INSERT_CHUNK_SIZE):
+            query = EmailMessage.insert_many(chunk)
+            
+            if isinstance(EmailMessage._meta.database, MySQLDatabase):
+                # MySQL has no RETURNING; it reports the first ID of the statement
+                if consecutive_insert_ids(EmailMessage._meta.database):
+                    first_id = query.execute()
+                    email_ids.extend(range(first_id, first_id + len(chunk)))
+                else:
+                    email_ids.extend(EmailMessage.insert(row).execute() for row in chunk)
+            else:
+                email_ids.extend(row[0] for row in query.returning(EmailMessage.id).tuples().execute())
+        
+        recipient_rows = []
+        for email_id, row in zip(email_ids, rows):
+            recipient_rows.extend(EmailRecipient.rows_for(
+                email_id, json.loads(row['recipients']),
+                json.loads(row['cc']) if row['cc'] else None,
+                json.loads(row['bcc']) if row['bcc'] else None
+            ))
+        for chunk in chunked(recipient_rows, INSERT_CHUNK_SIZE):
+            EmailRecipient.insert_many(chunk).execute()
+        
+        db_router.record_write(EmailMessage._meta.table_name, email_ids)
+        return email_ids
     
     def process_queued_email(self, email_id: int) -> bool:
         """Process an email from the queue"""
@@ -156,105 +608,301 @@ class EmailService:
         logger.info(f"Email {email_id} processed: {'Success' if success else 'Failed'} - {message}")
         return success
     
+    def abort_send(self, email_id: int) -> bool:
+        """Abort an in-flight send that is stuck on the network, leaving the email queued to be sent again.
+        
+        Returns False when the attempt holds no open connection, so it may still deliver the email."""
+        return EmailSender.abort(email_id, requeue=True)
+    
     def handle_failed_email(self, email_id: int, max_retries: int) -> None:
         """Handle a failed email, potentially requeuing it"""
         try:
             with db.atomic():
-                email = EmailMessage.get_by_id(email_id)
+                email = EmailMessage.select_metadata().where(EmailMessage.id == email_id).get()
+                
+                # Permanent rejections can never succeed, so don't spend SMTP capacity on them
+                if not smtp_errors.is_retryable(email.error_code):
+                    logger.info(f"Email {email_id} failed permanently ({email.error_code}), not retrying")
+                    delivery_stats.record_given_up(email.smtp_config_id)
+                    return
                 
                 # If we haven't exceeded max retries, requeue with lower priority
                 if email.retry_count < max_retries:
+                    # Try a different SMTP config if available
+                    new_smtp_config = self._get_best_smtp_config(exclude_id=email.smtp_config_id)
+                    
+                    # Authentication failures are tied to the account, not the message
+                    if not new_smtp_config and smtp_errors.requires_other_config(email.error_code):
+                        email.update_status('failed', "Authentication failed and no other SMTP configuration is available")
+                        logger.info(f"Email {email_id} permanently failed: no alternative to SMTP config {email.smtp_config_id}")
+                        delivery_stats.record_given_up(email.smtp_config_id)
+                        return
+                    
                     email.increment_retry()
+                    delivery_stats.record_retry(email.smtp_config_id)
                     new_priority = min(5, email.priority + 1)  # Decrease priority (higher number)
                     
-                    # Try a different SMTP config if available
-                    new_smtp_config = self._get_best_smtp_config(exclude_id=email.smtp_config_id)
                     if new_smtp_config:
                         email.smtp_config_id = new_smtp_config.id
-                        email.save()
+                        email.save(only=['smtp_config_id'])
                     
-                    # Requeue with new priority
+                    # Requeue with new priority; only queued emails are claimed by workers
+                    email.update_status('queued')
                     if self.queue_service:
                         self.queue_service.enqueue(email.id, new_priority)
                         logger.info(f"Email {email_id} requeued with priority {new_priority}, retry {email.retry_count}")
                 else:
                     # Mark as permanently failed
                     email.update_status('failed', "Maximum retry attempts exceeded")
+                    delivery_stats.record_given_up(email.smtp_config_id)
                     logger.info(f"Email {email_id} permanently failed after {max_retries} retries")
         except Exception as e:
             logger.error(f"Error handling failed email {email_id}: {str(e)}")
     
+    def cancel_email(self, email_id: int) -> None:
+        """Cancel a scheduled or queued email and take it out of the queue.
+        
+        Raises DoesNotExist for an unknown email and EmailNotPendingError once it is being sent or done."""
+        updated = EmailMessage.update(status='cancelled', updated_at=datetime.now()).where(
+            (EmailMessage.id == email_id) & EmailMessage.status.in_(PENDING_STATUSES)
+        ).execute()
+        email = EmailMessage.select_metadata().where(EmailMessage.id == email_id).get()
+        if not updated:
+            raise EmailNotPendingError(email_id, email.status)
+        
+        # Workers skip a cancelled email anyway; this just frees its slot right away
+        if self.queue_service:
+            self.queue_service.cancel(email_id)
+        if self.scheduler:
+            self.scheduler.cancel(email_id)
+        
+        notify_status_listeners(email)
+        logger.info(f"Email {email_id} cancelled")
+    
+    def update_email_priority(self, email_id: int, priority: int) -> None:
+        """Change the priority of a scheduled or queued email, moving it within the queue.
+        
+        Raises DoesNotExist for an unknown email and EmailNotPendingError once it is being sent or done."""
+        updated = EmailMessage.update(priority=priority, updated_at=datetime.now()).where(
+            (EmailMessage.id == email_id) & EmailMessage.status.in_(PENDING_STATUSES)
+        ).execute()
+        if not updated:
+            email = EmailMessage.select(EmailMessage.status).where(EmailMessage.id == email_id).get()
+            raise EmailNotPendingError(email_id, email.status)
+        db_router.record_write(EmailMessage._meta.table_name, [email_id])
+        
+        # Scheduled emails are queued with the priority they have when released
+        if self.queue_service:
+            self.queue_service.reprioritize(email_id, priority)
+    
+    @staticmethod
+    def _read_one(query, row_id: int):
+        """Get one row from a replica when possible, falling back to the primary if it isn't there yet"""
+        replica = db_router.replica_for(query.model._meta.table_name, [row_id])
+        if replica is not None:
+            try:
+                return query.get(replica)
+            except DoesNotExist:
+                pass
+        return query.get()
+    
     def get_email(self, email_id: int) -> Dict[str, Any]:
         """Get email details by ID"""
-        with db.atomic():
-            email = EmailMessage.get_by_id(email_id)
-            smtp_config = SmtpConfig.get_by_id(email.smtp_config_id)
+        query = EmailMessage.select_metadata().where(EmailMessage.id == email_id)
+        try:
+            email = self._read_one(query, email_id)
+        except DoesNotExist:
+            # Old emails may have been moved out by the retention job
+            email = self.archive.get(email_id) if self.archive else None
+            if email is None:
+                raise
+        smtp_config = smtp_config_cache.get(email.smtp_config_id)
+        
+        return {
+            'id': email.id,
+            'subject': email.subject,
+            'sender': smtp_config.email_address,
+            'sender_name': smtp_config.display_name,
+            'recipients': email.get_recipients_list(),
+            'cc': email.get_cc_list(),
+            'bcc': email.get_bcc_list(),
+            'status': email.status,
+            'priority': email.priority,
+            'campaign': email.campaign,
+            'retry_count': email.retry_count,
+            'smtp_config': smtp_config.name,
+            'created_at': email.created_at.isoformat(),
+            'updated_at': email.updated_at.isoformat(),
+            'sent_at': email.sent_at.isoformat() if email.sent_at else None,
+            'send_at': email.send_at.isoformat() if email.send_at else None,
+            'error_message': email.error_message,
+            'error_code': email.error_code
+        }
+    
+    def get_email_statuses(self, email_ids: List[int]) -> Dict[str, Any]:
+        """Get the delivery status of many emails with a single projected query"""
+        email_ids = list(dict.fromkeys(email_ids))  # Drop duplicates, keep order
+        
+        query = (
+            EmailMessage
+            .select(EmailMessage.id, EmailMessage.status, EmailMessage.priority,
+                    EmailMessage.retry_count, EmailMessage.smtp_config_id,
+                    EmailMessage.error_code, EmailMessage.error_message,
+                    EmailMessage.updated_at, EmailMessage.sent_at)
+            .where(EmailMessage.id.in_(email_ids))
+        )
+        
+        replica = db_router.replica_for(EmailMessage._meta.table_name, email_ids)
+        rows = {row['id']: row for row in query.dicts().iterator(replica)}
+        unseen = [email_id for email_id in email_ids if email_id not in rows]
+        if replica is not None and unseen:
+            # Rows the replica doesn't have yet may already be on the primary
+            rows.update((row['id'], row) for row in query.where(EmailMessage.id.in_(unseen)).dicts().iterator())
+        
+        # Config names come from the snapshot cache, one lookup per distinct config
+        config_names = {}
+        for config_id in {row['smtp_config_id'] for row in rows.values()}:
+            try:
+                config_names[config_id] = smtp_config_cache.get(config_id).name
+            except DoesNotExist:
+                config_names[config_id] = None
+        
+        emails = []
+        missing = []
+        for email_id in email_ids:
+            row = rows.get(email_id)
+            if row is None:
+                missing.append(email_id)
+                continue
             
-            return {
-                'id': email.id,
-                'subject': email.subject,
-                'sender': smtp_config.email_address,
-                'sender_name': smtp_config.display_name,
-                'recipients': email.get_recipients_list(),
-                'cc': email.get_cc_list(),
-                'bcc': email.get_bcc_list(),
-                'status': email.status,
-                'priority': email.priority,
-                'retry_count': email.retry_count,
-                'smtp_config': smtp_config.name,
-                'created_at': email.created_at.isoformat(),
-                'updated_at': email.updated_at.isoformat(),
-                'sent_at': email.sent_at.isoformat() if email.sent_at else None,
-                'error_message': email.error_message
-            }
-    
-    def get_emails_by_status(self, status: str, limit: int = 100) -> List[Dict[str, Any]]:
-        """Get emails by status"""
-        with db.atomic():
-            emails = EmailMessage.select().where(EmailMessage.status == status).limit(limit)
-            return [{
-                'id': email.id,
-                'subject': email.subject,
-                'status': email.status,
-                'priority': email.priority,
-                'retry_count': email.retry_count,
-                'created_at': email.created_at.isoformat()
-            } for email in emails]
-    
-    def _get_best_smtp_config(self, exclude_id=None) -> Optional[SmtpConfig]:
-        """Get the best available SMTP configuration, with sorting done in Python."""        
+            emails.append({
+                'id': row['id'],
+                'status': row['status'],
+                'priority': row['priority'],
+                'retry_count': row['retry_count'],
+                'smtp_config': config_names[row['smtp_config_id']],
+                'updated_at': row['updated_at'].isoformat(),
+                'sent_at': row['sent_at'].isoformat() if row['sent_at'] else None,
+                'error_code': row['error_code'],
+                'error_message': row['error_message']
+            })
+        
+        return {'emails': emails, 'missing': missing}
+    
+    def subscribe_status_events(self, email_ids: Optional[List[int]] = None, campaign: Optional[str] = None,
+                                smtp_config_id: Optional[int] = None, cursor: Optional[str] = None,
+                                buffer_size: int = 1000) -> Subscription:
+        """Subscribe to status transitions, optionally resuming after a cursor"""
+        return status_events.subscribe(
+            email_ids=email_ids, campaign=campaign, smtp_config_id=smtp_config_id,
+            cursor=cursor, buffer_size=buffer_size
+        )
+    
+    def get_emails_by_status(self, status: str, limit: int = 100, cursor: Optional[str] = None,
+                             smtp_config_id: Optional[int] = None, priority: Optional[int] = None,
+                             created_after: Optional[datetime] = None,
+                             created_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Get emails by status, oldest first, one keyset page at a time.
+        
+        Pass the cursor built from the last row of a page (see encode_cursor) to get the next one.
+        Only the listed columns are read, never the message body."""
         query = (
-            SmtpConfig
-            .select()
-            .where(
-                (SmtpConfig.active == True) &
-                (SmtpConfig.sent_count_today < SmtpConfig.daily_limit) &
-                (SmtpConfig.sent_count_hour < SmtpConfig.hourly_limit)
+            EmailMessage
+            .select(EmailMessage.id, EmailMessage.subject, EmailMessage.status,
+                    EmailMessage.priority, EmailMessage.retry_count, EmailMessage.created_at)
+            .where(EmailMessage.status == status)
+        )
+        
+        if cursor:
+            last_created_at, last_id = self.decode_cursor(cursor)
+            query = query.where(
+                (EmailMessage.created_at > last_created_at) |
+                ((EmailMessage.created_at == last_created_at) & (EmailMessage.id > last_id))
             )
+        if smtp_config_id is not None:
+            query = query.where(EmailMessage.smtp_config_id == smtp_config_id)
+        if priority is not None:
+            query = query.where(EmailMessage.priority == priority)
+        if created_after is not None:
+            query = query.where(EmailMessage.created_at >= created_after)
+        if created_before is not None:
+            query = query.where(EmailMessage.created_at < created_before)
+        
+        query = db_router.read(query.order_by(EmailMessage.created_at, EmailMessage.id).limit(limit))
+        
+        return [{
+            'id': row['id'],
+            'subject': row['subject'],
+            'status': row['status'],
+            'priority': row['priority'],
+            'retry_count': row['retry_count'],
+            'created_at': row['created_at'].isoformat()
+        } for row in query.dicts().iterator()]
+    
+    def get_emails_by_recipient(self, address: Optional[str] = None, domain: Optional[str] = None,
+                                limit: int = 100, cursor: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get the emails sent to an address or domain, newest first, with each recipient's delivery state.
+        
+        Pass the id of the last row of a page as cursor to get the next one."""
+        if (address is None) == (domain is None):
+            raise ValueError("Exactly one of address or domain is required")
+        
+        query = (
+            EmailRecipient
+            .select(EmailRecipient.id, EmailRecipient.email_id, EmailRecipient.kind,
+                    EmailRecipient.address, EmailRecipient.status, EmailRecipient.smtp_code,
+                    EmailRecipient.smtp_reply, EmailRecipient.updated_at,
+                    EmailMessage.subject, EmailMessage.status.alias('email_status'),
+                    EmailMessage.created_at)
+            .join(EmailMessage, on=(EmailRecipient.email_id == EmailMessage.id))
         )
-
-        if exclude_id is not None:
-            query = query.where(SmtpConfig.id != exclude_id)
-
-        try:            # Fetch all potential candidates
-            candidate_configs = list(query) # Execute the query and get a list            
-            if not candidate_configs:
-                return None
-
-            # Now, sort these candidates in Python
-            def calculate_utilization(config: SmtpConfig) -> float:
-                if config.daily_limit is not None and config.daily_limit != 0:
-                    # Ensure float division
-                    return float(config.sent_count_today) / float(config.daily_limit)
-                return 0.0 # If daily_limit is 0 or None, consider utilization as 0 (or a high number if you want to deprioritize them)
-
-            # Sort by utilization (lowest first)
-            # We also add a secondary sort key (e.g., id) to ensure stable sort if utilizations are equal
-            sorted_configs = sorted(candidate_configs, key=lambda cfg: (calculate_utilization(cfg), cfg.id))
-
-            return sorted_configs[0] # Return the one with the lowest utilization
-
-        except Exception as e: # Broader exception handling for unforeseen issues during fetch or sort
+        
+        if address is not None:
+            query = query.where(EmailRecipient.address == EmailRecipient.normalize(address)[0])
+        else:
+            query = query.where(EmailRecipient.domain == domain.strip().lower())
+        if cursor is not None:
+            query = query.where(EmailRecipient.id < cursor)
+        
+        query = db_router.read(query.order_by(EmailRecipient.id.desc()).limit(limit))
+        
+        return [{
+            'id': row['id'],
+            'email_id': row['email_id'],
+            'kind': row['kind'],
+            'address': row['address'],
+            'status': row['status'],
+            'smtp_code': row['smtp_code'],
+            'smtp_reply': row['smtp_reply'],
+            'updated_at': row['updated_at'].isoformat(),
+            'subject': row['subject'],
+            'email_status': row['email_status'],
+            'created_at': row['created_at'].isoformat()
+        } for row in query.dicts().iterator()]
+    
+    @staticmethod
+    def encode_cursor(created_at: str, email_id: int) -> str:
+        """Build an opaque pagination cursor from a row's ISO created_at and ID"""
+        raw = f"{created_at}|{email_id}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        """Parse a pagination cursor (ValueError if malformed)"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            created_at, email_id = raw.rsplit('|', 1)
+            return datetime.fromisoformat(created_at), int(email_id)
+        except (ValueError, UnicodeDecodeError, binascii.Error):
+            raise ValueError("Invalid cursor")
+    
+    def _get_best_smtp_config(self, exclude_id=None) -> Optional[RoutingEntry]:
+        """Get the best available SMTP configuration, ranked by expected completion time and utilization.
+        
+        Served from the in-memory selector heap instead of scanning the SmtpConfig table."""
+        try:
+            return smtp_selector.pick(exclude_id=exclude_id)
+        except Exception as e:
             logger.error(f"Error in _get_best_smtp_config: {e}")
             return None
     
@@ -262,55 +910,75 @@ class EmailService:
         """Create a new SMTP configuration"""
         with db.atomic():
             smtp_config = SmtpConfig.create(**kwargs)
-            return smtp_config.id
+        
+        smtp_config_cache.invalidate(smtp_config.id)
+        return smtp_config.id
     
     def update_smtp_config(self, config_id: int, **kwargs) -> bool:
-        """Update an SMTP configuration"""
+        """Update an SMTP configuration, writing only the edited columns"""
         try:
-            with db.atomic():
-                smtp_config = SmtpConfig.get_by_id(config_id)
-                
-                for key, value in kwargs.items():
-                    if hasattr(smtp_config, key):
-                        setattr(smtp_config, key, value)
-                
-                smtp_config.updated_at = datetime.now()
-                smtp_config.save()
-                return True
+            if not SmtpConfig.edit(config_id, **kwargs):
+                return False
+            
+            smtp_config_cache.invalidate(config_id)
+            return True
         except Exception:
             return False
     
     def get_smtp_config(self, config_id: int) -> Dict[str, Any]:
         """Get SMTP configuration details"""
-        with db.atomic():
-            config = SmtpConfig.get_by_id(config_id)
-            return {
-                'id': config.id,
-                'name': config.name,
-                'email_address': config.email_address,
-                'display_name': config.display_name,
-                'smtp_host': config.smtp_host,
-                'smtp_port': config.smtp_port,
-                'username': config.username,
-                'active': config.active,
-                'daily_limit': config.daily_limit,
-                'hourly_limit': config.hourly_limit,
-                'sent_count_today': config.sent_count_today,
-                'sent_count_hour': config.sent_count_hour,
-                'last_sent': config.last_sent.isoformat() if config.last_sent else None,
-                'created_at': config.created_at.isoformat()
-            }
+        config = self._read_one(SmtpConfig.select().where(SmtpConfig.id == config_id), config_id)
+        return {
+            'id': config.id,
+            'name': config.name,
+            'email_address': config.email_address,
+            'display_name': config.display_name,
+            'smtp_host': config.smtp_host,
+            'smtp_port': config.smtp_port,
+            'username': config.username,
+            'active': config.active,
+            'daily_limit': config.daily_limit,
+            'hourly_limit': config.hourly_limit,
+            'connect_timeout': config.connect_timeout,
+            'command_timeout': config.command_timeout,
+            'data_timeout': config.data_timeout,
+            'sent_count_today': config.sent_count_today,
+            'sent_count_hour': config.sent_count_hour,
+            'last_sent': config.last_sent.isoformat() if config.last_sent else None,
+            'created_at': config.created_at.isoformat()
+        }
+    
+    def get_delivery_stats(self, start: datetime, end: datetime, smtp_config_id: Optional[int] = None,
+                           granularity: str = 'day') -> Dict[str, Any]:
+        """Delivery counters and time-to-send percentiles from the hourly rollups"""
+        return delivery_stats.summary(start, end, smtp_config_id=smtp_config_id, granularity=granularity)
+    
+    def add_suppressions(self, entries: List[Dict[str, Any]]) -> int:
+        """Suppress addresses or domains, replacing the reason and expiry of ones already listed"""
+        return suppression_list.add_many(entries)
+    
+    def remove_suppression(self, address: str) -> bool:
+        """Lift the suppression of an address or domain"""
+        return suppression_list.remove(address)
+    
+    def get_suppression(self, address: str) -> Optional[Dict[str, Any]]:
+        """The suppression covering an address, if any"""
+        return suppression_list.get(address)
+    
+    def export_suppressions(self) -> Iterator[Dict[str, Any]]:
+        """Every active suppression"""
+        return suppression_list.export()
     
     def list_smtp_configs(self) -> List[Dict[str, Any]]:
         """List all SMTP configurations"""
-        with db.atomic():
-            configs = SmtpConfig.select()
-            return [{
-                'id': config.id,
-                'name': config.name,
-                'email_address': config.email_address,
-                'active': config.active,
-                'daily_limit': config.daily_limit,
-                'sent_count_today': config.sent_count_today,
-                'sent_count_hour': config.sent_count_hour
-            } for config in configs]
\ No newline at end of file
+        configs = db_router.read(SmtpConfig.select())
+        return [{
+            'id': config.id,
+            'name': config.name,
+            'email_address': config.email_address,
+            'active': config.active,
+            'daily_limit': config.daily_limit,
+            'sent_count_today': config.sent_count_today,
+            'sent_count_hour': config.sent_count_hour,
+            'routing': smtp_router.describe(config)
+        } for config in configs]
\ No newline at end of file
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, NamedTuple, Optional
+
+from models.email_model import IdempotencyKey
+
+logger = logging.getLogger('idempotency')
+
+# Expired keys deleted per purge statement
+PURGE_CHUNK_SIZE = 1000
+
+
+class IdempotencyKeyReusedError(ValueError):
+    """An idempotency key was sent again with a different request"""
+
+    def __init__(self, key: str):
+        self.key = key
+        super().__init__(f"Idempotency key {key!r} was already used for a different email")
+
+
+class StoredKey(NamedTuple):
+    email_id: int
+    fingerprint: str
+    created_at: datetime
+
+
+def request_fingerprint(params: Dict[str, Any]) -> str:
+    """SHA-256 of a request's parameters, independent of key order"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    """Idempotency keys of created emails, with the most recent ones cached in memory.
+
+    Keys live in the IdempotencyKey table under a unique index, inserted in the same
+    transaction as their email, so two concurrent requests with one key can't both
+    create an email. Keys found or written by this process are kept in an LRU of
+    max_entries, so a client retrying against the same process is answered without a
+    query. A key missing from the cache is not looked up before its insert: the unique
+    index rejects a used one, and only then is the table read. Keys are only cached
+    once committed and only ever expire, so the cache never contradicts the table.
+
+    Keys expire ttl seconds after they were first used; expired rows are deleted a
+    chunk at a time, at most once every purge_interval seconds.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400.0, purge_interval: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, StoredKey]" = OrderedDict()
+        self._next_purge = 0.0
+
+    def reset(self):
+        """Forget the cached keys"""
+        with self._lock:
+            self._entries.clear()
+            self._next_purge = 0.0
+
+    def _expired(self, stored: StoredKey) -> bool:
+        return stored.created_at < datetime.now() - timedelta(seconds=self.ttl)
+
+    def _remember(self, key: str, stored: StoredKey):
+        with self._lock:
+            self._entries[key] = stored
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def cached(self, key: str) -> Optional[StoredKey]:
+        """The email created with a key if this process knows it, without a query"""
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is None:
+                return None
+            if self._expired(stored):
+                # The insert finds the row and lookup deletes it
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return stored
+
+    def lookup(self, key: str) -> Optional[StoredKey]:
+        """The email created with a key, from the cache or the table, or None if the key is unused or expired"""
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is not None:
+                self._entries.move_to_end(key)
+        if stored is None:
+            row = (IdempotencyKey
+                   .select(IdempotencyKey.email_id, IdempotencyKey.fingerprint, IdempotencyKey.created_at)
+                   .where(IdempotencyKey.key == key)
+                   .tuples()
+                   .first())
+            if row is None:
+                return None
+            stored = StoredKey(*row)
+            self._remember(key, stored)
+
+        if self._expired(stored):
+            # Make room for the key to be used again
+            with self._lock:
+                self._entries.pop(key, None)
+            IdempotencyKey.delete().where(
+                (IdempotencyKey.key == key) & (IdempotencyKey.created_at == stored.created_at)
+            ).execute()
+            return None
+        return stored
+
+    def insert(self, key: str, email_id: int, fingerprint: str) -> StoredKey:
+        """Store a key inside the email's transaction; raises IntegrityError if another request took it first"""
+        stored = StoredKey(email_id, fingerprint, datetime.now())
+        IdempotencyKey.insert(key=key, email_id=email_id, fingerprint=fingerprint,
+                              created_at=stored.created_at).execute()
+        return stored
+
+    def committed(self, key: str, stored: StoredKey):
+        """Cache a key once its transaction committed, and purge expired keys when due"""
+        self._remember(key, stored)
+        self.purge_expired()
+
+    def purge_expired(self, force: bool = False) -> int:
+        """Delete one chunk of expired keys, at most once every purge_interval unless forced"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now < self._next_purge:
+                return 0
+            self._next_purge = now + self.purge_interval
+
+        cutoff = datetime.now() - timedelta(seconds=self.ttl)
+        try:
+            ids = [row.id for row in IdempotencyKey
+                   .select(IdempotencyKey.id)
+                   .where(IdempotencyKey.created_at < cutoff)
+                   .limit(PURGE_CHUNK_SIZE)]
+            if not ids:
+                return 0
+            return IdempotencyKey.delete().where(IdempotencyKey.id.in_(ids)).execute()
+        except Exception as e:
+            logger.error(f"Error purging expired idempotency keys: {str(e)}")
+            return 0
+
+
+# Shared by the whole process; sized by create_app (see IDEMPOTENCY_*)
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from models.email_model import ThreadConnection
+
+logger = logging.getLogger('ingest_writer')
+
+
+class _PendingRow:
+    """A row handed to the writer, with the means to wake up its request thread"""
+    __slots__ = ('row', 'done', 'email_id', 'error')
+
+    def __init__(self, row: Dict[str, Any]):
+        self.row = row
+        self.done = threading.Event()
+        self.email_id: Optional[int] = None
+        self.error: Optional[Exception] = None
+
+
+class IngestWriter:
+    """Group-commit writer for new email rows.
+
+    Request threads call submit(), which blocks until the row is committed. A single
+    writer thread collects rows for at most max_delay seconds or until batch_size rows
+    are waiting, inserts them all in one transaction, and then wakes every waiting
+    request with its email ID. Many requests thereby share one commit (and one fsync)
+    while each still only returns once its row is durable. A batch that fails is split
+    in halves and committed again, so only the requests whose rows fail get the error.
+    """
+
+    def __init__(self, insert_rows: Callable[[List[Dict[str, Any]]], List[int]],
+                 on_committed: Optional[Callable[[List[Dict[str, Any]], List[int]], None]] = None,
+                 batch_size: int = 200, max_delay: float = 0.005, submit_timeout: float = 30.0):
+        self.insert_rows = insert_rows  # Inserts rows in one transaction and returns their IDs
+        self.on_committed = on_committed  # Called with the rows and IDs after each commit
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.submit_timeout = submit_timeout
+        self.queue: "queue.Queue[_PendingRow]" = queue.Queue()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the writer thread"""
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self._writer_process)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Ingest writer started (batch size {self.batch_size}, max delay {self.max_delay * 1000:.1f}ms)")
+
+    def stop(self):
+        """Stop the writer thread after committing what is already waiting"""
+        self.running = False
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        self.thread = None
+        logger.info("Ingest writer stopped")
+
+    def submit(self, row: Dict[str, Any]) -> int:
+        """Hand a row to the writer and block until it is committed, returning its ID"""
+        if not self.running:
+            raise RuntimeError("Ingest writer is not running")
+
+        pending = _PendingRow(row)
+        self.queue.put(pending)
+
+        if not pending.done.wait(self.submit_timeout):
+            raise TimeoutError("Timed out waiting for the email to be stored")
+        if pending.error is not None:
+            raise pending.error
+        return pending.email_id
+
+    def _collect(self) -> List[_PendingRow]:
+        """Wait for a first row, then gather more until the batch is full or the delay is over"""
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _writer_process(self):
+        """Writer loop committing one batch per iteration"""
+        with ThreadConnection() as connection:
+            while self.running or not self.queue.empty():
+                batch = self._collect()
+                if batch:
+                    connection.refresh()
+                    self._commit(batch)
+
+    def _commit(self, batch: List[_PendingRow]):
+        """Insert a batch and wake its request threads"""
+        rows = [pending.row for pending in batch]
+        try:
+            email_ids = self.insert_rows(rows)
+        except Exception as e:
+            if len(batch) > 1:
+                # Find the bad rows so the other requests in the batch still get their email
+                logger.warning(f"Error committing {len(batch)} emails, retrying in halves: {str(e)}")
+                middle = len(batch) // 2
+                self._commit(batch[:middle])
+                self._commit(batch[middle:])
+                return
+            logger.error(f"Error committing an email: {str(e)}")
+            for pending in batch:
+                pending.error = e
+                pending.done.set()
+            return
+
+        if self.on_committed:
+            try:
+                self.on_committed(rows, email_ids)
+            except Exception as e:
+                logger.error(f"Error after committing {len(batch)} emails: {str(e)}")
+
+        for pending, email_id in zip(batch, email_ids):
+            pending.email_id = email_id
+            pending.done.set()
@@ -1,9 +1,12 @@
 import queue
 import threading
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 
+from models.email_model import ThreadConnection
+from utils.indexed_heap import IndexedHeap
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -11,16 +14,70 @@ logging.basicConfig(
 )
 logger = logging.getLogger('queue_service')
 
+class IndexedPriorityQueue(queue.PriorityQueue):
+    """PriorityQueue of (priority, email_id) pairs that can also drop an email or change its priority.
+    
+    Entries are kept in an IndexedHeap keyed by email id, so both take O(log n) instead of
+    a scan. An email is held at most once: putting it again keeps the higher priority.
+    """
+    
+    def _init(self, maxsize):
+        self.queue = IndexedHeap()  # email id -> (priority, email id)
+    
+    def _qsize(self):
+        return len(self.queue)
+    
+    def _put(self, item):
+        priority, email_id = item
+        if email_id in self.queue:
+            if item < self.queue.priority(email_id):
+                self.queue.push(email_id, item)
+            self.unfinished_tasks -= 1  # put() counts it again
+            return
+        self.queue.push(email_id, item)
+    
+    def _get(self):
+        return self.queue.pop()[1]
+    
+    def remove(self, email_id: int) -> bool:
+        """Drop an email, returning False if it isn't waiting in the queue"""
+        with self.mutex:
+            if email_id not in self.queue:
+                return False
+            self.queue.remove(email_id)
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks == 0:
+                self.all_tasks_done.notify_all()
+            self.not_full.notify()
+            return True
+    
+    def reprioritize(self, email_id: int, priority: int) -> bool:
+        """Change the priority of a waiting email, returning False if it isn't in the queue"""
+        with self.mutex:
+            if email_id not in self.queue:
+                return False
+            self.queue.push(email_id, (priority, email_id))
+            return True
+
 class EmailQueue:
     """Email queue manager for congestion control"""
     
-    def __init__(self, worker_count=2, max_retries=3):
-        self.queue = queue.PriorityQueue()
+    def __init__(self, worker_count=2, max_retries=3, send_deadline=None, watchdog_interval=5.0):
+        self.queue = IndexedPriorityQueue()
         self.worker_count = worker_count
         self.max_retries = max_retries
+        self.send_deadline = send_deadline  # Seconds before a send is considered hung (None disables the watchdog)
+        self.watchdog_interval = watchdog_interval
         self.workers = []
+        self.watchdog = None
         self.running = False
         self.email_service = None  # Will be set after initialization
+        
+        # Watchdog bookkeeping: current attempt and thread generation per worker slot
+        self._lock = threading.Lock()
+        self._in_flight: Dict[int, Tuple[int, int, float]] = {}
+        self._generations: Dict[int, int] = {}
+        self._requeued: set = set()  # (worker id, generation) of abandoned attempts whose email was queued again
     
     def set_email_service(self, email_service):
         """Set the email service to use for sending emails"""
@@ -31,6 +88,26 @@ class EmailQueue:
         self.queue.put((priority, email_id))
         logger.info(f"Email {email_id} added to queue with priority {priority}")
     
+    def enqueue_many(self, items: List[Tuple[int, int]]):
+        """Add several (email_id, priority) pairs to the queue"""
+        for email_id, priority in items:
+            self.queue.put((priority, email_id))
+        logger.info(f"{len(items)} emails added to queue")
+    
+    def cancel(self, email_id: int) -> bool:
+        """Take an email out of the queue, returning False if it isn't waiting in it"""
+        removed = self.queue.remove(email_id)
+        if removed:
+            logger.info(f"Email {email_id} removed from queue")
+        return removed
+    
+    def reprioritize(self, email_id: int, priority: int) -> bool:
+        """Move a waiting email to another priority, returning False if it isn't in the queue"""
+        moved = self.queue.reprioritize(email_id, priority)
+        if moved:
+            logger.info(f"Email {email_id} moved to priority {priority}")
+        return moved
+    
     def start_workers(self):
         """Start worker threads to process the queue"""
         if self.running:
@@ -42,12 +119,26 @@ class EmailQueue:
         self.running = True
         
         for i in range(self.worker_count):
-            worker = threading.Thread(target=self._worker_process, args=(i,))
-            worker.daemon = True
-            worker.start()
-            self.workers.append(worker)
+            self._spawn_worker(i)
             
         logger.info(f"Started {self.worker_count} worker threads")
+        
+        if self.send_deadline:
+            self.watchdog = threading.Thread(target=self._watchdog_process)
+            self.watchdog.daemon = True
+            self.watchdog.start()
+            logger.info(f"Started watchdog with a {self.send_deadline}s send deadline")
+    
+    def _spawn_worker(self, worker_id: int):
+        """Start a worker thread for the given slot, replacing any previous one"""
+        worker = threading.Thread(target=self._worker_process, args=(worker_id,))
+        worker.daemon = True
+        worker.start()
+        
+        if worker_id < len(self.workers):
+            self.workers[worker_id] = worker
+        else:
+            self.workers.append(worker)
     
     def stop_workers(self):
         """Stop all worker threads"""
@@ -57,12 +148,21 @@ class EmailQueue:
             if worker.is_alive():
                 worker.join(timeout=5.0)
         self.workers = []
+        self.watchdog = None
         logger.info("All worker threads stopped")
     
     def _worker_process(self, worker_id: int):
         """Worker process to send emails from the queue"""
+        generation = self._generations.get(worker_id, 0)
         logger.info(f"Worker {worker_id} started")
         
+        with ThreadConnection() as connection:
+            self._work(worker_id, generation, connection)
+        
+        logger.info(f"Worker {worker_id} stopped")
+    
+    def _work(self, worker_id: int, generation: int, connection: ThreadConnection):
+        """Take emails off the queue until the workers are stopped or this one is abandoned"""
         while self.running:
             try:
                 # Get email from queue with 1-second timeout
@@ -71,10 +171,29 @@ class EmailQueue:
                 except queue.Empty:
                     continue
                 
+                # Keep this thread's connection, unless it sat idle long enough to have gone stale
+                connection.refresh()
+                
                 logger.info(f"Worker {worker_id} processing email {email_id} (priority: {priority})")
                 
                 # Process the email
-                success = self.email_service.process_queued_email(email_id)
+                with self._lock:
+                    self._in_flight[worker_id] = (email_id, priority, time.monotonic())
+                try:
+                    success = self.email_service.process_queued_email(email_id)
+                finally:
+                    abandoned = self._finish_attempt(worker_id, generation)
+                
+                if abandoned:
+                    # The watchdog replaced this worker; unless it also requeued the email, finish the attempt here
+                    with self._lock:
+                        requeued = (worker_id, generation) in self._requeued
+                        self._requeued.discard((worker_id, generation))
+                    logger.warning(f"Worker {worker_id} was abandoned while sending email {email_id}, exiting")
+                    if not success and not requeued:
+                        self.email_service.handle_failed_email(email_id, self.max_retries)
+                    self.queue.task_done()
+                    return
                 
                 if not success:
                     # If failed, check retry count and possibly requeue
@@ -87,5 +206,50 @@ class EmailQueue:
                 logger.error(f"Worker {worker_id} encountered an error: {str(e)}")
                 # Sleep a bit before continuing to prevent tight loops on errors
                 time.sleep(1)
+    
+    def _finish_attempt(self, worker_id: int, generation: int) -> bool:
+        """Clear the in-flight record of a worker, returning True if it was abandoned"""
+        with self._lock:
+            if self._generations.get(worker_id, 0) != generation:
+                return True
+            self._in_flight.pop(worker_id, None)
+            return False
+    
+    def _watchdog_process(self):
+        """Watchdog loop that recovers workers stuck past the send deadline"""
+        while self.running:
+            time.sleep(self.watchdog_interval)
+            try:
+                self.check_stuck_workers()
+            except Exception as e:
+                logger.error(f"Watchdog encountered an error: {str(e)}")
+    
+    def check_stuck_workers(self) -> int:
+        """Abandon attempts running past the send deadline, requeue them and replace their workers"""
+        if not self.send_deadline:
+            return 0
+        
+        now = time.monotonic()
+        stuck = []
+        with self._lock:
+            for worker_id, (email_id, priority, started_at) in list(self._in_flight.items()):
+                if now - started_at > self.send_deadline:
+                    # Bump the generation so the stuck thread exits once it unblocks
+                    del self._in_flight[worker_id]
+                    generation = self._generations.get(worker_id, 0)
+                    self._generations[worker_id] = generation + 1
+                    stuck.append((worker_id, generation, email_id, priority))
+        
+        for worker_id, generation, email_id, priority in stuck:
+            logger.warning(f"Worker {worker_id} stuck on email {email_id} for over {self.send_deadline}s, replacing it")
+            # Only a closed connection guarantees the stuck attempt can't deliver the email as well
+            if self.email_service.abort_send(email_id):
+                with self._lock:
+                    self._requeued.add((worker_id, generation))
+                self.enqueue(email_id, priority)
+            else:
+                logger.warning(f"Email {email_id} left to its stuck worker, which holds no SMTP connection")
+            if self.running:
+                self._spawn_worker(worker_id)
         
-        logger.info(f"Worker {worker_id} stopped")
\ No newline at end of file
+        return len(stuck)
@@ -0,0 +1,281 @@
+import gzip
+import json
+import os
+import threading
+import logging
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from peewee import MySQLDatabase, Database
+
+from models.email_model import EmailMessage, ContentBlob, EmailRecipient, ArchivedEmail, db
+
+logger = logging.getLogger('retention')
+
+# Only emails in these states are ever archived
+TERMINAL_STATUSES = ('sent', 'failed', 'cancelled')
+
+# Name of the MySQL advisory lock that keeps several processes from archiving at once
+RETENTION_LOCK = 'mailerservice_retention'
+
+DATETIME_FIELDS = ('created_at', 'updated_at', 'sent_at', 'send_at')
+
+
+@contextmanager
+def retention_lock(database: Database):
+    """Yield whether this process may archive now (MySQL advisory lock, always granted elsewhere)"""
+    if not isinstance(database, MySQLDatabase):
+        yield True
+        return
+
+    acquired = database.execute_sql("SELECT GET_LOCK(%s, 0)", (RETENTION_LOCK,)).fetchone()[0]
+    try:
+        yield bool(acquired)
+    finally:
+        if acquired:
+            database.execute_sql("SELECT RELEASE_LOCK(%s)", (RETENTION_LOCK,))
+
+
+def _lock_rows(email_ids: List[int]):
+    """Select the full rows of the given emails that are still terminal, locking them on MySQL"""
+    query = EmailMessage.select().where(
+        EmailMessage.id.in_(email_ids) & EmailMessage.status.in_(TERMINAL_STATUSES)
+    )
+    if isinstance(EmailMessage._meta.database, MySQLDatabase):
+        # A retry may requeue a failed email between picking and moving it
+        query = query.for_update()
+    return list(query.dicts())
+
+
+class TableArchive:
+    """Moves emails into the ArchivedEmail table.
+
+    Rows keep their content hash, so their bodies stay in ContentBlob, and their
+    EmailRecipient rows stay where they are.
+    """
+
+    def archive(self, email_ids: List[int]) -> int:
+        """Move the given emails in one transaction and return how many were moved"""
+        now = datetime.now()
+        with db.atomic():
+            rows = _lock_rows(email_ids)
+            if not rows:
+                return 0
+            for row in rows:
+                row['archived_at'] = now
+
+            # Ignore rows a crashed earlier run already copied
+            ArchivedEmail.insert_many(rows).on_conflict_ignore().execute()
+            EmailMessage.delete().where(EmailMessage.id.in_([row['id'] for row in rows])).execute()
+        return len(rows)
+
+    def get(self, email_id: int) -> Optional[EmailMessage]:
+        archived = ArchivedEmail.get_or_none(ArchivedEmail.id == email_id)
+        return archived.to_email() if archived else None
+
+
+class FileArchive:
+    """Moves emails into gzip-compressed NDJSON files, one per day of creation.
+
+    Each batch is appended to its day's file as a separate gzip member, which gzip
+    readers treat as one stream, and flushed to disk before the rows are deleted. A
+    record holds the row with its body and per-recipient delivery state inlined, so
+    the email's ContentBlob reference and EmailRecipient rows are released. A crash
+    between writing and deleting archives the batch again on the next run; readers
+    take the first copy.
+
+    manifest.json keeps the lowest and highest email ID of each file, so a lookup
+    only decompresses the files that can hold the ID.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _read_manifest(self) -> Dict[str, List[int]]:
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_manifest(self, manifest: Dict[str, List[int]]):
+        path = os.path.join(self.directory, self.MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _to_record(row: Dict[str, Any], body: str, deliveries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        record = {'id': row['id']}  # First, so lookups can skip other lines without parsing them
+        for name, value in row.items():
+            if name in ('id', 'html_body', 'content_hash'):
+                continue
+            record[name] = value.isoformat() if isinstance(value, datetime) else value
+        record['html_content'] = body
+        record['deliveries'] = deliveries
+        return record
+
+    @staticmethod
+    def _from_record(record: Dict[str, Any]) -> EmailMessage:
+        fields = {name: record.get(name) for name in EmailMessage._meta.fields if name in record}
+        for name in DATETIME_FIELDS:
+            if fields.get(name):
+                fields[name] = datetime.fromisoformat(fields[name])
+        fields['html_body'] = record.get('html_content', '')
+        return EmailMessage(**fields)
+
+    def archive(self, email_ids: List[int]) -> int:
+        """Write the given emails to their day files, then delete them, and return how many were moved"""
+        with db.atomic():
+            rows = _lock_rows(email_ids)
+            if not rows:
+                return 0
+            ids = [row['id'] for row in rows]
+
+            hashes = list({row['content_hash'] for row in rows if row['content_hash']})
+            bodies = {
+                blob.hash: zlib.decompress(blob.data).decode('utf-8')
+                for blob in ContentBlob.select(ContentBlob.hash, ContentBlob.data).where(ContentBlob.hash.in_(hashes))
+            } if hashes else {}
+
+            deliveries = defaultdict(list)
+            for recipient in (EmailRecipient
+                              .select(EmailRecipient.email_id, EmailRecipient.kind, EmailRecipient.address,
+                                      EmailRecipient.status, EmailRecipient.smtp_code, EmailRecipient.smtp_reply)
+                              .where(EmailRecipient.email_id.in_(ids)).dicts()):
+                deliveries[recipient.pop('email_id')].append(recipient)
+
+            days = defaultdict(list)
+            for row in rows:
+                body = bodies.get(row['content_hash'], '') if row['content_hash'] else row['html_body']
+                days[row['created_at'].strftime('%Y-%m-%d')].append(
+                    self._to_record(row, body, deliveries[row['id']])
+                )
+            self._append(days)
+
+            EmailRecipient.delete().where(EmailRecipient.email_id.in_(ids)).execute()
+            EmailMessage.delete().where(EmailMessage.id.in_(ids)).execute()
+            ContentBlob.release([row['content_hash'] for row in rows if row['content_hash']])
+        return len(rows)
+
+    def _append(self, days: Dict[str, List[Dict[str, Any]]]):
+        """Append one gzip member per day file and record the files' ID ranges"""
+        with self._lock:
+            manifest = self._read_manifest()
+            for day, records in days.items():
+                name = f'emails-{day}.ndjson.gz'
+                data = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+                with open(os.path.join(self.directory, name), 'ab') as f:
+                    f.write(gzip.compress(data))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                low, high = manifest.get(name, [None, None])
+                ids = [record['id'] for record in records]
+                manifest[name] = [min(ids + ([low] if low is not None else [])),
+                                  max(ids + ([high] if high is not None else []))]
+            self._write_manifest(manifest)
+
+    def get(self, email_id: int) -> Optional[EmailMessage]:
+        prefix = f'{{"id": {email_id},'
+        for name, (low, high) in sorted(self._read_manifest().items()):
+            if not low <= email_id <= high:
+                continue
+            with gzip.open(os.path.join(self.directory, name), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith(prefix):
+                        return self._from_record(json.loads(line))
+        return None
+
+
+class RetentionJob:
+    """Background job moving old sent and failed emails out of EmailMessage.
+
+    Every interval seconds it archives emails that reached a terminal state more than
+    max_age_days ago, batch_size at a time. Each batch is its own short transaction
+    that only locks the rows it moves, and the job sleeps batch_pause seconds between
+    batches so the queue workers and the API keep the table to themselves most of the
+    time. Only one process archives at a time.
+    """
+
+    def __init__(self, archive, max_age_days: int = 90, batch_size: int = 500,
+                 batch_pause: float = 0.2, interval: float = 3600.0):
+        self.archive = archive  # TableArchive or FileArchive
+        self.max_age_days = max_age_days
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self._stopped = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the retention thread"""
+        if self.running:
+            return
+
+        self.running = True
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._retention_process)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Retention job started (archiving after {self.max_age_days} days)")
+
+    def stop(self):
+        """Stop the retention thread, finishing the batch in progress"""
+        self.running = False
+        self._stopped.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        self.thread = None
+        logger.info("Retention job stopped")
+
+    def _retention_process(self):
+        """Retention loop running one pass per interval"""
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Retention job encountered an error: {str(e)}")
+            finally:
+                db.close()
+
+    def run_once(self, now: Optional[datetime] = None, max_batches: Optional[int] = None) -> int:
+        """Archive everything that is due, optionally stopping after max_batches, and return the count"""
+        cutoff = (now or datetime.now()) - timedelta(days=self.max_age_days)
+        archived = 0
+        batches = 0
+
+        with retention_lock(EmailMessage._meta.database) as acquired:
+            if not acquired:
+                logger.info("Another process is archiving, skipping this run")
+                return 0
+
+            while max_batches is None or batches < max_batches:
+                # Served by the (status, created_at) index; updated_at skips emails still retried lately
+                email_ids = [row.id for row in EmailMessage
+                             .select(EmailMessage.id)
+                             .where(EmailMessage.status.in_(TERMINAL_STATUSES) &
+                                    (EmailMessage.created_at < cutoff) &
+                                    (EmailMessage.updated_at < cutoff))
+                             .limit(self.batch_size)]
+                if not email_ids:
+                    break
+
+                archived += self.archive.archive(email_ids)
+                batches += 1
+                if len(email_ids) < self.batch_size or self._stopped.wait(self.batch_pause):
+                    break
+
+        if archived:
+            logger.info(f"Archived {archived} emails older than {cutoff.isoformat()}")
+        return archived
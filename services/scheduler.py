@@ -0,0 +1,170 @@
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from models.email_model import EmailMessage, ThreadConnection, db, notify_status_listeners
+from utils.indexed_heap import IndexedHeap
+
+logger = logging.getLogger('scheduler')
+
+
+class EmailScheduler:
+    """Moves scheduled emails to the send queue when their send_at comes.
+
+    Scheduled emails stay in the database with status 'scheduled'. Only those due
+    within the next window seconds are held in memory, in a heap ordered by send_at,
+    read with the (status, send_at) index every window / 2 seconds. At most
+    max_loaded are held; when the window holds more, it is shortened to the last one
+    loaded and read again once half of them went out. Emails created for the current
+    window are added to the heap as they are created.
+
+    Due emails are switched to 'queued' batch_size at a time, each with its own
+    conditional UPDATE, and only the ones this scheduler moved are queued, so an email
+    is released once even with schedulers in several processes. Emails released but
+    not sent before a restart are queued again by EmailService.recover_queued; emails
+    not released yet are simply read again.
+    """
+
+    def __init__(self, queue_service=None, window: float = 300.0, max_loaded: int = 10000, batch_size: int = 500):
+        self.queue_service = queue_service
+        self.window = window
+        self.max_loaded = max_loaded
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._heap = IndexedHeap()  # email id -> (send_at, id)
+        self._horizon: Optional[datetime] = None  # Every scheduled email due before this is in the heap
+        self._limited = False  # The last read stopped at max_loaded
+        self._next_load = 0.0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self._scheduler_process)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Scheduler started (window {self.window}s)")
+
+    def stop(self):
+        """Stop the scheduler thread"""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        self.thread = None
+        logger.info("Scheduler stopped")
+
+    def schedule(self, email_id: int, send_at: datetime):
+        """Hold a just committed scheduled email in memory if it falls in the loaded window"""
+        with self._cond:
+            if self._horizon is not None and send_at < self._horizon:
+                self._heap.push(email_id, (send_at, email_id))
+                self._cond.notify_all()
+
+    def cancel(self, email_id: int) -> bool:
+        """Forget a scheduled email that was cancelled, returning False if it wasn't held in memory"""
+        with self._cond:
+            if email_id not in self._heap:
+                return False
+            self._heap.remove(email_id)
+            return True
+
+    def load(self, now: Optional[datetime] = None) -> int:
+        """Read the scheduled emails due within the window into the heap and return how many were read"""
+        now = now or datetime.now()
+        horizon = now + timedelta(seconds=self.window)
+        rows = list(EmailMessage
+                    .select(EmailMessage.id, EmailMessage.send_at)
+                    .where((EmailMessage.status == 'scheduled') & (EmailMessage.send_at < horizon))
+                    .order_by(EmailMessage.send_at, EmailMessage.id)
+                    .limit(self.max_loaded)
+                    .tuples())
+
+        with self._cond:
+            self._limited = len(rows) >= self.max_loaded
+            if self._limited:
+                # Later emails with the same send_at as the last one are read next time
+                horizon = rows[-1][1]
+            for email_id, send_at in rows:
+                self._heap.push(email_id, (send_at, email_id))
+            self._horizon = horizon
+            self._next_load = time.monotonic() + self.window / 2
+            self._cond.notify_all()
+        return len(rows)
+
+    def _load_due(self) -> bool:
+        with self._cond:
+            return (time.monotonic() >= self._next_load or
+                    (self._limited and len(self._heap) <= self.max_loaded // 2))
+
+    def release_due(self, now: Optional[datetime] = None) -> int:
+        """Queue up to batch_size emails whose send_at has come and return how many were taken from the heap"""
+        now = now or datetime.now()
+        due: List[int] = []
+        with self._cond:
+            while len(due) < self.batch_size:
+                top = self._heap.peek()
+                if top is None or top[1][0] > now:
+                    break
+                self._heap.pop()
+                due.append(top[0])
+        if not due:
+            return 0
+
+        # If this fails the emails are still scheduled, and the next read puts them back in the heap
+        with db.atomic():
+            candidates = list(EmailMessage.select_metadata().where(
+                EmailMessage.id.in_(due) & (EmailMessage.status == 'scheduled')
+            ))
+            # Another process's scheduler may be releasing the same emails: keep only those this one moved
+            emails = [email for email in candidates
+                      if EmailMessage.switch_status(email.id, ('scheduled',), 'queued')]
+
+        for email in emails:
+            email.status = 'queued'
+            try:
+                notify_status_listeners(email)
+            except Exception as e:
+                logger.error(f"Error notifying status listeners for email {email.id}: {str(e)}")
+
+        if emails and self.queue_service:
+            self.queue_service.enqueue_many([(email.id, email.priority) for email in emails])
+        if emails:
+            logger.info(f"Released {len(emails)} scheduled emails")
+        return len(due)
+
+    def _seconds_to_next(self) -> float:
+        """Time until the next email is due or the next read, whichever is first; the caller holds the lock"""
+        wait = self._next_load - time.monotonic()
+        top = self._heap.peek()
+        if top is not None:
+            wait = min(wait, (top[1][0] - datetime.now()).total_seconds())
+        return max(0.0, wait)
+
+    def _scheduler_process(self):
+        """Scheduler loop"""
+        with ThreadConnection() as connection:
+            while self.running:
+                connection.refresh()
+                try:
+                    if self._load_due():
+                        self.load()
+                    while self.release_due() == self.batch_size:
+                        pass
+                except Exception as e:
+                    logger.error(f"Scheduler encountered an error: {str(e)}")
+                    # Emails taken from the heap may not have been released, read them again
+                    with self._cond:
+                        self._next_load = 0.0
+                    time.sleep(1)
+
+                with self._cond:
+                    if self.running:
+                        self._cond.wait(timeout=self._seconds_to_next())
@@ -0,0 +1,131 @@
+import smtplib
+import socket
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# Failure categories
+TRANSIENT = 'transient'  # 4xx reply, the same message may succeed later
+PERMANENT = 'permanent'  # 5xx reply, retrying the same message cannot succeed
+NETWORK = 'network'  # Connection refused, dropped or timed out
+AUTH = 'auth'  # Credentials rejected, another SMTP account may still work
+RECIPIENT = 'recipient'  # Recipients refused by the server
+UNKNOWN = 'unknown'  # Anything else, retried like before
+SUPPRESSED = 'suppressed'  # Every recipient is on the suppression list, nothing was sent
+
+# Recipient replies meaning the mailbox does not exist: unavailable, not local, bad mailbox name
+HARD_BOUNCE_CODES = (550, 551, 553)
+
+
+class SmtpFailure(NamedTuple):
+    """Structured description of a failed send attempt"""
+    category: str
+    code: Optional[int]
+    message: str
+
+    @property
+    def error_code(self) -> str:
+        """Compact code stored on the email, e.g. 'permanent.550' or 'network'"""
+        if self.code is None:
+            return self.category
+        return f"{self.category}.{self.code}"
+
+    @property
+    def retryable(self) -> bool:
+        """Whether retrying could ever succeed"""
+        return is_retryable(self.error_code)
+
+
+def parse_error_code(error_code: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+    """Split a stored error code into its category and SMTP reply code"""
+    if not error_code:
+        return None, None
+
+    category, _, code = error_code.partition('.')
+    return category, int(code) if code.isdigit() else None
+
+
+def is_retryable(error_code: Optional[str]) -> bool:
+    """Decide whether an email that failed with this error code should be retried"""
+    category, code = parse_error_code(error_code)
+
+    # Emails without a classification keep the old retry behaviour
+    if category is None or category in (TRANSIENT, NETWORK, UNKNOWN, AUTH):
+        return True
+
+    if category == RECIPIENT:
+        return code is not None and code < 500
+
+    return False
+
+
+def requires_other_config(error_code: Optional[str]) -> bool:
+    """Whether a retry only makes sense through a different SMTP configuration"""
+    category, _ = parse_error_code(error_code)
+    return category == AUTH
+
+
+def is_relay_failure(error_code: Optional[str]) -> bool:
+    """Whether the failure says something about the SMTP server rather than the message"""
+    category, _ = parse_error_code(error_code)
+    return category in (TRANSIENT, NETWORK, AUTH)
+
+
+def is_hard_bounce(code: Optional[int]) -> bool:
+    """Whether a recipient refusal means the address will never accept mail"""
+    return code in HARD_BOUNCE_CODES
+
+
+def _from_reply(code: int, message: str) -> SmtpFailure:
+    """Classify a plain SMTP reply code"""
+    if 400 <= code < 500:
+        return SmtpFailure(TRANSIENT, code, message)
+    if code >= 500:
+        return SmtpFailure(PERMANENT, code, message)
+    return SmtpFailure(UNKNOWN, code, message)
+
+
+def _decode(reply) -> str:
+    """Turn an SMTP reply text into a string"""
+    if isinstance(reply, bytes):
+        return reply.decode('utf-8', errors='replace')
+    return str(reply)
+
+
+def classify_refusals(refused: Dict[str, Tuple[int, bytes]]) -> Optional[SmtpFailure]:
+    """Classify per-recipient refusals as returned by sendmail or SMTPRecipientsRefused"""
+    if not refused:
+        return None
+
+    codes = [code for code, _ in refused.values()]
+    # One transient refusal is enough to make the message worth retrying
+    transient = [code for code in codes if 400 <= code < 500]
+    code = transient[0] if transient else max(codes)
+
+    details = '; '.join(
+        f"{address}: {code} {_decode(reply)}" for address, (code, reply) in refused.items()
+    )
+    return SmtpFailure(RECIPIENT, code, f"Refused recipients: {details}")
+
+
+def classify_exception(error: Exception) -> SmtpFailure:
+    """Classify an exception raised while sending"""
+    message = str(error)
+
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return SmtpFailure(AUTH, error.smtp_code, message)
+
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return classify_refusals(error.recipients) or SmtpFailure(RECIPIENT, None, message)
+
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return SmtpFailure(NETWORK, None, message)
+
+    if isinstance(error, smtplib.SMTPResponseException):
+        return _from_reply(error.smtp_code, message)
+
+    if isinstance(error, smtplib.SMTPNotSupportedError):
+        return SmtpFailure(PERMANENT, None, message)
+
+    if isinstance(error, (socket.timeout, OSError)):
+        return SmtpFailure(NETWORK, None, message)
+
+    return SmtpFailure(UNKNOWN, None, message)
@@ -0,0 +1,102 @@
+import threading
+from typing import Dict, Any, Optional
+
+
+class SmtpRouter:
+    """Tracks how fast and how reliable each SMTP configuration is and scores them for routing.
+
+    Latency and failure rate are exponentially weighted moving averages (EWMA) of the
+    observed send attempts, kept in memory per process. Latency is only taken from
+    successful sends, since failures are often quick refusals; each failure is charged
+    failure_cost seconds instead. A configuration's score is its expected completion time,
+    scaled up by how much of its daily quota is used. Lower is better.
+    """
+
+    def __init__(self, alpha=0.2, failure_weight=1.0, utilization_weight=1.0, default_latency=1.0,
+                 failure_cost=30.0):
+        self._lock = threading.Lock()
+        self._stats: Dict[int, Dict[str, Optional[float]]] = {}
+        self.configure(alpha, failure_weight, utilization_weight, default_latency, failure_cost)
+
+    def configure(self, alpha=0.2, failure_weight=1.0, utilization_weight=1.0, default_latency=1.0,
+                  failure_cost=30.0):
+        """Set the routing weights.
+
+        alpha: weight of the newest sample in the moving averages (0-1)
+        failure_weight: how strongly the failure rate inflates the expected completion time
+        utilization_weight: how strongly daily quota usage inflates the score
+        default_latency: latency in seconds assumed for configurations without successful sends
+        failure_cost: seconds a failed attempt is assumed to cost, e.g. a command timeout
+        """
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be between 0 and 1")
+
+        self.alpha = alpha
+        self.failure_weight = failure_weight
+        self.utilization_weight = utilization_weight
+        self.default_latency = default_latency
+        self.failure_cost = failure_cost
+
+    def reset(self):
+        """Forget all collected statistics"""
+        with self._lock:
+            self._stats.clear()
+
+    def record(self, config_id: int, latency: float, success: bool):
+        """Fold one send attempt into the moving averages of a configuration"""
+        failure = 0.0 if success else 1.0
+
+        with self._lock:
+            stats = self._stats.get(config_id)
+            if stats is None:
+                self._stats[config_id] = {'latency': latency if success else None, 'failure_rate': failure,
+                                          'samples': 1}
+                return
+
+            if success:
+                if stats['latency'] is None:
+                    stats['latency'] = latency
+                else:
+                    stats['latency'] += self.alpha * (latency - stats['latency'])
+            stats['failure_rate'] += self.alpha * (failure - stats['failure_rate'])
+            stats['samples'] += 1
+
+    def expected_time(self, config_id: int) -> float:
+        """Expected seconds until a message is delivered through this configuration"""
+        with self._lock:
+            stats = self._stats.get(config_id)
+            if stats is None:
+                return self.default_latency
+            latency, failure_rate = stats['latency'], stats['failure_rate']
+        if latency is None:
+            latency = self.default_latency
+
+        # With failure probability p a send takes 1 / (1 - p) attempts on average, p / (1 - p) of them failed
+        failure_rate = min(failure_rate, 0.99)
+        return (latency / (1 - failure_rate) +
+                self.failure_weight * failure_rate / (1 - failure_rate) * self.failure_cost)
+
+    def score(self, config) -> float:
+        """Routing score for an SmtpConfig, lower is better"""
+        utilization = 0.0
+        if config.daily_limit:
+            utilization = float(config.sent_count_today) / float(config.daily_limit)
+
+        return self.expected_time(config.id) * (1 + self.utilization_weight * utilization)
+
+    def describe(self, config) -> Dict[str, Any]:
+        """Current routing statistics of an SmtpConfig, for display"""
+        with self._lock:
+            stats = dict(self._stats.get(config.id, {}))
+
+        return {
+            'avg_latency_ms': round(stats['latency'] * 1000, 1) if stats.get('latency') is not None else None,
+            'failure_rate': round(stats['failure_rate'], 4) if stats else None,
+            'samples': int(stats.get('samples', 0)),
+            'expected_time_ms': round(self.expected_time(config.id) * 1000, 1),
+            'score': round(self.score(config), 4)
+        }
+
+
+# Shared by the senders that record results and the service that picks configurations
+smtp_router = SmtpRouter()
@@ -0,0 +1,167 @@
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from models.smtp_config import SmtpConfig, add_change_listener, add_send_listener
+from services.smtp_router import smtp_router, SmtpRouter
+from utils.indexed_heap import IndexedHeap
+
+logger = logging.getLogger('smtp_selector')
+
+
+class RoutingEntry:
+    """In-memory copy of the SmtpConfig columns that decide eligibility and routing"""
+    __slots__ = ('id', 'active', 'daily_limit', 'hourly_limit', 'sent_count_today',
+                 'sent_count_hour', 'last_reset_daily', 'last_reset_hourly')
+
+    FIELDS = __slots__
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values[field])
+
+    @classmethod
+    def from_config(cls, config: SmtpConfig) -> 'RoutingEntry':
+        return cls(**{field: getattr(config, field) for field in cls.FIELDS})
+
+    def apply_resets(self, now: datetime):
+        """Zero the counters whose window has passed, like SmtpConfig._reset_counters"""
+        if now.date() > self.last_reset_daily.date():
+            self.sent_count_today = 0
+            self.last_reset_daily = now
+        if (now - self.last_reset_hourly).total_seconds() >= 3600:
+            self.sent_count_hour = 0
+            self.last_reset_hourly = now
+
+    def resume_at(self) -> Optional[datetime]:
+        """When an exhausted config gets quota again, or None if it can send now"""
+        if self.sent_count_today >= self.daily_limit:
+            return datetime.combine(self.last_reset_daily.date() + timedelta(days=1), datetime.min.time())
+        if self.sent_count_hour >= self.hourly_limit:
+            return self.last_reset_hourly + timedelta(hours=1)
+        return None
+
+
+class SmtpSelector:
+    """Cached, incrementally updated index of SMTP configs for picking the best sender.
+
+    Configs with quota left sit in a min-heap keyed by their routing score, so picking
+    the best one is O(1) and updating one after a send or edit is O(log n). Configs that
+    reached a limit are parked in a second heap keyed by the time their quota resets.
+    The whole index is reloaded from the database every refresh_interval seconds to pick
+    up changes made by other processes.
+    """
+
+    def __init__(self, router: SmtpRouter = smtp_router, refresh_interval: float = 60.0):
+        self.router = router
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._entries: Dict[int, RoutingEntry] = {}
+        self._ready = IndexedHeap()  # config id -> (score, id)
+        self._parked = IndexedHeap()  # config id -> resume time
+        self._loaded_at: Optional[float] = None
+
+    def reset(self):
+        """Drop the cached index, it is reloaded on the next pick"""
+        with self._lock:
+            self._entries.clear()
+            self._ready.clear()
+            self._parked.clear()
+            self._loaded_at = None
+
+    def pick(self, exclude_id: Optional[int] = None) -> Optional[RoutingEntry]:
+        """Return the eligible config with the best routing score"""
+        with self._lock:
+            self._ensure_loaded()
+            self._revive(datetime.now())
+
+            best = self._ready.peek(exclude=exclude_id)
+            if best is None:
+                return None
+            return self._entries[best[0]]
+
+    def update(self, config: SmtpConfig):
+        """Sync one config after it was created, edited or sent through"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._place(RoutingEntry.from_config(config), datetime.now())
+
+    def record_send(self, config_id: int, count: int, now: datetime):
+        """Apply a send counted (or given back) by SmtpConfig.reserve_send to the cached entry"""
+        with self._lock:
+            entry = self._entries.get(config_id)
+            if entry is None:
+                return
+            # The UPDATE zeroed the passed windows before counting
+            entry.apply_resets(now)
+            entry.sent_count_today = max(0, entry.sent_count_today + count)
+            entry.sent_count_hour = max(0, entry.sent_count_hour + count)
+            self._place(entry, now)
+
+    def remove(self, config_id: int):
+        """Forget a config"""
+        with self._lock:
+            self._discard(config_id)
+
+    def rescore(self, config_id: int):
+        """Recompute the routing score of a config after its statistics changed"""
+        with self._lock:
+            if config_id in self._ready:
+                entry = self._entries[config_id]
+                self._ready.push(config_id, (self.router.score(entry), config_id))
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+
+        fields = [getattr(SmtpConfig, field) for field in RoutingEntry.FIELDS]
+        rows = SmtpConfig.select(*fields).tuples()
+
+        self._entries.clear()
+        self._ready.clear()
+        self._parked.clear()
+        now = datetime.now()
+        for row in rows:
+            self._place(RoutingEntry(**dict(zip(RoutingEntry.FIELDS, row))), now)
+
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(self._entries)} SMTP configurations into the selector")
+
+    def _discard(self, config_id: int):
+        self._entries.pop(config_id, None)
+        if config_id in self._ready:
+            self._ready.remove(config_id)
+        if config_id in self._parked:
+            self._parked.remove(config_id)
+
+    def _place(self, entry: RoutingEntry, now: datetime):
+        """Put an entry in the heap matching its state"""
+        self._discard(entry.id)
+        if not entry.active:
+            return
+
+        self._entries[entry.id] = entry
+        entry.apply_resets(now)
+        resume_at = entry.resume_at()
+        if resume_at is None:
+            self._ready.push(entry.id, (self.router.score(entry), entry.id))
+        else:
+            self._parked.push(entry.id, resume_at)
+
+    def _revive(self, now: datetime):
+        """Move parked configs whose quota window has reset back into the ready heap"""
+        while self._parked:
+            config_id, resume_at = self._parked.peek()
+            if resume_at > now:
+                break
+            self._parked.pop()
+            self._place(self._entries[config_id], now)
+
+
+# Shared by all EmailService instances in this process, kept in sync with every SmtpConfig save
+smtp_selector = SmtpSelector()
+add_change_listener(smtp_selector.update)
+add_send_listener(smtp_selector.record_send)
@@ -0,0 +1,203 @@
+import threading
+import uuid
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from models.email_model import EmailMessage, add_status_listener
+
+logger = logging.getLogger('status_events')
+
+
+class StatusEvent(NamedTuple):
+    """One status transition of an email"""
+    seq: int
+    email_id: int
+    status: str
+    smtp_config_id: int
+    campaign: Optional[str]
+    retry_count: int
+    error_code: Optional[str]
+    timestamp: datetime
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'email_id': self.email_id,
+            'status': self.status,
+            'smtp_config_id': self.smtp_config_id,
+            'campaign': self.campaign,
+            'retry_count': self.retry_count,
+            'error_code': self.error_code,
+            'timestamp': self.timestamp.isoformat()
+        }
+
+
+class Subscription:
+    """A subscriber's filtered view of the event stream, with a bounded buffer.
+
+    When the buffer is full, new events are not queued; the subscriber catches up
+    from the bus history on its next read. If the history has moved past it too,
+    the read reports a gap and the client should re-read the emails it tracks.
+    """
+
+    def __init__(self, bus: 'StatusEventBus', email_ids: Optional[Iterable[int]] = None,
+                 campaign: Optional[str] = None, smtp_config_id: Optional[int] = None,
+                 buffer_size: int = 1000, last_seq: int = 0):
+        self.bus = bus
+        self.email_ids: Optional[Set[int]] = set(email_ids) if email_ids else None
+        self.campaign = campaign
+        self.smtp_config_id = smtp_config_id
+        self.buffer_size = buffer_size
+        self.events: Deque[StatusEvent] = deque()
+        self.last_seq = last_seq  # Last sequence number handed to the client
+        self.overflowed = False
+        self.gap = False
+        self.closed = False
+
+    def matches(self, event: StatusEvent) -> bool:
+        if self.email_ids is not None and event.email_id not in self.email_ids:
+            return False
+        if self.campaign is not None and event.campaign != self.campaign:
+            return False
+        if self.smtp_config_id is not None and event.smtp_config_id != self.smtp_config_id:
+            return False
+        return True
+
+    @property
+    def cursor(self) -> str:
+        """Opaque position to resume from after reconnecting"""
+        return self.bus.make_cursor(self.last_seq)
+
+    def get(self, timeout: Optional[float] = None) -> Tuple[List[StatusEvent], bool]:
+        """Wait up to timeout seconds for events; returns them and whether some were lost"""
+        return self.bus.read(self, timeout)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class StatusEventBus:
+    """In-process fan-out of email status transitions.
+
+    Every transition gets a sequence number and is kept in a ring buffer of the last
+    history_size events, so a client can reconnect with its cursor and resume where it
+    left off. Cursors carry a per-process epoch; a cursor from before a restart resumes
+    with a gap, as the events it missed are gone.
+    """
+
+    def __init__(self, history_size: int = 10000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._cond = threading.Condition()
+        self._history: Deque[StatusEvent] = deque(maxlen=history_size)
+        self._subscribers: Set[Subscription] = set()
+        self._seq = 0
+
+    def configure(self, history_size: int):
+        with self._cond:
+            self._history = deque(self._history, maxlen=history_size)
+
+    def reset(self):
+        """Forget all history and subscribers"""
+        with self._cond:
+            self._history.clear()
+            for subscription in self._subscribers:
+                subscription.closed = True
+            self._subscribers.clear()
+            self._cond.notify_all()
+
+    def make_cursor(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def parse_cursor(self, cursor: Optional[str]) -> Tuple[int, bool]:
+        """Turn a cursor into the sequence number to resume after and whether events were lost"""
+        if not cursor:
+            return self._seq, False
+
+        epoch, _, seq = cursor.partition('-')
+        if not seq.isdigit():
+            raise ValueError("Invalid cursor")
+        if epoch != self.epoch:
+            # Issued before a restart; replay whatever this process still has
+            return 0, True
+        return min(int(seq), self._seq), False
+
+    def publish(self, email: EmailMessage):
+        """Record a status transition and hand it to matching subscribers"""
+        with self._cond:
+            self._seq += 1
+            event = StatusEvent(
+                self._seq, email.id, email.status, email.smtp_config_id, email.campaign,
+                email.retry_count, email.error_code, email.updated_at or datetime.now()
+            )
+            self._history.append(event)
+
+            for subscription in self._subscribers:
+                if not subscription.matches(event):
+                    continue
+                if subscription.overflowed or len(subscription.events) >= subscription.buffer_size:
+                    subscription.overflowed = True
+                else:
+                    subscription.events.append(event)
+
+            self._cond.notify_all()
+
+    def subscribe(self, email_ids: Optional[Iterable[int]] = None, campaign: Optional[str] = None,
+                  smtp_config_id: Optional[int] = None, cursor: Optional[str] = None,
+                  buffer_size: int = 1000) -> Subscription:
+        """Start receiving events, optionally resuming after a cursor (ValueError if it is invalid)"""
+        with self._cond:
+            last_seq, lost = self.parse_cursor(cursor)
+            subscription = Subscription(self, email_ids, campaign, smtp_config_id, buffer_size, last_seq)
+            subscription.gap = lost
+            if last_seq < self._seq:
+                # Replay the missed events from history on the first read
+                subscription.overflowed = True
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._cond:
+            subscription.closed = True
+            self._subscribers.discard(subscription)
+            self._cond.notify_all()
+
+    def read(self, subscription: Subscription, timeout: Optional[float] = None) -> Tuple[List[StatusEvent], bool]:
+        with self._cond:
+            self._cond.wait_for(
+                lambda: subscription.events or subscription.overflowed or subscription.closed,
+                timeout
+            )
+
+            if subscription.overflowed:
+                self._catch_up(subscription)
+
+            events = list(subscription.events)
+            subscription.events.clear()
+            if subscription.overflowed:
+                subscription.last_seq = events[-1].seq
+            else:
+                # Everything published so far was either delivered or filtered out
+                subscription.last_seq = self._seq
+
+            gap, subscription.gap = subscription.gap, False
+            return events, gap
+
+    def _catch_up(self, subscription: Subscription):
+        """Refill a subscription from history after its buffer overflowed"""
+        oldest = self._history[0].seq if self._history else self._seq + 1
+        if subscription.last_seq + 1 < oldest:
+            subscription.gap = True
+
+        matched = [
+            event for event in self._history
+            if event.seq > subscription.last_seq and subscription.matches(event)
+        ]
+        # Hand out at most one buffer per read; the rest is replayed on the next one
+        subscription.events = deque(matched[:subscription.buffer_size])
+        subscription.overflowed = len(matched) > subscription.buffer_size
+
+
+# Shared by the whole process, fed by every EmailMessage.update_status
+status_events = StatusEventBus()
+add_status_listener(status_events.publish)
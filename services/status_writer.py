@@ -0,0 +1,151 @@
+import threading
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from peewee import chunked
+
+from models.email_model import EmailMessage, ThreadConnection, db, notify_status_listeners
+
+logger = logging.getLogger('status_writer')
+
+
+class _PendingStatus:
+    """Latest unwritten status columns of one email"""
+    __slots__ = ('email', 'values', 'done', 'error')
+
+    def __init__(self, email: EmailMessage):
+        self.email = email
+        self.values: Dict[str, Any] = {}
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class StatusWriter:
+    """Write-behind buffer for email status transitions.
+
+    Workers hand transitions to submit() and a single writer thread flushes them every
+    flush_interval seconds. Transitions of the same email are coalesced, keeping the
+    latest value of each column, and emails ending up with the same values share one
+    UPDATE ... WHERE id IN (...), all in one transaction per flush. Only the status
+    columns are written, with updated_at (and sent_at for sent emails) stamped at flush.
+
+    Terminal transitions are submitted with wait=True and only return once committed,
+    so nothing that follows them (retries, requeues) can act on an unwritten state.
+    Intermediate ones like 'sending' don't wait; after a crash they are lost, which
+    leaves the email in its previous, still valid state. Status listeners are notified
+    after the flush, once per email, with the coalesced state.
+    """
+
+    def __init__(self, flush_interval: float = 0.005, max_batch: int = 1000, wait_timeout: float = 30.0):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch  # Flush right away once this many emails are waiting
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._pending: Dict[int, _PendingStatus] = {}
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the writer thread"""
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self._writer_process)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f"Status writer started (flush every {self.flush_interval * 1000:.1f}ms)")
+
+    def stop(self):
+        """Stop the writer thread after flushing what is already waiting"""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        self.thread = None
+        logger.info("Status writer stopped")
+
+    def submit(self, email: EmailMessage, status: str, error_message: Optional[str] = None,
+               error_code: Optional[str] = None, wait: bool = False):
+        """Record a status transition; with wait, block until it is committed.
+
+        Falls back to a direct update when the writer is not running."""
+        if not self.running:
+            email.update_status(status, error_message, error_code)
+            return
+
+        with self._cond:
+            fields = email.apply_status(status, error_message, error_code)
+            entry = self._pending.get(email.id)
+            if entry is None:
+                entry = self._pending[email.id] = _PendingStatus(email)
+            entry.email = email
+            entry.values.update(
+                (field, getattr(email, field)) for field in fields if field not in ('updated_at', 'sent_at')
+            )
+            self._cond.notify_all()
+
+        if not wait:
+            return
+        if not entry.done.wait(self.wait_timeout):
+            raise TimeoutError(f"Timed out waiting for the status of email {email.id} to be written")
+        if entry.error is not None:
+            raise entry.error
+
+    def _writer_process(self):
+        """Writer loop flushing one batch per iteration"""
+        with ThreadConnection() as connection:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._pending or not self.running, timeout=0.5)
+                    if not self._pending:
+                        if not self.running:
+                            return
+                        continue
+                    # Give other workers a moment to add to the same flush
+                    self._cond.wait_for(lambda: len(self._pending) >= self.max_batch or not self.running,
+                                        timeout=self.flush_interval)
+                    batch, self._pending = self._pending, {}
+
+                connection.refresh()
+                self._flush(batch)
+
+    def _flush(self, batch: Dict[int, _PendingStatus]):
+        """Write a batch with one UPDATE per distinct set of values and wake its waiters"""
+        now = datetime.now()
+        groups: Dict[tuple, List[int]] = defaultdict(list)
+        for email_id, entry in batch.items():
+            groups[tuple(sorted(entry.values.items(), key=lambda item: item[0]))].append(email_id)
+
+        try:
+            with db.atomic():
+                for key, email_ids in groups.items():
+                    values = dict(key, updated_at=now)
+                    if values.get('status') == 'sent':
+                        values['sent_at'] = now
+                    for chunk in chunked(email_ids, 500):
+                        EmailMessage.update(**values).where(EmailMessage.id.in_(chunk)).execute()
+        except Exception as e:
+            logger.error(f"Error writing the status of {len(batch)} emails: {str(e)}")
+            for entry in batch.values():
+                entry.error = e
+                entry.done.set()
+            return
+
+        for entry in batch.values():
+            entry.email.updated_at = now
+            if entry.values.get('status') == 'sent':
+                entry.email.sent_at = now
+            entry.done.set()
+
+            try:
+                notify_status_listeners(entry.email)
+            except Exception as e:
+                logger.error(f"Error notifying status listeners for email {entry.email.id}: {str(e)}")
+
+
+# Shared by all workers of this process; only buffers once started (see create_app)
+status_writer = StatusWriter()
@@ -0,0 +1,229 @@
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from peewee import chunked
+
+from models.email_model import Suppression
+from services import smtp_errors
+from services.db_router import db_router
+
+logger = logging.getLogger('suppression')
+
+# Changes are re-read with this overlap, covering clock skew between processes and late commits
+SYNC_OVERLAP = timedelta(seconds=5)
+
+# Rows per upsert statement when importing
+UPSERT_CHUNK_SIZE = 500
+
+
+class RecipientsSuppressedError(ValueError):
+    """Every recipient of a new email is suppressed"""
+
+    def __init__(self, addresses: List[str]):
+        self.addresses = addresses
+        super().__init__(f"All recipients are suppressed: {', '.join(addresses)}")
+
+
+class SuppressionList:
+    """Addresses and domains that must not be sent to, checked in memory.
+
+    The Suppression table is loaded once into a set of never-expiring entries and a
+    dict of expiry timestamps, so a check is two or four hash lookups whatever the
+    size of the list. Changes made in this process apply right away; changes made by
+    other processes are read every refresh_interval seconds by their updated_at.
+    Lifting a suppression expires its row instead of deleting it, so that other
+    processes see the change too.
+
+    If the table can't be read, checks let everything through until the next refresh:
+    a database hiccup should not hold up sending.
+    """
+
+    def __init__(self, refresh_interval: float = 5.0, bounce_days: int = 0):
+        self.refresh_interval = refresh_interval
+        self.bounce_days = bounce_days  # How long hard bounces stay suppressed, 0 for good
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the loaded entries, they are read again on the next check"""
+        with self._lock:
+            self._permanent: Set[str] = set()
+            self._expiring: Dict[str, float] = {}  # Address or domain -> expiry as a timestamp
+            self._loaded = False
+            self._synced_at: Optional[datetime] = None
+            self._next_sync = 0.0
+
+    def _sync(self):
+        """Load the list on first use, then pick up other processes' changes every refresh_interval"""
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+
+        with self._lock:
+            if now < self._next_sync:
+                return  # Another thread just did
+            self._next_sync = now + self.refresh_interval
+            try:
+                if self._loaded:
+                    self._load_changes()
+                else:
+                    self._load_all()
+            except Exception as e:
+                logger.error(f"Error loading the suppression list: {str(e)}")
+
+    def _load_all(self):
+        started = datetime.now()
+        permanent: Set[str] = set()
+        expiring: Dict[str, float] = {}
+        query = (Suppression
+                 .select(Suppression.address, Suppression.expires_at)
+                 .where(Suppression.expires_at.is_null() | (Suppression.expires_at > started)))
+        for address, expires_at in query.tuples().iterator():
+            if expires_at is None:
+                permanent.add(address)
+            else:
+                expiring[address] = expires_at.timestamp()
+
+        self._permanent, self._expiring = permanent, expiring
+        self._synced_at = started
+        self._loaded = True
+        logger.info(f"Loaded {len(permanent) + len(expiring)} suppressions")
+
+    def _load_changes(self):
+        started = datetime.now()
+        query = (Suppression
+                 .select(Suppression.address, Suppression.expires_at)
+                 .where(Suppression.updated_at >= self._synced_at - SYNC_OVERLAP))
+        for address, expires_at in query.tuples().iterator():
+            self._apply(address, expires_at)
+        self._synced_at = started
+
+    def _apply(self, address: str, expires_at: Optional[datetime]):
+        """Update the in-memory entry of one address; the caller holds the lock"""
+        if expires_at is None:
+            self._expiring.pop(address, None)
+            self._permanent.add(address)
+            return
+
+        self._permanent.discard(address)
+        if expires_at.timestamp() > time.time():
+            self._expiring[address] = expires_at.timestamp()
+        else:
+            self._expiring.pop(address, None)
+
+    def suppressed(self, addresses: Iterable[str]) -> List[str]:
+        """The given addresses that must not be sent to, as they were given"""
+        self._sync()
+        permanent, expiring = self._permanent, self._expiring
+        if not permanent and not expiring:
+            return []
+
+        now = time.time()
+        found = []
+        for address in addresses:
+            key = address.strip().lower()
+            domain = key.rpartition('@')[2]
+            if (key in permanent or domain in permanent or
+                    expiring.get(key, 0) > now or expiring.get(domain, 0) > now):
+                found.append(address)
+        return found
+
+    def add_many(self, entries: Iterable[Dict[str, Any]]) -> int:
+        """Suppress addresses or domains, given as dicts with address, reason and optional expires_at.
+
+        Entries already listed get the new reason and expiry. Returns how many were written."""
+        now = datetime.now()
+        rows: Dict[str, Dict[str, Any]] = {}
+        for entry in entries:
+            address, scope = Suppression.normalize(entry['address'])
+            rows[address] = {'address': address, 'scope': scope, 'reason': entry.get('reason') or 'manual',
+                             'expires_at': entry.get('expires_at'), 'created_at': now, 'updated_at': now}
+        if not rows:
+            return 0
+
+        with Suppression._meta.database.atomic():
+            for chunk in chunked(list(rows.values()), UPSERT_CHUNK_SIZE):
+                Suppression.upsert_many(chunk)
+
+        with self._lock:
+            for row in rows.values():
+                self._apply(row['address'], row['expires_at'])
+        return len(rows)
+
+    def add(self, address: str, reason: str = 'manual', expires_at: Optional[datetime] = None):
+        self.add_many([{'address': address, 'reason': reason, 'expires_at': expires_at}])
+
+    def remove(self, address: str) -> bool:
+        """Lift the suppression of an address or domain; False if it wasn't suppressed"""
+        address, _ = Suppression.normalize(address)
+        now = datetime.now()
+        updated = (Suppression
+                   .update(expires_at=now, updated_at=now)
+                   .where((Suppression.address == address) &
+                          (Suppression.expires_at.is_null() | (Suppression.expires_at > now)))
+                   .execute())
+
+        with self._lock:
+            self._permanent.discard(address)
+            self._expiring.pop(address, None)
+        return bool(updated)
+
+    def record_bounces(self, refused: Dict[str, Tuple[int, Any]]):
+        """Suppress the addresses a server refused as nonexistent (sendmail's refused recipients)"""
+        addresses = [
+            address for address, reply in (refused or {}).items()
+            if isinstance(reply, tuple) and smtp_errors.is_hard_bounce(reply[0])
+        ]
+        if not addresses:
+            return
+
+        expires_at = datetime.now() + timedelta(days=self.bounce_days) if self.bounce_days else None
+        try:
+            self.add_many({'address': address, 'reason': 'hard_bounce', 'expires_at': expires_at}
+                          for address in addresses)
+            logger.info(f"Suppressed {len(addresses)} hard-bounced addresses")
+        except Exception as e:
+            logger.error(f"Error suppressing hard-bounced addresses: {str(e)}")
+
+    @staticmethod
+    def _describe(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'address': row['address'],
+            'scope': row['scope'],
+            'reason': row['reason'],
+            'expires_at': row['expires_at'].isoformat() if row['expires_at'] else None,
+            'created_at': row['created_at'].isoformat()
+        }
+
+    def get(self, address: str) -> Optional[Dict[str, Any]]:
+        """The suppression covering an address, its own before its domain's, or None"""
+        address, _ = Suppression.normalize(address)
+        now = datetime.now()
+        candidates = [address, address.rpartition('@')[2]]
+        query = (Suppression
+                 .select(Suppression.address, Suppression.scope, Suppression.reason,
+                         Suppression.expires_at, Suppression.created_at)
+                 .where(Suppression.address.in_(candidates) &
+                        (Suppression.expires_at.is_null() | (Suppression.expires_at > now))))
+        rows = {row['address']: row for row in query.dicts()}
+        for candidate in candidates:
+            if candidate in rows:
+                return self._describe(rows[candidate])
+        return None
+
+    def export(self) -> Iterator[Dict[str, Any]]:
+        """Every active suppression, streamed from a replica when there is one"""
+        query = (Suppression
+                 .select(Suppression.address, Suppression.scope, Suppression.reason,
+                         Suppression.expires_at, Suppression.created_at)
+                 .where(Suppression.expires_at.is_null() | (Suppression.expires_at > datetime.now()))
+                 .order_by(Suppression.id))
+        for row in db_router.read(query).dicts().iterator():
+            yield self._describe(row)
+
+
+# Shared by the whole process; loaded on first use (see create_app for the settings)
+suppression_list = SuppressionList()
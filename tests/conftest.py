@@ -7,28 +7,40 @@ import json
 import queue
 from unittest.mock import MagicMock, patch
 
-from models.email_model import EmailMessage, db as _db
+from models.email_model import (EmailMessage, ContentBlob, EmailRecipient, ArchivedEmail, DeliveryStat, Suppression,
+                                IdempotencyKey, db as _db)
 from models.smtp_config import SmtpConfig
 from services.email_service import EmailService
 from services.queue_service import EmailQueue
+from services.smtp_router import smtp_router
+from services.smtp_selector import smtp_selector
+from services.config_cache import smtp_config_cache
+from services.status_events import status_events
+from services.db_router import db_router
+from services.delivery_stats import delivery_stats
+from services.suppression import suppression_list
+from services.idempotency import idempotency_store
 from controllers.email_controller import EmailController, email_bp
 from controllers.smtp_controller import SmtpController, smtp_bp
 from app import create_app
 
+# Every table, bound to the in-memory test database
+MODELS = [EmailMessage, SmtpConfig, ContentBlob, EmailRecipient, ArchivedEmail, DeliveryStat, Suppression, IdempotencyKey]
+
 @pytest.fixture(scope='function')
 def db():
     """Create a test database in memory"""
     test_db = SqliteDatabase(':memory:')
     
     # Connect to the test database
-    with test_db.bind_ctx([EmailMessage, SmtpConfig]):
+    with test_db.bind_ctx(MODELS):
         test_db.connect()
-        test_db.create_tables([EmailMessage, SmtpConfig])
+        test_db.create_tables(MODELS)
         
         yield test_db
         
         # Clean up
-        test_db.drop_tables([EmailMessage, SmtpConfig])
+        test_db.drop_tables(MODELS)
         test_db.close()
 
 @pytest.fixture
@@ -114,4 +126,25 @@ def app():
 @pytest.fixture
 def client(app):
     """Create a test client for the app"""
-    return app.test_client()
\ No newline at end of file
+    return app.test_client()
+
+@pytest.fixture(autouse=True)
+def reset_smtp_routing():
+    """Start every test without routing statistics or cached configs from earlier tests"""
+    smtp_router.reset()
+    smtp_selector.reset()
+    smtp_config_cache.invalidate()
+    status_events.reset()
+    db_router.reset()
+    delivery_stats.reset()
+    suppression_list.reset()
+    idempotency_store.reset()
+    yield
+    smtp_router.reset()
+    smtp_selector.reset()
+    smtp_config_cache.invalidate()
+    status_events.reset()
+    db_router.reset()
+    delivery_stats.reset()
+    suppression_list.reset()
+    idempotency_store.reset()
@@ -0,0 +1,60 @@
+import pytest
+from unittest.mock import patch
+
+from models.smtp_config import SmtpConfig
+from services.config_cache import SmtpConfigCache
+
+class TestSmtpConfigCache:
+    def test_get_returns_snapshot(self, db, smtp_config):
+        """Test snapshots carry the connection details"""
+        cache = SmtpConfigCache()
+        
+        snapshot = cache.get(smtp_config.id)
+        assert snapshot.smtp_host == "smtp.example.com"
+        assert snapshot.password == "password123"
+        assert snapshot.version == 1
+        
+        # Snapshots are immutable
+        with pytest.raises(AttributeError):
+            snapshot.smtp_host = "other"
+    
+    def test_get_is_cached(self, db, smtp_config):
+        """Test a second lookup does not hit the database"""
+        cache = SmtpConfigCache()
+        first = cache.get(smtp_config.id)
+        
+        with patch.object(SmtpConfig, 'select', side_effect=AssertionError("queried")):
+            assert cache.get(smtp_config.id) is first
+    
+    def test_ttl_expiry(self, db, smtp_config):
+        """Test entries are reloaded after the TTL"""
+        cache = SmtpConfigCache(ttl=0)
+        first = cache.get(smtp_config.id)
+        
+        assert cache.get(smtp_config.id) is not first
+    
+    def test_invalidate(self, db, smtp_config):
+        """Test explicit invalidation"""
+        cache = SmtpConfigCache()
+        cache.get(smtp_config.id)
+        
+        SmtpConfig.update(smtp_host="smtp.changed.com").where(SmtpConfig.id == smtp_config.id).execute()
+        assert cache.get(smtp_config.id).smtp_host == "smtp.example.com"
+        
+        cache.invalidate(smtp_config.id)
+        assert cache.get(smtp_config.id).smtp_host == "smtp.changed.com"
+    
+    def test_version_check(self, db, smtp_config):
+        """Test edits from other processes are detected through the version column"""
+        cache = SmtpConfigCache(version_check_interval=0)
+        cache.get(smtp_config.id)
+        
+        SmtpConfig.update(smtp_port=2525, version=SmtpConfig.version + 1).where(
+            SmtpConfig.id == smtp_config.id).execute()
+        
+        assert cache.get(smtp_config.id).smtp_port == 2525
+    
+    def test_missing_config(self, db):
+        """Test missing configs raise DoesNotExist"""
+        with pytest.raises(SmtpConfig.DoesNotExist):
+            SmtpConfigCache().get(999)
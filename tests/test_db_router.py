@@ -0,0 +1,92 @@
+import pytest
+import json
+from peewee import SqliteDatabase
+
+from models.email_model import EmailMessage, ContentBlob, EmailRecipient
+from models.smtp_config import SmtpConfig
+from services.db_router import DatabaseRouter, db_router
+
+MODELS = [EmailMessage, SmtpConfig, ContentBlob, EmailRecipient]
+
+@pytest.fixture
+def databases(tmp_path):
+    """A primary and a replica as two SQLite files, the models bound to the primary"""
+    primary = SqliteDatabase(str(tmp_path / 'primary.db'))
+    replica = SqliteDatabase(str(tmp_path / 'replica.db'))
+    replica.bind(MODELS, bind_refs=False, bind_backrefs=False)  # Create the same tables in the replica
+    replica.create_tables(MODELS)
+    with primary.bind_ctx(MODELS):
+        primary.create_tables(MODELS)
+        yield primary, replica
+    primary.close()
+    replica.close()
+
+def insert_email(database, subject, smtp_config_id=1):
+    with database.bind_ctx([EmailMessage, ContentBlob]):
+        return EmailMessage.create(subject=subject, sender="", recipients=json.dumps(["a@example.com"]),
+                                   html_content="<p>x</p>", status="queued", smtp_config_id=smtp_config_id).id
+
+@pytest.fixture
+def replicated(databases, email_service):
+    """One config and one email on both sides, with the replica's copy marked"""
+    primary, replica = databases
+    for database, name in ((primary, "Primary SMTP"), (replica, "Replica SMTP")):
+        with database.bind_ctx([SmtpConfig]):
+            SmtpConfig.create(name=name, email_address="test@example.com", smtp_host="smtp.example.com",
+                              smtp_port=587, username="u", password="p")
+    email_id = insert_email(primary, "From primary")
+    insert_email(replica, "From replica")
+    db_router.configure(replicas=[replica], read_your_writes=60)
+    return email_id
+
+class TestDatabaseRouter:
+    def test_without_replicas_queries_stay_on_primary(self):
+        """Test queries are left untouched when no replica is configured"""
+        router = DatabaseRouter()
+        query = EmailMessage.select()
+        
+        assert router.replica_for('emailmessage', [1]) is None
+        assert router.read(query)._database is EmailMessage._meta.database
+    
+    def test_reads_go_to_replica(self, replicated, email_service):
+        """Test read-only service calls are answered by the replica"""
+        assert email_service.get_email(replicated)['subject'] == "From replica"
+        assert [row['subject'] for row in email_service.get_emails_by_status('queued')] == ["From replica"]
+        assert [config['name'] for config in email_service.list_smtp_configs()] == ["Replica SMTP"]
+        assert email_service.get_smtp_config(1)['name'] == "Replica SMTP"
+    
+    def test_recent_writes_are_read_from_primary(self, replicated, email_service):
+        """Test rows written by this process are read back from the primary"""
+        email = EmailMessage.get_by_id(replicated)
+        email.update_status('sending')
+        
+        assert email_service.get_email(replicated)['subject'] == "From primary"
+        assert email_service.get_email_statuses([replicated])['emails'][0]['status'] == 'sending'
+    
+    def test_rows_missing_on_replica_are_read_from_primary(self, databases, replicated, email_service):
+        """Test rows the replica hasn't received yet are still found"""
+        primary, _ = databases
+        new_id = insert_email(primary, "Not replicated yet")
+        
+        assert email_service.get_email(new_id)['subject'] == "Not replicated yet"
+        statuses = email_service.get_email_statuses([replicated, new_id])
+        assert [row['id'] for row in statuses['emails']] == [replicated, new_id]
+        assert statuses['missing'] == []
+    
+    def test_lagging_replica_is_skipped(self, databases, replicated, email_service):
+        """Test replicas further behind than the tolerated lag are not read from"""
+        _, replica = databases
+        router = DatabaseRouter([replica], max_lag=5, lag_probe=lambda database: 30.0)
+        assert router.replica_for('emailmessage') is None
+        
+        router.lag_probe = lambda database: 1.0
+        router._next_lag_check = 0
+        assert router.replica_for('emailmessage') is replica
+    
+    def test_recent_writes_expire(self, databases):
+        """Test reads return to the replica once the read-your-writes window is over"""
+        _, replica = databases
+        router = DatabaseRouter([replica], read_your_writes=0)
+        router.record_write('emailmessage', [1])
+        
+        assert router.replica_for('emailmessage', [1]) is replica
@@ -0,0 +1,72 @@
+import pytest
+from datetime import datetime, timedelta
+
+from models.email_model import DeliveryStat
+from services.delivery_stats import DeliveryStats, latency_percentile
+
+HOUR = datetime(2026, 3, 2, 10)
+
+@pytest.fixture
+def stats():
+    return DeliveryStats()
+
+class TestDeliveryStats:
+    def test_transitions_increment_hourly_rows(self, db, stats):
+        """Test each transition lands in its configuration's hour with an upsert"""
+        stats.record_sent(1, HOUR, HOUR + timedelta(seconds=3))
+        stats.record_sent(1, HOUR, HOUR + timedelta(minutes=10))
+        stats.record_failed(1, HOUR + timedelta(minutes=5))
+        stats.record_retry(1, HOUR + timedelta(minutes=5))
+        stats.record_given_up(2, HOUR + timedelta(hours=1))
+        
+        row = DeliveryStat.get((DeliveryStat.smtp_config_id == 1) & (DeliveryStat.hour == HOUR))
+        assert (row.sent, row.failed, row.retried, row.given_up) == (2, 1, 1, 0)
+        assert row.latency_5 == 1
+        assert row.latency_900 == 1
+        assert row.latency_sum == 603
+        assert DeliveryStat.select().count() == 2
+    
+    def test_buffered_until_flush(self, db, stats):
+        """Test a running aggregator writes on flush but reports pending counters right away"""
+        stats.running = True
+        stats.record_sent(1, HOUR, HOUR + timedelta(seconds=30))
+        stats.record_sent(1, HOUR, HOUR + timedelta(seconds=30))
+        
+        assert DeliveryStat.select().count() == 0
+        assert stats.summary(HOUR, HOUR + timedelta(hours=1))['totals']['sent'] == 2
+        
+        stats.flush()
+        assert DeliveryStat.get().sent == 2
+        assert stats.summary(HOUR, HOUR + timedelta(hours=1))['totals']['sent'] == 2
+    
+    def test_summary_granularity(self, db, stats):
+        """Test the rollups are folded per hour, day or in total"""
+        stats.record_sent(1, HOUR, HOUR + timedelta(seconds=1))
+        stats.record_sent(1, HOUR, HOUR + timedelta(hours=2, seconds=1))
+        stats.record_sent(2, HOUR, HOUR + timedelta(days=1))
+        end = HOUR + timedelta(days=2)
+        
+        hourly = stats.summary(HOUR, end, granularity='hour')
+        assert [(row['smtp_config_id'], row['period']) for row in hourly['series']] == [
+            (1, HOUR.isoformat()), (1, (HOUR + timedelta(hours=2)).isoformat()), (2, (HOUR + timedelta(days=1)).isoformat())
+        ]
+        
+        daily = stats.summary(HOUR, end, smtp_config_id=1, granularity='day')
+        assert [(row['period'], row['sent']) for row in daily['series']] == [(datetime(2026, 3, 2).isoformat(), 2)]
+        
+        total = stats.summary(HOUR, end, granularity='total')
+        assert total['totals']['sent'] == 3
+        assert total['totals']['time_to_send']['histogram']['le_1s'] == 1
+        assert total['totals']['time_to_send']['histogram']['inf'] == 2
+        
+        with pytest.raises(ValueError):
+            stats.summary(HOUR, end, granularity='week')
+    
+    def test_latency_percentile(self):
+        """Test percentiles are interpolated within their histogram bucket"""
+        buckets = [0, 10, 0, 0, 0, 0, 0, 0]  # Ten emails sent after 1 to 5 seconds
+        
+        assert latency_percentile(buckets, 50) == 3.0
+        assert latency_percentile(buckets, 100) == 5.0
+        assert latency_percentile([0] * 8, 50) is None
+        assert latency_percentile([0] * 7 + [1], 99) == 3600.0
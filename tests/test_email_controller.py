@@ -37,7 +37,8 @@ class TestEmailController:
                 smtp_config_id=None,
                 cc=None,
                 bcc=None,
-                priority=2
+                priority=2,
+                campaign=None
             )
     
     def test_create_email_validation_error(self, client):
@@ -1,12 +1,15 @@
 import pytest
 import json
+import smtplib
 from unittest.mock import MagicMock, patch, ANY
 from datetime import datetime
 from peewee import DoesNotExist
 
-from services.email_service import EmailService, EmailSender
-from models.email_model import EmailMessage
+from services.email_service import EmailService, EmailSender, EmailNotPendingError, consecutive_insert_ids
+from models.email_model import EmailMessage, ContentBlob, EmailRecipient, DeliveryStat
 from models.smtp_config import SmtpConfig
+from services.smtp_router import smtp_router
+from services.config_cache import smtp_config_cache
 
 class TestEmailService:
     def test_create_email(self, db, smtp_config, email_service):
@@ -123,6 +126,289 @@ class TestEmailService:
         
         no_config = email_service._get_best_smtp_config()
         assert no_config is None
+    
+    def test_handle_failed_email_permanent(self, db, test_email, email_service):
+        """Test that permanently rejected emails are not retried"""
+        test_email.update_status('failed', 'No such user', 'permanent.550')
+        
+        email_service.handle_failed_email(test_email.id, 3)
+        
+        email = EmailMessage.get_by_id(test_email.id)
+        assert email.retry_count == 0
+        assert email.status == 'failed'
+        email_service.queue_service.enqueue.assert_not_called()
+    
+    def test_handle_failed_email_auth_without_alternative(self, db, test_email, email_service):
+        """Test that auth failures are not retried on the same account"""
+        test_email.update_status('failed', 'Bad credentials', 'auth.535')
+        
+        email_service.handle_failed_email(test_email.id, 3)
+        
+        email = EmailMessage.get_by_id(test_email.id)
+        assert email.retry_count == 0
+        assert "Authentication failed" in email.error_message
+        email_service.queue_service.enqueue.assert_not_called()
+    
+    def test_get_best_smtp_config_prefers_faster_relay(self, db, smtp_config, email_service):
+        """Test that observed latency outweighs a small utilization difference"""
+        fast_config = SmtpConfig.create(
+            name="Fast SMTP",
+            email_address="fast@example.com",
+            smtp_host="smtp.fast.com",
+            smtp_port=587,
+            username="fast@example.com",
+            password="password",
+            daily_limit=100,
+            hourly_limit=10,
+            sent_count_today=10
+        )
+        smtp_router.record(smtp_config.id, 5.0, True)
+        smtp_router.record(fast_config.id, 0.5, True)
+        
+        assert email_service._get_best_smtp_config().id == fast_config.id
+        
+        # Routing scores are exposed in the config listing
+        listing = {c['id']: c for c in email_service.list_smtp_configs()}
+        assert listing[fast_config.id]['routing']['avg_latency_ms'] == 500.0
+        assert listing[smtp_config.id]['routing']['samples'] == 1
+    
+    def test_update_smtp_config_invalidates_cache(self, db, smtp_config, test_email, email_service):
+        """Test config edits are visible to cached lookups"""
+        assert email_service.get_email(test_email.id)['sender'] == "test@example.com"
+        
+        assert email_service.update_smtp_config(smtp_config.id, email_address="new@example.com") is True
+        
+        assert email_service.get_email(test_email.id)['sender'] == "new@example.com"
+        assert SmtpConfig.get_by_id(smtp_config.id).version == 2
+    
+    def test_update_smtp_config_keeps_concurrent_sends(self, db, smtp_config, email_service):
+        """Test an edit doesn't write back counters read before a send was counted"""
+        load = SmtpConfig.get_by_id
+        def load_then_send(config_id):
+            config = load(config_id)
+            SmtpConfig.reserve_send(config_id)  # Counted by a worker while the edit is in flight
+            return config
+        
+        with patch.object(SmtpConfig, 'get_by_id', side_effect=load_then_send):
+            assert email_service.update_smtp_config(smtp_config.id, hourly_limit=200) is True
+        
+        config = SmtpConfig.get_by_id(smtp_config.id)
+        assert (config.hourly_limit, config.sent_count_hour, config.version) == (200, 1, 2)
+        assert email_service.update_smtp_config(999, hourly_limit=200) is False
+    
+    def test_create_emails_batch(self, db, smtp_config, email_service):
+        """Test creating emails in bulk"""
+        items = [
+            {'subject': f"Subject {i}", 'recipients': [f"user{i}@example.com"],
+             'html_content': "<p>Hi</p>", 'priority': 2}
+            for i in range(3)
+        ]
+        
+        results = email_service.create_emails_batch(items)
+        
+        email_ids = [result['email_id'] for result in results]
+        assert [result['index'] for result in results] == [0, 1, 2]
+        for i, email_id in enumerate(email_ids):
+            email = EmailMessage.get_by_id(email_id)
+            assert email.subject == f"Subject {i}"
+            assert email.smtp_config_id == smtp_config.id
+            assert email.status == "queued"
+            assert email.html_content == "<p>Hi</p>"
+        
+        # The shared body is stored once
+        assert ContentBlob.select().count() == 1
+        assert ContentBlob.get().ref_count == 3
+        
+        email_service.queue_service.enqueue_many.assert_called_once_with([(i, 2) for i in email_ids])
+    
+    def test_create_emails_batch_chunks(self, db, smtp_config, email_service):
+        """Test IDs line up with the input across insert chunks"""
+        items = [
+            {'subject': f"Subject {i}", 'recipients': ["user@example.com"], 'html_content': "<p>Hi</p>"}
+            for i in range(7)
+        ]
+        
+        with patch('services.email_service.INSERT_CHUNK_SIZE', 3):
+            results = email_service.create_emails_batch(items)
+        
+        subjects = [EmailMessage.get_by_id(r['email_id']).subject for r in results]
+        assert subjects == [item['subject'] for item in items]
+    
+    def test_consecutive_insert_ids(self):
+        """Test multi-row INSERT IDs are only derived where MySQL hands them out consecutively"""
+        def server(increment, lock_mode):
+            database = MagicMock()
+            database.execute_sql.return_value.fetchone.return_value = (increment, lock_mode)
+            return database
+        
+        with patch.dict('services.email_service._consecutive_ids', clear=True):
+            single = server(1, 1)
+            assert consecutive_insert_ids(single) is True
+            assert consecutive_insert_ids(single) is True
+            single.execute_sql.assert_called_once()  # Checked once per database
+            
+            assert consecutive_insert_ids(server(2, 1)) is False  # Galera, group replication
+            assert consecutive_insert_ids(server(1, 2)) is False  # Interleaved
+    
+    def test_create_emails_batch_without_config(self, db, email_service):
+        """Test items report an error when no SMTP configuration is available"""
+        results = email_service.create_emails_batch([
+            {'subject': "S", 'recipients': ["user@example.com"], 'html_content': "<p>Hi</p>"}
+        ])
+        
+        assert results == [{'index': 0, 'error': "No available SMTP configuration found"}]
+        email_service.queue_service.enqueue_many.assert_not_called()
+    
+    def test_create_email_group_commit(self, db, smtp_config, email_service):
+        """Test create_email hands the row to the group-commit writer"""
+        email_service.ingest_writer = MagicMock()
+        email_service.ingest_writer.submit.return_value = 55
+        
+        email_id = email_service.create_email(
+            subject="Test Subject",
+            recipients=["recipient@example.com"],
+            html_content="<p>Test content</p>",
+            priority=3
+        )
+        
+        assert email_id == 55
+        row = email_service.ingest_writer.submit.call_args[0][0]
+        assert row['smtp_config_id'] == smtp_config.id
+        assert row['priority'] == 3
+        assert EmailMessage.select().count() == 0
+    
+    def test_get_emails_by_status_pages(self, db, smtp_config, email_service):
+        """Test keyset pagination walks every row exactly once"""
+        created_at = datetime(2024, 1, 1, 12, 0, 0)
+        for i in range(5):
+            # Two rows share a timestamp to exercise the ID tie-breaker
+            EmailMessage.create(subject=f"Email {i}", sender="", recipients='["a@example.com"]',
+                                html_content="<p>x</p>", smtp_config_id=smtp_config.id,
+                                created_at=created_at if i < 2 else datetime(2024, 1, 1, 12, i))
+        
+        seen = []
+        cursor = None
+        while True:
+            page = email_service.get_emails_by_status('queued', 2, cursor=cursor)
+            seen.extend(email['subject'] for email in page)
+            if len(page) < 2:
+                break
+            cursor = email_service.encode_cursor(page[-1]['created_at'], page[-1]['id'])
+        
+        assert seen == [f"Email {i}" for i in range(5)]
+    
+    def test_get_emails_by_status_filters(self, db, smtp_config, email_service):
+        """Test filtering by priority, SMTP config and creation time"""
+        for priority in (1, 2, 2):
+            EmailMessage.create(subject=f"P{priority}", sender="", recipients='["a@example.com"]',
+                                html_content="<p>x</p>", smtp_config_id=smtp_config.id,
+                                priority=priority, created_at=datetime(2024, 1, priority))
+        
+        assert len(email_service.get_emails_by_status('queued', priority=2)) == 2
+        assert len(email_service.get_emails_by_status('queued', smtp_config_id=smtp_config.id + 1)) == 0
+        assert len(email_service.get_emails_by_status('queued', created_after=datetime(2024, 1, 2))) == 2
+        assert len(email_service.get_emails_by_status('queued', created_before=datetime(2024, 1, 2))) == 1
+    
+    def test_decode_invalid_cursor(self, email_service):
+        """Test malformed cursors are rejected"""
+        with pytest.raises(ValueError):
+            email_service.decode_cursor("not-a-cursor")
+    
+    def test_get_email_statuses(self, db, smtp_config, test_email, email_service):
+        """Test batch status lookup"""
+        test_email.update_status('failed', 'No such user', 'permanent.550')
+        
+        result = email_service.get_email_statuses([test_email.id, 999, test_email.id])
+        
+        assert result['missing'] == [999]
+        assert len(result['emails']) == 1
+        status = result['emails'][0]
+        assert status['id'] == test_email.id
+        assert status['status'] == 'failed'
+        assert status['error_code'] == 'permanent.550'
+        assert status['smtp_config'] == "Test SMTP"
+    
+    def test_create_email_stores_recipients(self, db, smtp_config, email_service):
+        """Test every address is stored as a normalized recipient row"""
+        email_id = email_service.create_email(
+            subject="S", recipients=["A@Example.com"], html_content="<p>x</p>",
+            smtp_config_id=smtp_config.id, cc=["cc@other.org"], bcc=["bcc@example.com"]
+        )
+        
+        rows = EmailRecipient.select().where(EmailRecipient.email_id == email_id).order_by(EmailRecipient.id)
+        assert [(r.kind, r.address, r.domain, r.status) for r in rows] == [
+            ('to', 'a@example.com', 'example.com', 'pending'),
+            ('cc', 'cc@other.org', 'other.org', 'pending'),
+            ('bcc', 'bcc@example.com', 'example.com', 'pending'),
+        ]
+    
+    def test_get_emails_by_recipient(self, db, smtp_config, email_service):
+        """Test looking up emails by address and by domain, newest first"""
+        results = email_service.create_emails_batch([
+            {'subject': "First", 'recipients': ["user@example.com"], 'html_content': "<p>1</p>"},
+            {'subject': "Second", 'recipients': ["other@example.com"], 'cc': ["USER@example.com"],
+             'html_content': "<p>2</p>"},
+        ])
+        first_id, second_id = [result['email_id'] for result in results]
+        
+        rows = email_service.get_emails_by_recipient(address="User@Example.com")
+        assert [(row['email_id'], row['kind']) for row in rows] == [(second_id, 'cc'), (first_id, 'to')]
+        assert rows[0]['subject'] == "Second"
+        assert rows[0]['email_status'] == 'queued'
+        
+        page = email_service.get_emails_by_recipient(domain="example.com", limit=2)
+        assert len(page) == 2
+        rest = email_service.get_emails_by_recipient(domain="example.com", cursor=page[-1]['id'])
+        assert [row['email_id'] for row in rest] == [first_id]
+        
+        with pytest.raises(ValueError):
+            email_service.get_emails_by_recipient()
+    
+    def test_failure_handling_updates_delivery_stats(self, db, test_email, email_service):
+        """Test retries and final failures are counted in the delivery rollups"""
+        email_service.handle_failed_email(test_email.id, 3)
+        
+        test_email.retry_count = 3
+        test_email.save()
+        email_service.handle_failed_email(test_email.id, 3)
+        
+        row = DeliveryStat.get(DeliveryStat.smtp_config_id == test_email.smtp_config_id)
+        assert row.retried == 1
+        assert row.given_up == 1
+        
+        totals = email_service.get_delivery_stats(datetime(2000, 1, 1), datetime(2100, 1, 1), granularity='total')['totals']
+        assert (totals['retried'], totals['given_up']) == (1, 1)
+    
+    def test_cancel_email(self, db, test_email, email_service, mock_queue):
+        """Test a queued email is cancelled and taken out of the queue"""
+        email_service.scheduler = MagicMock()
+        email_service.cancel_email(test_email.id)
+        
+        assert EmailMessage.get_by_id(test_email.id).status == 'cancelled'
+        mock_queue.cancel.assert_called_once_with(test_email.id)
+        email_service.scheduler.cancel.assert_called_once_with(test_email.id)
+        
+        # Already cancelled, and the same once sent
+        with pytest.raises(EmailNotPendingError) as excinfo:
+            email_service.cancel_email(test_email.id)
+        assert excinfo.value.status == 'cancelled'
+        
+        with pytest.raises(DoesNotExist):
+            email_service.cancel_email(test_email.id + 1)
+    
+    def test_update_email_priority(self, db, test_email, email_service, mock_queue):
+        email_service.update_email_priority(test_email.id, 4)
+        
+        assert EmailMessage.get_by_id(test_email.id).priority == 4
+        mock_queue.reprioritize.assert_called_once_with(test_email.id, 4)
+        
+        test_email.update_status('sending')
+        with pytest.raises(EmailNotPendingError):
+            email_service.update_email_priority(test_email.id, 1)
+        assert EmailMessage.get_by_id(test_email.id).priority == 4
+        
+        with pytest.raises(DoesNotExist):
+            email_service.update_email_priority(test_email.id + 1, 1)
 
 
 class TestEmailSender:
@@ -173,4 +459,207 @@ class TestEmailSender:
         # Verify SMTP config counters were not updated
         smtp_config.refresh()
         assert smtp_config.sent_count_today == 0
-        assert smtp_config.sent_count_hour == 0
\ No newline at end of file
+        assert smtp_config.sent_count_hour == 0
+    
+    @patch('smtplib.SMTP')
+    def test_send_email_records_error_code(self, mock_smtp, db, test_email, smtp_config):
+        """Test that a failed send records a structured error code"""
+        mock_smtp.return_value.sendmail.side_effect = smtplib.SMTPRecipientsRefused(
+            {'recipient@example.com': (550, b'No such user')}
+        )
+        
+        success, message = EmailSender.send_email(test_email.id)
+        
+        assert success is False
+        email = EmailMessage.get_by_id(test_email.id)
+        assert email.status == 'failed'
+        assert email.error_code == 'recipient.550'
+    
+    @patch('smtplib.SMTP')
+    def test_send_email_partial_refusal(self, mock_smtp, db, test_email, smtp_config):
+        """Test that refusals returned by sendmail are recorded on a sent email"""
+        mock_smtp.return_value.sendmail.return_value = {'recipient@example.com': (550, b'No such user')}
+        
+        success, message = EmailSender.send_email(test_email.id)
+        
+        assert success is True
+        email = EmailMessage.get_by_id(test_email.id)
+        assert email.status == 'sent'
+        assert email.error_code == 'recipient.550'
+        assert 'recipient@example.com' in email.error_message
+    
+    @patch('smtplib.SMTP')
+    def test_send_email_quota(self, mock_smtp, db, test_email, smtp_config):
+        """Test a send takes quota and a failed one gives it back"""
+        EmailSender.send_email(test_email.id)
+        assert SmtpConfig.get_by_id(smtp_config.id).sent_count_hour == 1
+        
+        failing = EmailMessage.create(subject="S", sender="", recipients='["a@example.com"]',
+                                      html_content="<p>x</p>", smtp_config_id=smtp_config.id)
+        mock_smtp.return_value.sendmail.side_effect = smtplib.SMTPServerDisconnected("gone")
+        EmailSender.send_email(failing.id)
+        assert SmtpConfig.get_by_id(smtp_config.id).sent_count_hour == 1
+    
+    @patch('smtplib.SMTP')
+    def test_send_email_records_recipient_replies(self, mock_smtp, db, smtp_config):
+        """Test each recipient gets the server's verdict"""
+        email_id = EmailService().create_email(
+            subject="S", recipients=["ok@example.com", "Gone@example.com"], html_content="<p>x</p>",
+            smtp_config_id=smtp_config.id
+        )
+        mock_smtp.return_value.sendmail.return_value = {'Gone@example.com': (550, b'No such user')}
+        
+        EmailSender.send_email(email_id)
+        
+        rows = {r.address: r for r in EmailRecipient.select().where(EmailRecipient.email_id == email_id)}
+        assert rows['ok@example.com'].status == 'accepted'
+        assert rows['gone@example.com'].status == 'refused'
+        assert rows['gone@example.com'].smtp_code == 550
+        assert rows['gone@example.com'].smtp_reply == 'No such user'
+    
+    @patch('smtplib.SMTP')
+    def test_send_email_uses_timeouts(self, mock_smtp, db, test_email, smtp_config):
+        """Test that connect, command and data timeouts are applied"""
+        smtp_config.connect_timeout = 5
+        smtp_config.command_timeout = 15
+        smtp_config.data_timeout = 60
+        smtp_config.save()
+        
+        server = mock_smtp.return_value
+        
+        success, message = EmailSender.send_email(test_email.id)
+        
+        assert success is True
+        mock_smtp.assert_called_once_with("smtp.example.com", 587, timeout=5)
+        timeouts = [c.args[0] for c in server.sock.settimeout.call_args_list]
+        assert timeouts == [15, 60]
+        server.close.assert_called_once()
+    
+    @patch('smtplib.SMTP')
+    def test_send_email_skips_cancelled(self, mock_smtp, db, test_email, smtp_config):
+        """Test an email cancelled after it was queued elsewhere is not sent"""
+        test_email.update_status('cancelled')
+        
+        assert EmailSender.send_email(test_email.id) == (True, "Email was cancelled")
+        mock_smtp.assert_not_called()
+        assert SmtpConfig.get_by_id(smtp_config.id).sent_count_today == 0
+    
+    @patch('smtplib.SMTP')
+    def test_cancel_while_sending(self, mock_smtp, db, test_email, smtp_config, email_service):
+        """Test a cancel racing a worker either stops the send or is refused, never both"""
+        # Cancelled after the worker read the email, before it claimed it
+        real_get = smtp_config_cache.get
+        def cancel_then_get(config_id):
+            email_service.cancel_email(test_email.id)
+            return real_get(config_id)
+        with patch.object(smtp_config_cache, 'get', side_effect=cancel_then_get):
+            assert EmailSender.send_email(test_email.id) == (True, "Email is no longer queued")
+        mock_smtp.return_value.sendmail.assert_not_called()
+        assert EmailMessage.get_by_id(test_email.id).status == 'cancelled'
+        assert SmtpConfig.get_by_id(smtp_config.id).sent_count_hour == 0
+        
+        # Cancelled once the worker claimed it
+        other = EmailMessage.create(subject="S", sender="", recipients='["a@example.com"]',
+                                    html_content="<p>x</p>", smtp_config_id=smtp_config.id)
+        refused = []
+        def cancel_during_login(*args):
+            with pytest.raises(EmailNotPendingError) as excinfo:
+                email_service.cancel_email(other.id)
+            refused.append(excinfo.value.status)
+        mock_smtp.return_value.login.side_effect = cancel_during_login
+        assert EmailSender.send_email(other.id)[0] is True
+        assert refused == ['sending']
+        assert EmailMessage.get_by_id(other.id).status == 'sent'
+    
+    @patch('smtplib.SMTP')
+    def test_send_email_quota_exhausted_stays_queued(self, mock_smtp, db, test_email, smtp_config):
+        smtp_config.hourly_limit = 0
+        smtp_config.save()
+        
+        assert EmailSender.send_email(test_email.id) == (False, "SMTP sending limits reached")
+        assert EmailMessage.get_by_id(test_email.id).status == 'queued'
+    
+    def test_retry_requeues_as_queued(self, db, test_email, email_service):
+        """Test a failed email is queued again, so a worker can claim it and it can be cancelled"""
+        test_email.update_status('failed', "SMTP error")
+        
+        email_service.handle_failed_email(test_email.id, 3)
+        
+        email = EmailMessage.get_by_id(test_email.id)
+        assert (email.status, email.retry_count, email.error_message) == ('queued', 1, "SMTP error")
+        email_service.queue_service.enqueue.assert_called_once_with(test_email.id, 2)
+    
+    def test_abort_closes_active_connection(self):
+        """Test aborting an in-flight send closes its socket"""
+        server = MagicMock()
+        EmailSender._active_connections[42] = server
+        
+        assert EmailSender.abort(42) is True
+        server.sock.shutdown.assert_called_once()
+        server.close.assert_called_once()
+        
+        # Nothing left to abort
+        assert EmailSender.abort(42) is False
+        EmailSender._aborted_connections.discard(server)
+    
+    @patch('smtplib.SMTP')
+    def test_aborted_send_is_left_queued(self, mock_smtp, db, test_email, smtp_config, email_service):
+        """Test an attempt aborted by the watchdog hands the email back instead of failing it"""
+        def stuck(*args):
+            assert email_service.abort_send(test_email.id) is True
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        mock_smtp.return_value.sendmail.side_effect = stuck
+        
+        success, _ = EmailSender.send_email(test_email.id)
+        
+        assert success is False
+        assert EmailMessage.get_by_id(test_email.id).status == 'queued'
+        assert SmtpConfig.get_by_id(smtp_config.id).sent_count_hour == 0
+        assert not EmailSender._aborted_connections
+    
+    @patch('smtplib.SMTP')
+    def test_no_abort_once_delivered(self, mock_smtp, db, test_email, smtp_config, email_service):
+        """Test an attempt stuck after the message went out can't be aborted and requeued"""
+        def stuck_quitting():
+            assert email_service.abort_send(test_email.id) is False
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        mock_smtp.return_value.quit.side_effect = stuck_quitting
+        
+        assert EmailSender.send_email(test_email.id)[0] is True
+        assert EmailMessage.get_by_id(test_email.id).status == 'sent'
+    
+    @patch('smtplib.SMTP')
+    def test_abort_as_the_message_goes_out(self, mock_smtp, db, test_email, smtp_config, email_service):
+        """Test an attempt aborted just as the server accepted the message takes back its requeue"""
+        def accepted_while_aborting(*args):
+            assert email_service.abort_send(test_email.id) is True
+            return {}
+        mock_smtp.return_value.sendmail.side_effect = accepted_while_aborting
+        
+        # The copy the watchdog queued again is picked up before this attempt writes 'sent'
+        record_sent = EmailSender._record_sent
+        retries = []
+        def retry_first(email, refusal):
+            if not retries:
+                retries.append(EmailSender.send_email(test_email.id))
+            record_sent(email, refusal)
+        
+        with patch.object(EmailSender, '_record_sent', side_effect=retry_first):
+            assert EmailSender.send_email(test_email.id)[0] is True
+        
+        assert retries == [(True, "Email is no longer queued")]
+        assert mock_smtp.return_value.sendmail.call_count == 1
+        assert EmailMessage.get_by_id(test_email.id).status == 'sent'
+        assert not EmailSender._aborted_connections
+    
+    @patch('smtplib.SMTP')
+    def test_sent_status_write_timeout(self, mock_smtp, db, test_email, smtp_config):
+        """Test a delivered email whose status write times out is still recorded as sent, not failed"""
+        with patch('services.email_service.status_writer') as writer:
+            writer.submit.side_effect = TimeoutError("Timed out waiting for the status of email")
+            success, _ = EmailSender.send_email(test_email.id)
+        
+        assert success is True
+        email = EmailMessage.get_by_id(test_email.id)
+        assert (email.status, email.error_code) == ('sent', None)
+        assert SmtpConfig.get_by_id(smtp_config.id).sent_count_hour == 1
\ No newline at end of file
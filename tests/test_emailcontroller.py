@@ -0,0 +1,350 @@
+import pytest,os,sys,json
+
+from flask import Flask, Blueprint
+from unittest.mock import MagicMock
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from types import SimpleNamespace
+from datetime import datetime
+from controllers.email_controller import EmailController
+from services.status_events import StatusEventBus
+from services.suppression import RecipientsSuppressedError
+from services.idempotency import IdempotencyKeyReusedError
+from services.email_service import EmailNotPendingError
+from peewee import DoesNotExist
+
+@pytest.fixture
+def mock_email_service():
+    """Create a mock email service for testing"""
+    service = MagicMock()
+    return service
+
+@pytest.fixture
+def email_controller(mock_email_service):
+    """Create an email controller with a mock email service"""
+    return EmailController(mock_email_service)
+
+@pytest.fixture
+def blueprint():
+    """Create a fresh blueprint for each test"""
+    return Blueprint('email', __name__)
+
+@pytest.fixture
+def app(blueprint, email_controller):
+    """Create a Flask test app with the email controller registered"""
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    
+    email_controller.register_routes(blueprint)
+    app.register_blueprint(blueprint)
+    
+    return app
+
+@pytest.fixture
+def client(app):
+    """Create a test client for the app"""
+    with app.test_client() as client:
+        yield client
+
+def make_email(**overrides):
+    email = {
+        'subject': 'Test Subject',
+        'recipients': ['test@example.com'],
+        'html_content': '<p>Test content</p>'
+    }
+    email.update(overrides)
+    return email
+
+
+class TestCreateEmail:
+    def test_reports_every_invalid_address(self, client, mock_email_service):
+        response = client.post('/emails', json=make_email(recipients=['bad-one', 'ok@example.com', 'bad-two'],
+                                                          cc=['bad-cc']))
+        
+        assert response.status_code == 400
+        assert response.json['invalid_addresses'] == [
+            {'field': 'recipients', 'address': 'bad-one'},
+            {'field': 'recipients', 'address': 'bad-two'},
+            {'field': 'cc', 'address': 'bad-cc'}
+        ]
+        mock_email_service.create_email.assert_not_called()
+    
+    def test_all_recipients_suppressed(self, client, mock_email_service):
+        mock_email_service.create_email.side_effect = RecipientsSuppressedError(['test@example.com'])
+        response = client.post('/emails', json=make_email())
+        
+        assert response.status_code == 422
+        assert response.json['suppressed'] == ['test@example.com']
+    
+    def test_idempotency_key_header(self, client, mock_email_service):
+        mock_email_service.create_email.return_value = 5
+        response = client.post('/emails', json=make_email(), headers={'Idempotency-Key': 'order-1'})
+        
+        assert response.status_code == 201
+        assert mock_email_service.create_email.call_args.kwargs['idempotency_key'] == 'order-1'
+        
+        mock_email_service.create_email.side_effect = IdempotencyKeyReusedError('order-1')
+        response = client.post('/emails', json=make_email(idempotency_key='order-1'))
+        assert response.status_code == 422
+
+    def test_scheduled(self, client, mock_email_service):
+        mock_email_service.create_email.return_value = 5
+        response = client.post('/emails', json=make_email(send_at='2999-01-01T08:00:00'))
+        
+        assert response.status_code == 201
+        assert response.json['send_at'] == '2999-01-01T08:00:00'
+        assert 'scheduled' in response.json['message']
+        assert mock_email_service.create_email.call_args.kwargs['send_at'] == datetime(2999, 1, 1, 8)
+
+class TestChangeEmail:
+    def test_cancel(self, client, mock_email_service):
+        response = client.delete('/emails/5')
+        
+        assert response.status_code == 200
+        mock_email_service.cancel_email.assert_called_once_with(5)
+        
+        mock_email_service.cancel_email.side_effect = EmailNotPendingError(5, 'sent')
+        response = client.delete('/emails/5')
+        assert response.status_code == 409
+        assert response.json['status'] == 'sent'
+        
+        mock_email_service.cancel_email.side_effect = DoesNotExist()
+        assert client.delete('/emails/6').status_code == 404
+    
+    def test_update_priority(self, client, mock_email_service):
+        response = client.patch('/emails/5', json={'priority': '2'})
+        
+        assert response.status_code == 200
+        assert response.json['priority'] == 2
+        mock_email_service.update_email_priority.assert_called_once_with(5, 2)
+        
+        for body in ({'priority': 9}, {'subject': 'New'}, {'priority': 1, 'subject': 'New'}):
+            assert client.patch('/emails/5', json=body).status_code == 400
+        assert mock_email_service.update_email_priority.call_count == 1
+        
+        mock_email_service.update_email_priority.side_effect = EmailNotPendingError(5, 'sending')
+        assert client.patch('/emails/5', json={'priority': 1}).status_code == 409
+
+class TestCreateEmailsBatch:
+    def test_create_batch_success(self, client, mock_email_service):
+        mock_email_service.create_emails_batch.return_value = [
+            {'index': 0, 'email_id': 10},
+            {'index': 1, 'email_id': 11}
+        ]
+        response = client.post('/emails/batch', json=[make_email(), make_email(priority=3)])
+        
+        assert response.status_code == 201
+        assert response.json['created'] == 2
+        assert [r['email_id'] for r in response.json['results']] == [10, 11]
+        mock_email_service.create_emails_batch.assert_called_once()
+
+    def test_create_batch_partial(self, client, mock_email_service):
+        mock_email_service.create_emails_batch.return_value = [{'index': 0, 'email_id': 10}]
+        response = client.post('/emails/batch', json={'emails': [
+            make_email(recipients=['invalid-email']),
+            make_email()
+        ]})
+        
+        assert response.status_code == 207
+        results = response.json['results']
+        assert 'Invalid recipient email format' in results[0]['error']
+        assert results[1] == {'index': 1, 'email_id': 10}
+        
+        # Only the valid item reaches the service
+        items = mock_email_service.create_emails_batch.call_args[0][0]
+        assert len(items) == 1
+
+    def test_create_batch_rejects_oversized_list(self, client, mock_email_service):
+        """Test a list too long for its column fails alone instead of rolling back the batch"""
+        mock_email_service.create_emails_batch.return_value = [{'index': 0, 'email_id': 10}]
+        many = [f'user{i}@example.com' for i in range(200)]
+        response = client.post('/emails/batch', json=[make_email(), make_email(cc=many)])
+        
+        assert response.status_code == 207
+        assert 'Too many CC addresses' in response.json['results'][1]['error']
+        assert len(mock_email_service.create_emails_batch.call_args[0][0]) == 1
+
+    def test_create_batch_all_invalid(self, client, mock_email_service):
+        response = client.post('/emails/batch', json=[make_email(recipients=[])])
+        
+        assert response.status_code == 400
+        assert response.json['created'] == 0
+        mock_email_service.create_emails_batch.assert_not_called()
+
+    def test_create_batch_empty(self, client, mock_email_service):
+        response = client.post('/emails/batch', json=[])
+        assert response.status_code == 400
+
+    def test_create_batch_too_large(self, app, client, mock_email_service):
+        app.config['BATCH_MAX_SIZE'] = 2
+        response = client.post('/emails/batch', json=[make_email()] * 3)
+        assert response.status_code == 413
+
+
+class TestCreateEmailsStream:
+    def test_stream_results_per_line(self, app, client, mock_email_service):
+        app.config['STREAM_CHUNK_SIZE'] = 2
+        mock_email_service.create_emails_batch.side_effect = lambda items: [
+            {'index': i, 'email_id': 100 + i} for i in range(len(items))
+        ]
+        body = '\n'.join([
+            json.dumps(make_email()),
+            '{not json',
+            '',
+            json.dumps(make_email(recipients=['invalid-email'])),
+            json.dumps(make_email()),
+        ]) + '\n'
+        
+        response = client.post('/emails/stream', data=body, content_type='application/x-ndjson')
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert lines[0] == {'line': 1, 'email_id': 100}
+        assert lines[1]['line'] == 2 and 'Invalid JSON' in lines[1]['error']
+        assert lines[2]['line'] == 4 and 'Invalid recipient' in lines[2]['error']
+        assert lines[3] == {'line': 5, 'email_id': 100}
+        assert lines[4] == {'summary': {'created': 2, 'failed': 2}}
+        
+        # Valid lines were inserted in bounded chunks
+        assert mock_email_service.create_emails_batch.call_count == 2
+
+    def test_stream_chunk_failure_does_not_abort(self, app, client, mock_email_service):
+        app.config['STREAM_CHUNK_SIZE'] = 1
+        mock_email_service.create_emails_batch.side_effect = [
+            Exception("Database unavailable"),
+            [{'index': 0, 'email_id': 7}]
+        ]
+        body = json.dumps(make_email()) + '\n' + json.dumps(make_email()) + '\n'
+        
+        response = client.post('/emails/stream', data=body, content_type='application/x-ndjson')
+        
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert lines[0] == {'line': 1, 'error': "Database unavailable"}
+        assert lines[1] == {'line': 2, 'email_id': 7}
+
+
+class TestGetEmailsByStatus:
+    def test_next_cursor_header(self, client, mock_email_service):
+        mock_email_service.get_emails_by_status.return_value = [
+            {'id': 1, 'created_at': '2024-01-01T12:00:00'},
+            {'id': 2, 'created_at': '2024-01-01T12:01:00'}
+        ]
+        mock_email_service.encode_cursor.return_value = 'abc'
+        
+        response = client.get('/emails/status/queued?limit=2&priority=3&cursor=xyz')
+        
+        assert response.status_code == 200
+        assert response.headers['X-Next-Cursor'] == 'abc'
+        mock_email_service.get_emails_by_status.assert_called_once_with('queued', 2, cursor='xyz', priority=3)
+        mock_email_service.encode_cursor.assert_called_once_with('2024-01-01T12:01:00', 2)
+
+    def test_last_page_has_no_cursor(self, client, mock_email_service):
+        mock_email_service.get_emails_by_status.return_value = [{'id': 1, 'created_at': '2024-01-01T12:00:00'}]
+        
+        response = client.get('/emails/status/queued?limit=2')
+        
+        assert 'X-Next-Cursor' not in response.headers
+        mock_email_service.get_emails_by_status.assert_called_once_with('queued', 2)
+
+    def test_large_limit_is_clamped(self, client, mock_email_service):
+        mock_email_service.get_emails_by_status.return_value = []
+        
+        assert client.get('/emails/status/queued?limit=5000').status_code == 200
+        mock_email_service.get_emails_by_status.assert_called_once_with('queued', 1000)
+
+    def test_invalid_filters(self, client, mock_email_service):
+        assert client.get('/emails/status/queued?created_after=yesterday').status_code == 400
+        assert client.get('/emails/status/queued?limit=0').status_code == 400
+        
+        mock_email_service.get_emails_by_status.side_effect = ValueError("Invalid cursor")
+        response = client.get('/emails/status/queued?cursor=bad')
+        assert response.status_code == 400
+        assert response.json == {'error': 'Invalid cursor'}
+
+
+class TestGetEmailStatuses:
+    def test_status_batch_get(self, client, mock_email_service):
+        mock_email_service.get_email_statuses.return_value = {'emails': [{'id': 1, 'status': 'sent'}], 'missing': [2]}
+        
+        response = client.get('/emails/status-batch?ids=1,2')
+        
+        assert response.status_code == 200
+        assert response.json['missing'] == [2]
+        mock_email_service.get_email_statuses.assert_called_once_with([1, 2])
+
+    def test_status_batch_post(self, client, mock_email_service):
+        mock_email_service.get_email_statuses.return_value = {'emails': [], 'missing': []}
+        
+        response = client.post('/emails/status-batch', json={'ids': [3, 4, 5]})
+        
+        assert response.status_code == 200
+        mock_email_service.get_email_statuses.assert_called_once_with([3, 4, 5])
+
+    def test_status_batch_invalid(self, app, client, mock_email_service):
+        assert client.get('/emails/status-batch').status_code == 400
+        assert client.get('/emails/status-batch?ids=1,abc').status_code == 400
+        assert client.post('/emails/status-batch', json=[1, 2]).status_code == 400
+        
+        app.config['STATUS_BATCH_MAX'] = 2
+        assert client.post('/emails/status-batch', json={'ids': [1, 2, 3]}).status_code == 413
+        mock_email_service.get_email_statuses.assert_not_called()
+
+
+def make_event_email(email_id, campaign=None):
+    return SimpleNamespace(id=email_id, status='sent', smtp_config_id=1, campaign=campaign,
+                           retry_count=0, error_code=None, updated_at=datetime(2024, 1, 1))
+
+
+class TestStatusEvents:
+    @pytest.fixture
+    def bus(self, mock_email_service):
+        bus = StatusEventBus()
+        mock_email_service.subscribe_status_events.side_effect = bus.subscribe
+        return bus
+
+    def test_poll_returns_events_after_cursor(self, client, bus, mock_email_service):
+        cursor = bus.make_cursor(0)
+        bus.publish(make_event_email(1, campaign='spring'))
+        bus.publish(make_event_email(2))
+        
+        response = client.get(f'/emails/events/poll?campaign=spring&cursor={cursor}&wait=0')
+        
+        assert response.status_code == 200
+        assert [event['email_id'] for event in response.json['events']] == [1]
+        assert response.json['cursor'] == bus.make_cursor(2)
+        assert response.json['gap'] is False
+        mock_email_service.subscribe_status_events.assert_called_once_with(
+            buffer_size=1000, campaign='spring', cursor=cursor)
+
+    def test_poll_invalid_cursor(self, client, bus):
+        assert client.get('/emails/events/poll?cursor=bad&wait=0').status_code == 400
+
+    def test_sse_stream(self, app, client, bus):
+        app.config['EVENTS_STREAM_MAX_SECONDS'] = 0.2
+        bus.publish(make_event_email(5))
+        
+        response = client.get('/emails/events?ids=5', headers={'Last-Event-ID': bus.make_cursor(0)})
+        
+        assert response.mimetype == 'text/event-stream'
+        body = response.get_data(as_text=True)
+        assert f"id: {bus.make_cursor(1)}\nevent: status\n" in body
+        assert '"email_id": 5' in body
+
+
+class TestGetEmailsByRecipient:
+    def test_lookup_by_address(self, client, mock_email_service):
+        mock_email_service.get_emails_by_recipient.return_value = [{'id': 9, 'email_id': 3}, {'id': 7, 'email_id': 2}]
+        
+        response = client.get('/emails/recipients?address=user@example.com&limit=2&cursor=12')
+        
+        assert response.status_code == 200
+        assert response.headers['X-Next-Cursor'] == '7'
+        mock_email_service.get_emails_by_recipient.assert_called_once_with(
+            limit=2, address='user@example.com', cursor=12)
+
+    def test_invalid_lookup(self, client, mock_email_service):
+        assert client.get('/emails/recipients?domain=example.com&cursor=abc').status_code == 400
+        
+        mock_email_service.get_emails_by_recipient.side_effect = ValueError("Exactly one of address or domain is required")
+        response = client.get('/emails/recipients')
+        assert response.status_code == 400
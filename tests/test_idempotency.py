@@ -0,0 +1,104 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from models.email_model import EmailMessage, IdempotencyKey
+from services.email_service import EmailService
+from services.idempotency import IdempotencyStore, IdempotencyKeyReusedError, idempotency_store
+
+def create(service, smtp_config, key, subject="S"):
+    return service.create_email(subject=subject, recipients=['a@example.com'], html_content="<p>x</p>",
+                                smtp_config_id=smtp_config.id, idempotency_key=key)
+
+class TestIdempotencyStore:
+    def test_lookup_falls_back_to_the_table(self, db):
+        """Test a key written by another process is found and then cached"""
+        IdempotencyKey.create(key='k1', email_id=7, fingerprint='f')
+        store = IdempotencyStore()
+
+        assert store.lookup('k1').email_id == 7
+        IdempotencyKey.delete().execute()
+        assert store.lookup('k1').email_id == 7  # From the cache
+        assert store.lookup('other') is None
+
+    def test_cache_is_bounded(self, db):
+        store = IdempotencyStore(max_entries=2)
+        for key in ('a', 'b', 'c'):
+            store.committed(key, store.insert(key, 1, 'f'))
+
+        assert list(store._entries) == ['b', 'c']
+
+    def test_expired_key_can_be_used_again(self, db):
+        store = IdempotencyStore(ttl=60)
+        IdempotencyKey.create(key='k1', email_id=7, fingerprint='f', created_at=datetime.now() - timedelta(minutes=2))
+
+        assert store.lookup('k1') is None
+        assert IdempotencyKey.select().count() == 0
+
+    def test_purge_expired(self, db):
+        store = IdempotencyStore(ttl=60)
+        IdempotencyKey.create(key='old', email_id=1, fingerprint='f', created_at=datetime.now() - timedelta(hours=1))
+        IdempotencyKey.create(key='new', email_id=2, fingerprint='f')
+
+        assert store.purge_expired() == 1
+        assert store.purge_expired() == 0  # Not due yet
+        assert [row.key for row in IdempotencyKey.select()] == ['new']
+
+
+class TestIdempotentCreate:
+    def test_repeated_request_returns_the_first_email(self, db, smtp_config, email_service, mock_queue):
+        first = create(email_service, smtp_config, 'order-1')
+
+        with patch.object(IdempotencyKey, 'select') as select:
+            assert create(email_service, smtp_config, 'order-1') == first
+            select.assert_not_called()  # Answered from the cache
+
+        assert EmailMessage.select().count() == 1
+        mock_queue.enqueue.assert_called_once()
+
+    def test_repeated_request_after_restart(self, db, smtp_config, email_service):
+        first = create(email_service, smtp_config, 'order-1')
+        idempotency_store.reset()
+
+        assert create(email_service, smtp_config, 'order-1') == first
+        assert EmailMessage.select().count() == 1
+
+    def test_key_reused_for_another_email(self, db, smtp_config, email_service):
+        create(email_service, smtp_config, 'order-1')
+
+        with pytest.raises(IdempotencyKeyReusedError):
+            create(email_service, smtp_config, 'order-1', subject="Something else")
+
+    def test_concurrent_request_committed_first(self, db, smtp_config, email_service):
+        """Test losing the race on the unique key returns the winner's email"""
+        winner = create(email_service, smtp_config, 'order-1')
+
+        # This request checked the cache before the winner committed
+        with patch.object(idempotency_store, 'cached', return_value=None):
+            assert create(email_service, smtp_config, 'order-1') == winner
+        assert EmailMessage.select().count() == 1
+
+    def test_new_key_is_not_looked_up(self, db, smtp_config, email_service):
+        """Test a key missing from the cache is inserted without reading the table first"""
+        with patch.object(idempotency_store, 'lookup') as lookup:
+            create(email_service, smtp_config, 'order-1')
+            lookup.assert_not_called()
+
+        assert IdempotencyKey.select().count() == 1
+
+    def test_expired_key_creates_a_new_email(self, db, smtp_config, email_service):
+        first = create(email_service, smtp_config, 'order-1')
+        IdempotencyKey.update(created_at=datetime.now() - timedelta(days=2)).execute()
+        idempotency_store.reset()
+
+        second = create(email_service, smtp_config, 'order-1')
+
+        assert second != first
+        assert IdempotencyKey.get().email_id == second
+
+    def test_keyed_requests_skip_group_commit(self, db, smtp_config, email_service):
+        email_service.ingest_writer = object()  # Must not be used
+
+        email_id = create(email_service, smtp_config, 'order-1')
+
+        assert IdempotencyKey.get().email_id == email_id
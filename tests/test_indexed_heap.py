@@ -0,0 +1,59 @@
+import pytest
+import random
+
+from utils.indexed_heap import IndexedHeap
+
+class TestIndexedHeap:
+    def test_pop_in_priority_order(self):
+        """Test keys come out ordered by priority"""
+        heap = IndexedHeap()
+        priorities = list(range(50))
+        random.shuffle(priorities)
+        for key, priority in enumerate(priorities):
+            heap.push(key, priority)
+        
+        popped = [heap.pop()[1] for _ in range(len(heap))]
+        assert popped == sorted(priorities)
+    
+    def test_update_priority(self):
+        """Test pushing an existing key changes its priority"""
+        heap = IndexedHeap()
+        heap.push('a', 1)
+        heap.push('b', 2)
+        heap.push('c', 3)
+        
+        heap.push('c', 0)
+        assert heap.peek() == ('c', 0)
+        
+        heap.push('c', 10)
+        assert heap.peek() == ('a', 1)
+        assert len(heap) == 3
+    
+    def test_remove(self):
+        """Test removing arbitrary keys keeps the heap valid"""
+        heap = IndexedHeap()
+        for key in range(20):
+            heap.push(key, key)
+        
+        for key in (0, 7, 19, 3):
+            assert heap.remove(key) == key
+        
+        assert 7 not in heap
+        remaining = [heap.pop()[0] for _ in range(len(heap))]
+        assert remaining == [k for k in range(20) if k not in (0, 7, 19, 3)]
+        
+        with pytest.raises(KeyError):
+            heap.remove(7)
+    
+    def test_peek_excluding(self):
+        """Test peeking past an excluded root"""
+        heap = IndexedHeap()
+        assert heap.peek() is None
+        
+        heap.push('a', 1)
+        assert heap.peek(exclude='a') is None
+        
+        heap.push('b', 3)
+        heap.push('c', 2)
+        assert heap.peek(exclude='a') == ('c', 2)
+        assert heap.peek(exclude='b') == ('a', 1)
@@ -0,0 +1,94 @@
+import pytest
+import threading
+from unittest.mock import MagicMock
+
+from services.ingest_writer import IngestWriter, _PendingRow
+
+class TestIngestWriter:
+    def test_concurrent_rows_share_commits(self):
+        """Test rows submitted concurrently are committed in shared batches"""
+        batches = []
+        next_id = [0]
+        lock = threading.Lock()
+        
+        def insert_rows(rows):
+            with lock:
+                batches.append(len(rows))
+                first = next_id[0] + 1
+                next_id[0] += len(rows)
+            return list(range(first, first + len(rows)))
+        
+        writer = IngestWriter(insert_rows, batch_size=50, max_delay=0.05)
+        writer.start()
+        try:
+            results = {}
+            
+            def submit(i):
+                results[i] = writer.submit({'subject': f"Email {i}"})
+            
+            threads = [threading.Thread(target=submit, args=(i,)) for i in range(40)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            writer.stop()
+        
+        # Every request got its own ID, from fewer commits than requests
+        assert sorted(results.values()) == list(range(1, 41))
+        assert sum(batches) == 40
+        assert len(batches) < 40
+    
+    def test_batch_size_limit(self):
+        """Test a batch never exceeds the configured size"""
+        writer = IngestWriter(MagicMock(), batch_size=3, max_delay=1.0)
+        for i in range(5):
+            writer.queue.put(MagicMock())
+        
+        assert len(writer._collect()) == 3
+        assert len(writer._collect()) == 2
+    
+    def test_on_committed_runs_before_wakeup(self):
+        """Test committed rows are handed on, e.g. to the send queue"""
+        on_committed = MagicMock()
+        writer = IngestWriter(lambda rows: [7], on_committed)
+        writer.start()
+        try:
+            assert writer.submit({'priority': 2}) == 7
+        finally:
+            writer.stop()
+        
+        on_committed.assert_called_once_with([{'priority': 2}], [7])
+    
+    def test_commit_failure_is_raised_in_request(self):
+        """Test a failed commit surfaces in every waiting request"""
+        def insert_rows(rows):
+            raise RuntimeError("Deadlock found")
+        
+        writer = IngestWriter(insert_rows)
+        writer.start()
+        try:
+            with pytest.raises(RuntimeError, match="Deadlock"):
+                writer.submit({})
+        finally:
+            writer.stop()
+    
+    def test_bad_row_fails_only_its_request(self):
+        """Test a failed batch is retried in halves until only the bad row fails"""
+        def insert_rows(rows):
+            if any(row.get('bad') for row in rows):
+                raise ValueError("Data too long for column 'subject'")
+            return [row['n'] for row in rows]
+        
+        batch = [_PendingRow({'n': n, 'bad': n == 3}) for n in range(6)]
+        IngestWriter(insert_rows)._commit(batch)
+        
+        assert all(pending.done.is_set() for pending in batch)
+        assert [pending.email_id for pending in batch] == [0, 1, 2, None, 4, 5]
+        assert isinstance(batch[3].error, ValueError)
+        assert [pending.error for pending in batch if pending.error is None] == [None] * 5
+    
+    def test_submit_requires_running_writer(self):
+        """Test submitting to a stopped writer fails fast"""
+        with pytest.raises(RuntimeError):
+            IngestWriter(MagicMock()).submit({})
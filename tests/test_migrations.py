@@ -0,0 +1,79 @@
+import pytest
+from peewee import SqliteDatabase
+from playhouse.migrate import make_index_name
+
+from models.email_model import EmailMessage
+from models.smtp_config import SmtpConfig
+from models.migrations import MIGRATIONS, SchemaVersion, applied_versions, run_migrations
+
+EMAIL_INDEXES = {
+    make_index_name('emailmessage', columns)
+    for columns in (('status', 'priority', 'created_at'), ('status', 'created_at'), ('smtp_config_id', 'status'))
+}
+
+@pytest.fixture
+def legacy_db():
+    """A database with the tables as they were before migrations existed"""
+    test_db = SqliteDatabase(':memory:')
+    test_db.connect()
+    test_db.execute_sql(
+        "CREATE TABLE emailmessage (id INTEGER PRIMARY KEY, subject VARCHAR(255) NOT NULL, "
+        "sender VARCHAR(255) NOT NULL, sender_name VARCHAR(255), recipients VARCHAR(255) NOT NULL, "
+        "cc VARCHAR(255), bcc VARCHAR(255), html_content TEXT NOT NULL, status VARCHAR(255) NOT NULL, "
+        "error_message TEXT, smtp_config_id INTEGER NOT NULL, priority INTEGER NOT NULL, "
+        "retry_count INTEGER NOT NULL, created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL, "
+        "sent_at DATETIME)"
+    )
+    test_db.execute_sql(
+        "CREATE TABLE smtpconfig (id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL UNIQUE, "
+        "email_address VARCHAR(255) NOT NULL, display_name VARCHAR(255), smtp_host VARCHAR(255) NOT NULL, "
+        "smtp_port INTEGER NOT NULL, username VARCHAR(255) NOT NULL, password VARCHAR(255) NOT NULL, "
+        "use_tls INTEGER NOT NULL, use_ssl INTEGER NOT NULL, active INTEGER NOT NULL, "
+        "daily_limit INTEGER NOT NULL, hourly_limit INTEGER NOT NULL, sent_count_today INTEGER NOT NULL, "
+        "sent_count_hour INTEGER NOT NULL, last_sent DATETIME, last_reset_daily DATETIME NOT NULL, "
+        "last_reset_hourly DATETIME NOT NULL, created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)"
+    )
+    test_db.execute_sql(
+        "INSERT INTO smtpconfig VALUES (1, 'Old', 'a@example.com', NULL, 'smtp.example.com', 587, 'a', 'p', "
+        "1, 0, 1, 100, 10, 0, 0, NULL, '2024-01-01', '2024-01-01', '2024-01-01', '2024-01-01')"
+    )
+    yield test_db
+    test_db.close()
+
+class TestMigrations:
+    def test_upgrades_legacy_schema(self, legacy_db):
+        """Test missing columns and indexes are added to existing tables"""
+        applied = run_migrations(legacy_db)
+        
+        assert applied == [item.version for item in MIGRATIONS]
+        email_columns = {c.name for c in legacy_db.get_columns('emailmessage')}
+        assert {'error_code', 'campaign', 'content_hash'} <= email_columns
+        assert EMAIL_INDEXES <= {i.name for i in legacy_db.get_indexes('emailmessage')}
+        
+        # Existing rows get the defaults of the new columns
+        with legacy_db.bind_ctx([SmtpConfig]):
+            config = SmtpConfig.get_by_id(1)
+            assert (config.connect_timeout, config.command_timeout, config.data_timeout) == (10, 30, 120)
+            assert config.version == 1
+    
+    def test_runs_once(self, legacy_db):
+        """Test applied versions are recorded and not run again"""
+        run_migrations(legacy_db)
+        
+        assert run_migrations(legacy_db) == []
+        assert applied_versions(legacy_db) == [item.version for item in MIGRATIONS]
+    
+    def test_target_version(self, legacy_db):
+        """Test migrating up to a given version only"""
+        assert run_migrations(legacy_db, target=1) == [1]
+        assert not EMAIL_INDEXES & {i.name for i in legacy_db.get_indexes('emailmessage')}
+    
+    def test_fresh_database_matches_models(self):
+        """Test a new database created from the models has what the migrations add"""
+        test_db = SqliteDatabase(':memory:')
+        with test_db.bind_ctx([EmailMessage, SmtpConfig, SchemaVersion]):
+            run_migrations(test_db)
+            test_db.create_tables([EmailMessage, SmtpConfig])
+            
+            assert EMAIL_INDEXES <= {i.name for i in test_db.get_indexes('emailmessage')}
+            assert applied_versions(test_db) == [item.version for item in MIGRATIONS]
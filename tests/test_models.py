@@ -1,7 +1,10 @@
 import pytest
 import json
 from datetime import datetime, timedelta
-from models.email_model import EmailMessage
+import zlib
+from unittest.mock import patch
+from peewee import SqliteDatabase
+from models.email_model import EmailMessage, ContentBlob, ThreadConnection, HealthCheckedPooledMySQLDatabase, build_database
 from models.smtp_config import SmtpConfig
 
 class TestEmailMessage:
@@ -60,7 +63,43 @@ class TestEmailMessage:
         
         test_email.increment_retry()
         assert test_email.retry_count == 2
-
+    
+    def test_body_stored_in_content_blob(self, db, test_email):
+        """Test bodies are moved to a shared, compressed blob and loaded lazily"""
+        stored = EmailMessage.get_by_id(test_email.id)
+        assert stored.html_body == ''
+        assert stored.content_hash == ContentBlob.hash_content("<p>Test content</p>")
+        assert stored.html_content == "<p>Test content</p>"
+        
+        blob = ContentBlob.get_by_id(stored.content_hash)
+        assert blob.ref_count == 1
+        assert zlib.decompress(blob.data) == b"<p>Test content</p>"
+        
+        # Projected reads leave the body alone
+        assert 'html_body' not in EmailMessage.select_metadata().where(EmailMessage.id == test_email.id).get().__data__
+    
+    def test_content_blob_deduplicates(self, db):
+        """Test identical bodies share one blob with a reference per email"""
+        hashes = ContentBlob.store_many(["<p>a</p>", "<p>b</p>", "<p>a</p>"])
+        ContentBlob.store("<p>a</p>")
+        
+        assert hashes[0] == hashes[2] != hashes[1]
+        assert ContentBlob.select().count() == 2
+        assert ContentBlob.get_by_id(hashes[0]).ref_count == 3
+        assert ContentBlob.load(hashes[1]) == "<p>b</p>"
+        
+        ContentBlob.release([hashes[0], hashes[1]])
+        assert ContentBlob.get_by_id(hashes[0]).ref_count == 2
+        assert not ContentBlob.select().where(ContentBlob.hash == hashes[1]).exists()
+    
+    def test_legacy_inline_body(self, db, smtp_config):
+        """Test emails stored before content blobs still return their inline body"""
+        email_id = EmailMessage.insert(
+            subject="Old", sender="", recipients='["a@example.com"]', html_body="<p>old</p>",
+            smtp_config_id=smtp_config.id
+        ).execute()
+        
+        assert EmailMessage.get_by_id(email_id).html_content == "<p>old</p>"
 
 class TestSmtpConfig:
     def test_create_smtp_config(self, db):
@@ -141,4 +180,82 @@ class TestSmtpConfig:
         assert smtp_config.sent_count_today == 0
         assert smtp_config.sent_count_hour == 0
         assert smtp_config.last_reset_daily > yesterday
-        assert smtp_config.last_reset_hourly > two_hours_ago
\ No newline at end of file
+        assert smtp_config.last_reset_hourly > two_hours_ago
+    
+    def test_reserve_send(self, db, smtp_config):
+        """Test quota is taken atomically and refused at the limit"""
+        for _ in range(smtp_config.hourly_limit):
+            assert SmtpConfig.reserve_send(smtp_config.id) is True
+        assert SmtpConfig.reserve_send(smtp_config.id) is False
+        
+        config = SmtpConfig.get_by_id(smtp_config.id)
+        assert config.sent_count_hour == config.hourly_limit
+        assert config.sent_count_today == config.hourly_limit
+        
+        SmtpConfig.release_send(smtp_config.id)
+        assert SmtpConfig.get_by_id(smtp_config.id).sent_count_hour == config.hourly_limit - 1
+        assert SmtpConfig.reserve_send(smtp_config.id) is True
+    
+    def test_reserve_send_resets_windows(self, db, smtp_config):
+        """Test passed windows are zeroed in the same statement"""
+        smtp_config.sent_count_today = smtp_config.daily_limit
+        smtp_config.sent_count_hour = smtp_config.hourly_limit
+        smtp_config.last_reset_daily = datetime.now() - timedelta(days=1)
+        smtp_config.last_reset_hourly = datetime.now() - timedelta(hours=2)
+        smtp_config.save()
+        
+        assert SmtpConfig.reserve_send(smtp_config.id) is True
+        
+        config = SmtpConfig.get_by_id(smtp_config.id)
+        assert config.sent_count_today == 1
+        assert config.sent_count_hour == 1
+        assert config.last_reset_daily.date() == datetime.now().date()
+    
+    def test_reserve_send_inactive(self, db, smtp_config):
+        """Test inactive configs never get quota"""
+        smtp_config.active = False
+        smtp_config.save()
+        
+        assert SmtpConfig.reserve_send(smtp_config.id) is False
+        assert SmtpConfig.get_by_id(smtp_config.id).sent_count_today == 0
+
+
+class TestDatabase:
+    def test_sqlite_backend_uses_wal(self, tmp_path, monkeypatch):
+        """Test the SQLite backend opens its file in WAL mode"""
+        monkeypatch.setenv('DB_BACKEND', 'sqlite')
+        monkeypatch.setenv('DB_PATH', str(tmp_path / 'mail.db'))
+        
+        database = build_database()
+        
+        assert isinstance(database, SqliteDatabase)
+        assert database.execute_sql('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        database.close()
+    
+    def test_mysql_backend_is_pooled(self, monkeypatch):
+        """Test the MySQL backend is pooled with the configured limits"""
+        monkeypatch.setenv('DB_BACKEND', 'mysql')
+        monkeypatch.setenv('DB_POOL_MAX_CONNECTIONS', '8')
+        monkeypatch.setenv('DB_POOL_STALE_TIMEOUT', '120')
+        
+        database = build_database()
+        
+        assert isinstance(database, HealthCheckedPooledMySQLDatabase)
+        assert database._max_connections == 8
+        assert database._stale_timeout == 120
+    
+    def test_thread_connection_recycles_idle_connection(self, tmp_path):
+        """Test a worker connection is kept between tasks and handed back after sitting idle"""
+        database = SqliteDatabase(str(tmp_path / 'mail.db'))
+        
+        with ThreadConnection(database, max_idle=60) as connection:
+            database.connect()
+            connection.refresh()
+            assert not database.is_closed()
+            
+            with patch('models.email_model.time.monotonic', return_value=connection.last_used + 61):
+                connection.refresh()
+            assert database.is_closed()
+            
+            database.connect()
+        assert database.is_closed()
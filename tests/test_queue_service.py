@@ -127,4 +127,138 @@ class TestEmailQueue:
         email_queue.email_service.process_queued_email.assert_called_once_with(1)
         
         # Verify failed email was handled
-        email_queue.email_service.handle_failed_email.assert_called_once_with(1, email_queue.max_retries)
\ No newline at end of file
+        email_queue.email_service.handle_failed_email.assert_called_once_with(1, email_queue.max_retries)
+    
+    @patch('threading.Thread')
+    def test_start_workers_with_watchdog(self, mock_thread):
+        """Test that a send deadline starts the watchdog thread"""
+        email_queue = EmailQueue(worker_count=2, send_deadline=60)
+        email_queue.email_service = MagicMock()
+        
+        email_queue.start_workers()
+        
+        # Two workers plus the watchdog
+        assert mock_thread.call_count == 3
+        assert email_queue.watchdog is not None
+    
+    @patch('threading.Thread')
+    def test_check_stuck_workers(self, mock_thread):
+        """Test that a hung send is abandoned, requeued and its worker replaced"""
+        email_queue = EmailQueue(worker_count=1, send_deadline=10)
+        email_queue.email_service = MagicMock()
+        email_queue.running = True
+        email_queue.workers = [MagicMock()]
+        
+        # Worker 0 has been sending email 7 for longer than the deadline
+        email_queue._in_flight[0] = (7, 2, time.monotonic() - 30)
+        
+        assert email_queue.check_stuck_workers() == 1
+        
+        # The attempt was aborted and the email put back with its priority
+        email_queue.email_service.abort_send.assert_called_once_with(7)
+        assert email_queue.queue.get_nowait() == (2, 7)
+        
+        # A replacement worker took over the slot
+        assert mock_thread.call_count == 1
+        assert email_queue.workers[0] is mock_thread.return_value
+        
+        # The stuck thread is told it was abandoned once it returns
+        assert email_queue._finish_attempt(0, 0) is True
+    
+    @patch('threading.Thread')
+    def test_check_stuck_workers_without_connection(self, mock_thread):
+        """Test an attempt stuck outside an SMTP connection is replaced but its email not queued twice"""
+        email_queue = EmailQueue(worker_count=1, send_deadline=10)
+        email_queue.email_service = MagicMock()
+        email_queue.email_service.abort_send.return_value = False
+        email_queue.running = True
+        email_queue.workers = [MagicMock()]
+        email_queue._in_flight[0] = (7, 2, time.monotonic() - 30)
+        
+        assert email_queue.check_stuck_workers() == 1
+        
+        assert email_queue.queue.qsize() == 0
+        assert mock_thread.call_count == 1
+        assert not email_queue._requeued
+    
+    @patch('time.sleep', return_value=None)
+    def test_abandoned_worker_finishes_its_attempt(self, mock_sleep):
+        """Test a worker abandoned without a requeue still retries its failed email, then exits"""
+        email_queue = EmailQueue(worker_count=1, send_deadline=10)
+        email_queue.email_service = MagicMock()
+        email_queue.running = True
+        email_queue.enqueue(7, 2)
+        
+        def stuck(email_id):
+            # The watchdog gives up on the attempt while it is running
+            email_queue._generations[0] = 1
+            return False
+        email_queue.email_service.process_queued_email.side_effect = stuck
+        
+        email_queue._work(0, 0, MagicMock())
+        
+        email_queue.email_service.handle_failed_email.assert_called_once_with(7, email_queue.max_retries)
+        
+        # Had the watchdog queued it again, the retry is left to that copy
+        email_queue.email_service.handle_failed_email.reset_mock()
+        email_queue._generations[0] = 0
+        email_queue._requeued.add((0, 0))
+        email_queue.enqueue(7, 2)
+        email_queue._work(0, 0, MagicMock())
+        email_queue.email_service.handle_failed_email.assert_not_called()
+        assert not email_queue._requeued
+    
+    def test_check_stuck_workers_within_deadline(self):
+        """Test that attempts under the deadline are left alone"""
+        email_queue = EmailQueue(worker_count=1, send_deadline=10)
+        email_queue.email_service = MagicMock()
+        email_queue._in_flight[0] = (7, 2, time.monotonic())
+        
+        assert email_queue.check_stuck_workers() == 0
+        email_queue.email_service.abort_send.assert_not_called()
+        assert email_queue._finish_attempt(0, 0) is False
+    
+    def test_enqueue_many(self):
+        """Test adding several emails at once"""
+        email_queue = EmailQueue(worker_count=1)
+        
+        email_queue.enqueue_many([(1, 3), (2, 1)])
+        
+        assert email_queue.queue.qsize() == 2
+        assert email_queue.queue.get() == (1, 2)
+    
+    def test_cancel(self):
+        """Test a waiting email can be taken out of the queue"""
+        email_queue = EmailQueue(worker_count=1)
+        email_queue.enqueue_many([(1, 1), (2, 1), (3, 2)])
+        
+        assert email_queue.cancel(2) is True
+        assert email_queue.cancel(2) is False
+        
+        assert email_queue.queue.qsize() == 2
+        assert email_queue.queue.get() == (1, 1)
+        assert email_queue.queue.get() == (2, 3)
+        email_queue.queue.task_done()
+        email_queue.queue.task_done()
+        email_queue.queue.join()  # Cancelled emails don't hold up join()
+    
+    def test_reprioritize(self):
+        email_queue = EmailQueue(worker_count=1)
+        email_queue.enqueue_many([(1, 2), (2, 3), (3, 4)])
+        
+        assert email_queue.reprioritize(3, 1) is True
+        assert email_queue.reprioritize(4, 1) is False
+        
+        assert [email_queue.queue.get() for _ in range(3)] == [(1, 3), (2, 1), (3, 2)]
+    
+    def test_enqueue_twice_keeps_one_entry(self):
+        """Test an email put in the queue again is held once, at its higher priority"""
+        email_queue = EmailQueue(worker_count=1)
+        email_queue.enqueue(1, 3)
+        email_queue.enqueue(1, 2)
+        email_queue.enqueue(1, 5)
+        
+        assert email_queue.queue.qsize() == 1
+        assert email_queue.queue.get_nowait() == (2, 1)
+        email_queue.queue.task_done()
+        email_queue.queue.join()
@@ -0,0 +1,97 @@
+import pytest
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from models.email_model import EmailMessage, ContentBlob, EmailRecipient, ArchivedEmail
+from services.retention import RetentionJob, TableArchive, FileArchive
+
+OLD = datetime.now() - timedelta(days=120)
+
+def create_email(smtp_config, status, created_at=OLD, body="<p>Shared body</p>"):
+    email = EmailMessage.create(subject=f"{status} email", sender="", recipients=json.dumps(["a@example.com"]),
+                                html_content=body, status=status, smtp_config_id=smtp_config.id)
+    EmailRecipient.insert_many(EmailRecipient.rows_for(email.id, ["a@example.com"])).execute()
+    EmailMessage.update(created_at=created_at, updated_at=created_at).where(EmailMessage.id == email.id).execute()
+    return email
+
+@pytest.fixture
+def emails(smtp_config):
+    """Old terminal emails, an old email still queued and a recent sent one"""
+    return {
+        'sent': create_email(smtp_config, 'sent'),
+        'failed': create_email(smtp_config, 'failed'),
+        'queued': create_email(smtp_config, 'queued'),
+        'recent': create_email(smtp_config, 'sent', created_at=datetime.now())
+    }
+
+class TestTableArchive:
+    def test_moves_only_old_terminal_emails(self, db, emails):
+        """Test old sent and failed emails move to the archive table in batches"""
+        job = RetentionJob(TableArchive(), max_age_days=90, batch_size=1, batch_pause=0)
+        
+        assert job.run_once() == 2
+        
+        remaining = {email.id for email in EmailMessage.select(EmailMessage.id)}
+        assert remaining == {emails['queued'].id, emails['recent'].id}
+        assert {email.id for email in ArchivedEmail.select()} == {emails['sent'].id, emails['failed'].id}
+        # Archived rows keep their body reference
+        assert ContentBlob.get_by_id(emails['sent'].content_hash).ref_count == 4
+    
+    def test_max_batches(self, db, emails):
+        """Test a run can be limited to a number of batches"""
+        job = RetentionJob(TableArchive(), batch_size=1, batch_pause=0)
+        
+        assert job.run_once(max_batches=1) == 1
+        assert job.run_once() == 1
+        assert job.run_once() == 0
+    
+    def test_get_email_falls_back_to_archive(self, db, emails, email_service):
+        """Test archived emails are still returned by get_email"""
+        email_service.archive = TableArchive()
+        RetentionJob(email_service.archive, batch_pause=0).run_once()
+        
+        result = email_service.get_email(emails['sent'].id)
+        
+        assert result['id'] == emails['sent'].id
+        assert result['status'] == 'sent'
+        assert result['recipients'] == ["a@example.com"]
+        assert result['created_at'] == OLD.isoformat()
+        assert email_service.archive.get(emails['sent'].id).html_content == "<p>Shared body</p>"
+        
+        with pytest.raises(EmailMessage.DoesNotExist):
+            email_service.get_email(999)
+
+class TestFileArchive:
+    def test_writes_day_files_and_releases_rows(self, db, emails, tmp_path):
+        """Test old emails are written to compressed NDJSON and removed with their recipients and blob references"""
+        archive = FileArchive(str(tmp_path))
+        
+        assert RetentionJob(archive, batch_pause=0).run_once() == 2
+        
+        name = f"emails-{OLD.strftime('%Y-%m-%d')}.ndjson.gz"
+        with gzip.open(tmp_path / name, 'rt') as f:
+            records = [json.loads(line) for line in f]
+        assert sorted(record['id'] for record in records) == sorted([emails['sent'].id, emails['failed'].id])
+        assert records[0]['html_content'] == "<p>Shared body</p>"
+        assert records[0]['deliveries'][0]['address'] == "a@example.com"
+        
+        assert EmailRecipient.select().where(
+            EmailRecipient.email_id.in_([emails['sent'].id, emails['failed'].id])
+        ).count() == 0
+        assert ContentBlob.get_by_id(emails['sent'].content_hash).ref_count == 2
+        
+        manifest = json.loads((tmp_path / 'manifest.json').read_text())
+        assert manifest[name] == [min(emails['sent'].id, emails['failed'].id), max(emails['sent'].id, emails['failed'].id)]
+    
+    def test_lookup_across_appended_batches(self, db, emails, tmp_path):
+        """Test lookups read every batch appended to a day file"""
+        archive = FileArchive(str(tmp_path))
+        RetentionJob(archive, batch_size=1, batch_pause=0).run_once()
+        
+        email = archive.get(emails['failed'].id)
+        assert email.status == 'failed'
+        assert email.created_at == OLD
+        assert email.html_content == "<p>Shared body</p>"
+        assert archive.get(emails['queued'].id) is None
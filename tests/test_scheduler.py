@@ -0,0 +1,161 @@
+import pytest
+import json
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from models.email_model import EmailMessage, add_status_listener, _status_listeners
+from services.scheduler import EmailScheduler
+
+NOW = datetime(2026, 5, 1, 9, 0)
+
+def scheduled(smtp_config, send_at, priority=1):
+    return EmailMessage.create(subject="S", sender="", recipients=json.dumps(['a@example.com']),
+                               html_content="<p>x</p>", smtp_config_id=smtp_config.id, priority=priority,
+                               status='scheduled', send_at=send_at).id
+
+@pytest.fixture
+def queue():
+    return MagicMock()
+
+@pytest.fixture
+def scheduler(queue):
+    return EmailScheduler(queue, window=300, max_loaded=100, batch_size=10)
+
+class TestEmailScheduler:
+    def test_loads_only_the_window(self, db, smtp_config, scheduler):
+        """Test only emails due within the window are held in memory"""
+        soon = scheduled(smtp_config, NOW + timedelta(minutes=1))
+        due = scheduled(smtp_config, NOW - timedelta(minutes=1))
+        scheduled(smtp_config, NOW + timedelta(hours=1))
+
+        assert scheduler.load(NOW) == 2
+        assert scheduler._heap.peek()[0] == due
+        assert soon in scheduler._heap
+
+    def test_releases_due_emails_in_time_order(self, db, smtp_config, scheduler, queue):
+        first = scheduled(smtp_config, NOW - timedelta(minutes=2), priority=3)
+        second = scheduled(smtp_config, NOW - timedelta(minutes=1))
+        later = scheduled(smtp_config, NOW + timedelta(minutes=1))
+        scheduler.load(NOW)
+
+        assert scheduler.release_due(NOW) == 2
+
+        queue.enqueue_many.assert_called_once_with([(first, 3), (second, 1)])
+        assert EmailMessage.get_by_id(first).status == 'queued'
+        assert EmailMessage.get_by_id(later).status == 'scheduled'
+        assert list(scheduler._heap) == [(later, (NOW + timedelta(minutes=1), later))]
+
+    def test_released_once(self, db, smtp_config, queue):
+        """Test an email released by another scheduler is not queued again"""
+        email_id = scheduled(smtp_config, NOW)
+        ours, theirs = EmailScheduler(queue), EmailScheduler(queue)
+        ours.load(NOW)
+        theirs.load(NOW)
+
+        assert theirs.release_due(NOW) == 1
+        ours.release_due(NOW)
+
+        queue.enqueue_many.assert_called_once_with([(email_id, 1)])
+
+    def test_notifies_status_listeners(self, db, smtp_config, scheduler):
+        seen = []
+        listener = lambda email: seen.append((email.id, email.status))
+        add_status_listener(listener)
+        try:
+            email_id = scheduled(smtp_config, NOW)
+            scheduler.load(NOW)
+            scheduler.release_due(NOW)
+        finally:
+            _status_listeners.remove(listener)
+
+        assert seen == [(email_id, 'queued')]
+
+    def test_window_shrinks_to_max_loaded(self, db, smtp_config, queue):
+        """Test at most max_loaded emails are held and the rest are read once half went out"""
+        scheduler = EmailScheduler(queue, max_loaded=4, batch_size=2)
+        ids = [scheduled(smtp_config, NOW + timedelta(seconds=i)) for i in range(6)]
+
+        scheduler.load(NOW)
+        assert len(scheduler._heap) == 4
+        assert scheduler._horizon == NOW + timedelta(seconds=3)
+
+        scheduler.release_due(NOW + timedelta(minutes=1))
+        assert scheduler._load_due()
+        scheduler.load(NOW)
+        assert sorted(email_id for email_id, _ in scheduler._heap) == ids[2:]
+
+    def test_schedule_adds_emails_inside_the_window(self, db, scheduler):
+        scheduler.schedule(1, NOW)  # Nothing read yet, the first read finds it
+        assert len(scheduler._heap) == 0
+
+        scheduler.load(NOW)
+        scheduler.schedule(2, NOW + timedelta(minutes=1))
+        scheduler.schedule(3, NOW + timedelta(hours=1))
+        assert [email_id for email_id, _ in scheduler._heap] == [2]
+
+    def test_cancel(self, db, smtp_config, scheduler, queue):
+        email_id = scheduled(smtp_config, NOW)
+        scheduler.load(NOW)
+
+        assert scheduler.cancel(email_id) is True
+        assert scheduler.cancel(email_id) is False
+        assert scheduler.release_due(NOW) == 0
+        queue.enqueue_many.assert_not_called()
+
+    def test_released_once_without_row_locks(self, db, smtp_config, queue):
+        """Test a scheduler that read an email another one released meanwhile doesn't queue it"""
+        email_id = scheduled(smtp_config, NOW)
+        ours, theirs = EmailScheduler(queue), EmailScheduler(queue)
+        ours.load(NOW)
+        theirs.load(NOW)
+
+        # Both read the email as scheduled; theirs switches it first
+        switch_status = EmailMessage.switch_status
+        def released_meanwhile(*args):
+            theirs.release_due(NOW)
+            return switch_status(*args)
+        with patch.object(EmailMessage, 'switch_status', side_effect=released_meanwhile):
+            ours.release_due(NOW)
+
+        queue.enqueue_many.assert_called_once_with([(email_id, 1)])
+
+    def test_recover_queued(self, db, smtp_config, email_service, mock_queue):
+        """Test emails left queued by a previous run are queued again, in chunks"""
+        ids = [scheduled(smtp_config, NOW, priority=2) for _ in range(3)]
+        EmailMessage.update(status='queued').where(EmailMessage.id.in_(ids[:2])).execute()
+
+        assert email_service.recover_queued(chunk_size=1) == 2
+        assert [c.args[0] for c in mock_queue.enqueue_many.call_args_list] == [[(ids[0], 2)], [(ids[1], 2)]]
+
+
+class TestScheduledCreate:
+    def test_future_send_at_is_scheduled(self, db, smtp_config, email_service, mock_queue):
+        email_service.scheduler = MagicMock()
+        send_at = datetime.now() + timedelta(hours=1)
+
+        email_id = email_service.create_email(subject="S", recipients=['a@example.com'], html_content="<p>x</p>",
+                                              smtp_config_id=smtp_config.id, send_at=send_at)
+
+        email = EmailMessage.get_by_id(email_id)
+        assert (email.status, email.send_at) == ('scheduled', send_at)
+        mock_queue.enqueue.assert_not_called()
+        email_service.scheduler.schedule.assert_called_once_with(email_id, send_at)
+
+    def test_past_send_at_is_queued(self, db, smtp_config, email_service, mock_queue):
+        email_id = email_service.create_email(subject="S", recipients=['a@example.com'], html_content="<p>x</p>",
+                                              smtp_config_id=smtp_config.id, send_at=datetime.now() - timedelta(1))
+
+        assert EmailMessage.get_by_id(email_id).status == 'queued'
+        mock_queue.enqueue.assert_called_once()
+
+    def test_batch_queues_and_schedules(self, db, smtp_config, email_service, mock_queue):
+        email_service.scheduler = MagicMock()
+        send_at = datetime.now() + timedelta(hours=1)
+
+        results = email_service.create_emails_batch([
+            {'subject': 'S', 'recipients': ['a@example.com'], 'html_content': '<p>x</p>'},
+            {'subject': 'S', 'recipients': ['b@example.com'], 'html_content': '<p>x</p>', 'send_at': send_at}
+        ])
+
+        mock_queue.enqueue_many.assert_called_once_with([(results[0]['email_id'], 1)])
+        email_service.scheduler.schedule.assert_called_once_with(results[1]['email_id'], send_at)
@@ -0,0 +1,60 @@
+import pytest
+import smtplib
+import socket
+
+from services import smtp_errors
+from services.smtp_errors import classify_exception, classify_refusals, is_retryable, requires_other_config
+
+class TestSmtpErrors:
+    def test_classify_reply_codes(self):
+        """Test 4xx replies are transient and 5xx replies permanent"""
+        transient = classify_exception(smtplib.SMTPSenderRefused(451, b'Try again later', 'a@example.com'))
+        assert transient.category == smtp_errors.TRANSIENT
+        assert transient.error_code == 'transient.451'
+        assert transient.retryable is True
+        
+        permanent = classify_exception(smtplib.SMTPDataError(554, b'Message rejected'))
+        assert permanent.category == smtp_errors.PERMANENT
+        assert permanent.error_code == 'permanent.554'
+        assert permanent.retryable is False
+    
+    def test_classify_auth_failure(self):
+        """Test authentication failures require another SMTP config"""
+        failure = classify_exception(smtplib.SMTPAuthenticationError(535, b'Bad credentials'))
+        assert failure.error_code == 'auth.535'
+        assert requires_other_config(failure.error_code) is True
+    
+    def test_classify_network_errors(self):
+        """Test timeouts and disconnects are network failures"""
+        for error in (socket.timeout('timed out'),
+                      ConnectionRefusedError('refused'),
+                      smtplib.SMTPServerDisconnected('gone')):
+            failure = classify_exception(error)
+            assert failure.error_code == 'network'
+            assert failure.retryable is True
+    
+    def test_classify_refusals(self):
+        """Test per-recipient refusals"""
+        assert classify_refusals({}) is None
+        
+        permanent = classify_refusals({'gone@example.com': (550, b'No such user')})
+        assert permanent.error_code == 'recipient.550'
+        assert permanent.retryable is False
+        assert 'gone@example.com' in permanent.message
+        
+        # A single greylisted recipient keeps the message retryable
+        mixed = classify_refusals({
+            'gone@example.com': (550, b'No such user'),
+            'busy@example.com': (450, b'Mailbox busy')
+        })
+        assert mixed.error_code == 'recipient.450'
+        assert mixed.retryable is True
+        
+        refused = classify_exception(smtplib.SMTPRecipientsRefused({'gone@example.com': (550, b'No such user')}))
+        assert refused.error_code == 'recipient.550'
+    
+    def test_unclassified_errors_are_retryable(self):
+        """Test unknown and missing codes keep the old retry behaviour"""
+        assert is_retryable(None) is True
+        assert classify_exception(ValueError('boom')).error_code == 'unknown'
+        assert is_retryable('unknown') is True
@@ -0,0 +1,66 @@
+import pytest
+from types import SimpleNamespace
+
+from services.smtp_router import SmtpRouter
+
+def make_config(config_id, sent_count_today=0, daily_limit=100):
+    return SimpleNamespace(id=config_id, sent_count_today=sent_count_today, daily_limit=daily_limit)
+
+class TestSmtpRouter:
+    def test_ewma_updates(self):
+        """Test latency and failure rate are exponentially weighted, latency over successes only"""
+        router = SmtpRouter(alpha=0.5)
+        
+        router.record(1, 2.0, True)
+        router.record(1, 4.0, False)
+        
+        stats = router.describe(make_config(1))
+        assert stats['avg_latency_ms'] == 2000.0  # Only successful sends count
+        assert stats['failure_rate'] == 0.5
+        assert stats['samples'] == 2
+    
+    def test_unknown_config_uses_default_latency(self):
+        """Test configurations without samples get the default latency"""
+        router = SmtpRouter(default_latency=2.5)
+        
+        assert router.expected_time(99) == 2.5
+        assert router.describe(make_config(99))['avg_latency_ms'] is None
+    
+    def test_failures_inflate_expected_time(self):
+        """Test an unreliable relay scores worse than a slower reliable one"""
+        router = SmtpRouter(alpha=1.0)
+        router.record(1, 1.0, False)  # Fast but failing
+        router.record(2, 2.0, True)  # Slower but reliable
+        
+        assert router.score(make_config(2)) < router.score(make_config(1))
+    
+    def test_fast_failures_lose_to_a_slow_healthy_relay(self):
+        """Test a relay refusing connections in milliseconds doesn't look fast"""
+        router = SmtpRouter()
+        for _ in range(10):
+            router.record(1, 0.002, False)
+            router.record(2, 0.8, True)
+        
+        assert router.score(make_config(2)) < router.score(make_config(1))
+        assert router.describe(make_config(1))['avg_latency_ms'] is None
+    
+    def test_failure_cost(self):
+        """Test each failure is charged failure_cost seconds"""
+        router = SmtpRouter(alpha=0.5, failure_cost=10.0)
+        router.record(1, 1.0, True)
+        router.record(1, 1.0, False)  # p = 0.5
+        
+        assert router.expected_time(1) == 2.0 + 10.0
+    
+    def test_utilization_weight(self):
+        """Test quota usage inflates the score according to its weight"""
+        router = SmtpRouter(utilization_weight=1.0, default_latency=1.0)
+        assert router.score(make_config(1, sent_count_today=50)) == 1.5
+        
+        router.configure(utilization_weight=0.0, default_latency=1.0)
+        assert router.score(make_config(1, sent_count_today=50)) == 1.0
+    
+    def test_invalid_alpha(self):
+        """Test alpha must be a valid smoothing factor"""
+        with pytest.raises(ValueError):
+            SmtpRouter(alpha=0)
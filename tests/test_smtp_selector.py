@@ -0,0 +1,102 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from models.smtp_config import SmtpConfig
+from services.smtp_router import SmtpRouter
+from services.smtp_selector import SmtpSelector, smtp_selector
+
+def create_config(name, **kwargs):
+    values = dict(
+        name=name,
+        email_address=f"{name}@example.com",
+        smtp_host="smtp.example.com",
+        smtp_port=587,
+        username=f"{name}@example.com",
+        password="password",
+        daily_limit=100,
+        hourly_limit=10
+    )
+    values.update(kwargs)
+    return SmtpConfig.create(**values)
+
+class TestSmtpSelector:
+    def test_pick_lowest_utilization(self, db):
+        """Test the least used config is picked"""
+        busy = create_config("busy", sent_count_today=50)
+        idle = create_config("idle", sent_count_today=5)
+        selector = SmtpSelector(SmtpRouter())
+        
+        assert selector.pick().id == idle.id
+        assert selector.pick(exclude_id=idle.id).id == busy.id
+    
+    def test_exhausted_configs_are_parked(self, db):
+        """Test configs over a limit are not picked until their window resets"""
+        config = create_config("full", sent_count_hour=10)
+        selector = SmtpSelector(SmtpRouter())
+        
+        assert selector.pick() is None
+        
+        # An hour later the hourly window has reset
+        entry = selector._entries[config.id]
+        entry.last_reset_hourly = datetime.now() - timedelta(hours=2)
+        selector._parked.push(entry.id, datetime.now() - timedelta(minutes=1))
+        
+        assert selector.pick().id == entry.id
+        assert selector.pick().sent_count_hour == 0
+    
+    def test_saves_update_the_index(self, db):
+        """Test edits and sends are reflected without reloading"""
+        first = create_config("first")
+        second = create_config("second", sent_count_today=1)
+        
+        assert smtp_selector.pick().id == first.id
+        
+        # Sending through the first config makes the second one preferable
+        for _ in range(2):
+            first.increment_sent_count()
+        assert smtp_selector.pick().id == second.id
+        
+        # Deactivating removes it from the index
+        second.active = False
+        second.save()
+        assert smtp_selector.pick().id == first.id
+        
+        # New configs join the index
+        third = create_config("third")
+        assert smtp_selector.pick().id == third.id
+    
+    def test_reservations_update_the_index(self, db):
+        """Test quota taken and given back is applied without reading the config again"""
+        first = create_config("first")
+        second = create_config("second", sent_count_today=1)
+        assert smtp_selector.pick().id == first.id
+        
+        with patch.object(SmtpConfig, 'get_counters') as get_counters:
+            for _ in range(2):
+                assert SmtpConfig.reserve_send(first.id) is True
+            assert smtp_selector.pick().id == second.id
+            
+            SmtpConfig.release_send(first.id)
+            get_counters.assert_not_called()
+        
+        entry = smtp_selector._entries[first.id]
+        assert (entry.sent_count_today, entry.sent_count_hour) == (1, 1)
+    
+    def test_refused_reservation_parks_the_config(self, db):
+        """Test a config another process exhausted is parked once a reservation is refused"""
+        config = create_config("shared")
+        assert smtp_selector.pick().id == config.id
+        
+        SmtpConfig.update(sent_count_hour=10).where(SmtpConfig.id == config.id).execute()
+        assert SmtpConfig.reserve_send(config.id) is False
+        assert smtp_selector.pick() is None
+    
+    def test_refresh_interval_reloads(self, db):
+        """Test the index is reloaded from the database after the refresh interval"""
+        selector = SmtpSelector(SmtpRouter(), refresh_interval=0)
+        assert selector.pick() is None
+        
+        # Written behind the selector's back, e.g. by another process
+        config = create_config("late")
+        assert selector.pick().id == config.id
@@ -0,0 +1,59 @@
+import pytest
+from datetime import datetime
+from flask import Flask, Blueprint
+from unittest.mock import MagicMock
+
+from controllers.stats_controller import StatsController
+
+@pytest.fixture
+def mock_email_service():
+    service = MagicMock()
+    service.get_delivery_stats.return_value = {'series': [], 'totals': {'sent': 0}}
+    return service
+
+@pytest.fixture
+def client(mock_email_service):
+    """Create a test client with the stats controller on a fresh blueprint"""
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    blueprint = Blueprint('stats', __name__)
+    StatsController(mock_email_service).register_routes(blueprint)
+    app.register_blueprint(blueprint)
+    with app.test_client() as client:
+        yield client
+
+class TestGetStats:
+    def test_get_stats(self, client, mock_email_service):
+        response = client.get('/stats?from=2026-03-01&to=2026-03-08&smtp_config_id=2&granularity=hour')
+        
+        assert response.status_code == 200
+        assert response.json['totals'] == {'sent': 0}
+        mock_email_service.get_delivery_stats.assert_called_once_with(
+            datetime(2026, 3, 1), datetime(2026, 3, 8), smtp_config_id=2, granularity='hour'
+        )
+    
+    def test_defaults_to_last_day(self, client, mock_email_service):
+        response = client.get('/stats')
+        
+        assert response.status_code == 200
+        start, end = mock_email_service.get_delivery_stats.call_args[0]
+        assert (end - start).days == 1
+    
+    @pytest.mark.parametrize('query', [
+        'from=yesterday',
+        'from=2026-03-08&to=2026-03-01',
+        'from=2020-01-01&to=2026-01-01',
+        'smtp_config_id=abc'
+    ])
+    def test_invalid_filters(self, client, mock_email_service, query):
+        response = client.get(f'/stats?{query}')
+        
+        assert response.status_code == 400
+        mock_email_service.get_delivery_stats.assert_not_called()
+    
+    def test_invalid_granularity(self, client, mock_email_service):
+        mock_email_service.get_delivery_stats.side_effect = ValueError("granularity must be one of hour, day, total")
+        
+        response = client.get('/stats?granularity=week')
+        
+        assert response.status_code == 400
@@ -0,0 +1,94 @@
+import threading
+from types import SimpleNamespace
+from datetime import datetime
+
+from services.status_events import StatusEventBus, status_events
+
+def make_email(email_id, status='sent', smtp_config_id=1, campaign=None):
+    return SimpleNamespace(id=email_id, status=status, smtp_config_id=smtp_config_id, campaign=campaign,
+                           retry_count=0, error_code=None, updated_at=datetime(2024, 1, 1))
+
+class TestStatusEventBus:
+    def test_filters(self):
+        """Test subscribers only receive matching events"""
+        bus = StatusEventBus()
+        by_id = bus.subscribe(email_ids=[2])
+        by_campaign = bus.subscribe(campaign='spring')
+        by_config = bus.subscribe(smtp_config_id=7)
+        
+        bus.publish(make_email(1, campaign='spring'))
+        bus.publish(make_email(2, smtp_config_id=7))
+        
+        assert [e.email_id for e in by_id.get(timeout=0)[0]] == [2]
+        assert [e.email_id for e in by_campaign.get(timeout=0)[0]] == [1]
+        assert [e.email_id for e in by_config.get(timeout=0)[0]] == [2]
+    
+    def test_get_waits_for_events(self):
+        """Test a read blocks until an event is published"""
+        bus = StatusEventBus()
+        subscription = bus.subscribe()
+        threading.Timer(0.05, bus.publish, args=[make_email(1)]).start()
+        
+        events, gap = subscription.get(timeout=5)
+        assert [e.email_id for e in events] == [1]
+        assert not gap
+        assert subscription.get(timeout=0) == ([], False)
+    
+    def test_resume_from_cursor(self):
+        """Test reconnecting with a cursor replays the missed events"""
+        bus = StatusEventBus()
+        subscription = bus.subscribe()
+        bus.publish(make_email(1))
+        subscription.get(timeout=0)
+        cursor = subscription.cursor
+        subscription.close()
+        
+        bus.publish(make_email(2))
+        bus.publish(make_email(3))
+        
+        resumed = bus.subscribe(cursor=cursor)
+        events, gap = resumed.get(timeout=0)
+        assert [e.email_id for e in events] == [2, 3]
+        assert not gap
+    
+    def test_overflow_catches_up_from_history(self):
+        """Test a full buffer is refilled from history without losing events"""
+        bus = StatusEventBus()
+        subscription = bus.subscribe(buffer_size=2)
+        for email_id in range(1, 6):
+            bus.publish(make_email(email_id))
+        
+        assert [e.email_id for e in subscription.get(timeout=0)[0]] == [1, 2]
+        assert [e.email_id for e in subscription.get(timeout=0)[0]] == [3, 4]
+        assert [e.email_id for e in subscription.get(timeout=0)[0]] == [5]
+    
+    def test_gap_when_history_is_gone(self):
+        """Test a subscriber that fell behind the history is told it missed events"""
+        bus = StatusEventBus(history_size=2)
+        subscription = bus.subscribe(buffer_size=1)
+        for email_id in range(1, 5):
+            bus.publish(make_email(email_id))
+        
+        events, gap = subscription.get(timeout=0)
+        assert gap
+        assert [e.email_id for e in events] == [3]
+    
+    def test_cursor_from_another_process(self):
+        """Test a cursor from before a restart resumes with a gap"""
+        bus = StatusEventBus()
+        bus.publish(make_email(1))
+        
+        events, gap = bus.subscribe(cursor='deadbeef-42').get(timeout=0)
+        assert gap
+        assert [e.email_id for e in events] == [1]
+    
+    def test_update_status_publishes(self, db, test_email):
+        """Test status transitions of the model reach the shared bus"""
+        subscription = status_events.subscribe(email_ids=[test_email.id])
+        
+        test_email.update_status('failed', 'Rejected', 'permanent.550')
+        
+        events, _ = subscription.get(timeout=0)
+        assert len(events) == 1
+        assert events[0].status == 'failed'
+        assert events[0].error_code == 'permanent.550'
@@ -0,0 +1,105 @@
+import pytest
+import threading
+from unittest.mock import patch
+from peewee import SqliteDatabase
+
+from models.email_model import EmailMessage, ContentBlob, add_status_listener, _status_listeners
+from services.status_writer import StatusWriter
+
+def create_email(subject="Test Subject"):
+    return EmailMessage.create(subject=subject, sender="", recipients='["a@example.com"]',
+                               html_content="<p>x</p>", smtp_config_id=1)
+
+@pytest.fixture
+def events():
+    """Collect the emails status listeners are notified with"""
+    seen = []
+    listener = lambda email: seen.append((email.id, email.status))
+    add_status_listener(listener)
+    yield seen
+    _status_listeners.remove(listener)
+
+@pytest.fixture
+def buffering_writer():
+    """A writer that buffers like a running one but is flushed by the test"""
+    writer = StatusWriter()
+    writer.running = True
+    return writer
+
+class TestStatusWriter:
+    def test_falls_back_when_not_running(self, db, events):
+        """Test transitions are written directly without a writer thread"""
+        email = create_email()
+        
+        StatusWriter().submit(email, 'sent')
+        
+        assert EmailMessage.get_by_id(email.id).status == 'sent'
+        assert events == [(email.id, 'sent')]
+    
+    def test_coalesces_and_groups(self, db, events, buffering_writer):
+        """Test transitions of one email collapse and equal ones share an UPDATE"""
+        emails = [create_email(f"Email {i}") for i in range(3)]
+        for email in emails:
+            buffering_writer.submit(email, 'sending')
+        for email in emails[:2]:
+            buffering_writer.submit(email, 'sent')
+        buffering_writer.submit(emails[2], 'failed', "Rejected", 'permanent.550')
+        
+        original = EmailMessage.update
+        with patch.object(EmailMessage, 'update', side_effect=original) as update:
+            buffering_writer._flush(buffering_writer._pending)
+        
+        # One statement for the two sent emails, one for the failed one
+        assert update.call_count == 2
+        stored = {e.id: e for e in EmailMessage.select().where(EmailMessage.id.in_([e.id for e in emails]))}
+        assert [stored[e.id].status for e in emails] == ['sent', 'sent', 'failed']
+        assert stored[emails[0].id].sent_at is not None
+        assert stored[emails[2].id].error_code == 'permanent.550'
+        
+        # Listeners see each email once, in its final state
+        assert sorted(events) == sorted([(emails[0].id, 'sent'), (emails[1].id, 'sent'), (emails[2].id, 'failed')])
+    
+    def test_writes_only_status_columns(self, db, buffering_writer):
+        """Test unrelated in-memory changes are not written"""
+        email = create_email()
+        email.subject = "Changed"
+        buffering_writer.submit(email, 'sending')
+        buffering_writer._flush(buffering_writer._pending)
+        
+        stored = EmailMessage.get_by_id(email.id)
+        assert stored.status == 'sending'
+        assert stored.subject == "Test Subject"
+    
+    def test_waiters_get_flush_errors(self, db, buffering_writer):
+        """Test a failed flush is raised in the waiting worker"""
+        email = create_email()
+        buffering_writer.submit(email, 'sending')
+        batch = buffering_writer._pending
+        
+        with patch.object(EmailMessage, 'update', side_effect=RuntimeError("database gone")):
+            buffering_writer._flush(batch)
+        
+        assert isinstance(batch[email.id].error, RuntimeError)
+        assert batch[email.id].done.is_set()
+    
+    def test_wait_returns_after_commit(self, tmp_path):
+        """Test terminal transitions submitted from many threads are committed before returning"""
+        test_db = SqliteDatabase(str(tmp_path / 'status.db'), check_same_thread=False)
+        with test_db.bind_ctx([EmailMessage, ContentBlob]):
+            test_db.create_tables([EmailMessage, ContentBlob])
+            emails = [create_email(f"Email {i}") for i in range(20)]
+            
+            writer = StatusWriter(flush_interval=0.02)
+            writer.start()
+            try:
+                threads = [threading.Thread(target=writer.submit, args=(email, 'sent'), kwargs={'wait': True})
+                           for email in emails]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                writer.stop()
+            
+            assert EmailMessage.select().where(EmailMessage.status == 'sent').count() == 20
+            test_db.close()
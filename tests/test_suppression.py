@@ -0,0 +1,176 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from models.email_model import Suppression, EmailMessage, EmailRecipient
+from services.email_service import EmailService, EmailSender
+from services.suppression import SuppressionList, RecipientsSuppressedError
+
+@pytest.fixture
+def suppressions():
+    return SuppressionList()
+
+class TestSuppressionList:
+    def test_address_and_domain_entries(self, db, suppressions):
+        """Test addresses match case-insensitively and domain entries cover every address of the domain"""
+        suppressions.add_many([
+            {'address': 'Gone@Example.com', 'reason': 'hard_bounce'},
+            {'address': 'blocked.org', 'reason': 'complaint'}
+        ])
+
+        found = suppressions.suppressed(['gone@example.com', ' GONE@example.com', 'ok@example.com', 'x@blocked.org'])
+        assert found == ['gone@example.com', ' GONE@example.com', 'x@blocked.org']
+        assert Suppression.get(Suppression.address == 'blocked.org').scope == 'domain'
+
+    def test_expired_entries_are_ignored(self, db, suppressions):
+        """Test entries stop applying once they expire"""
+        suppressions.add('old@example.com', 'unsubscribe', datetime.now() - timedelta(seconds=1))
+        suppressions.add('new@example.com', 'unsubscribe', datetime.now() + timedelta(days=1))
+
+        assert suppressions.suppressed(['old@example.com', 'new@example.com']) == ['new@example.com']
+
+    def test_upsert_replaces_reason_and_expiry(self, db, suppressions):
+        """Test adding a listed address updates its row instead of failing"""
+        suppressions.add('a@example.com', 'manual', datetime.now() + timedelta(days=1))
+        suppressions.add('A@example.com', 'unsubscribe')
+
+        row = Suppression.get()
+        assert (row.reason, row.expires_at) == ('unsubscribe', None)
+        assert suppressions.suppressed(['a@example.com']) == ['a@example.com']
+
+    def test_loads_table_and_picks_up_other_processes(self, db, suppressions):
+        """Test the first check loads the table and later ones read changes made elsewhere"""
+        other = SuppressionList()
+        other.add('first@example.com')
+        assert suppressions.suppressed(['first@example.com']) == ['first@example.com']
+
+        other.add('second@example.com')
+        other.remove('first@example.com')
+        assert suppressions.suppressed(['first@example.com', 'second@example.com']) == ['first@example.com']
+
+        suppressions._next_sync = 0  # Next refresh is due
+        assert suppressions.suppressed(['first@example.com', 'second@example.com']) == ['second@example.com']
+
+    def test_remove(self, db, suppressions):
+        """Test lifting a suppression expires its row"""
+        suppressions.add('a@example.com')
+
+        assert suppressions.remove('A@example.com') is True
+        assert suppressions.remove('a@example.com') is False
+        assert suppressions.suppressed(['a@example.com']) == []
+        assert suppressions.get('a@example.com') is None
+        assert Suppression.get().expires_at is not None
+
+    def test_get_prefers_the_address_entry(self, db, suppressions):
+        suppressions.add('example.com', 'complaint')
+        suppressions.add('a@example.com', 'unsubscribe')
+
+        assert suppressions.get('a@example.com')['reason'] == 'unsubscribe'
+        assert suppressions.get('b@example.com')['scope'] == 'domain'
+        assert suppressions.get('b@example.org') is None
+
+    def test_export_skips_lifted_entries(self, db, suppressions):
+        suppressions.add_many([{'address': f'user{i}@example.com'} for i in range(3)])
+        suppressions.remove('user1@example.com')
+
+        exported = list(suppressions.export())
+        assert [entry['address'] for entry in exported] == ['user0@example.com', 'user2@example.com']
+        assert exported[0]['reason'] == 'manual'
+
+    def test_record_bounces(self, db, suppressions):
+        """Test only replies meaning the mailbox doesn't exist suppress an address"""
+        suppressions.bounce_days = 30
+        suppressions.record_bounces({
+            'gone@example.com': (550, b'No such user'),
+            'full@example.com': (552, b'Mailbox full'),
+            'later@example.com': (450, b'Try again')
+        })
+
+        row = Suppression.get()
+        assert (row.address, row.reason) == ('gone@example.com', 'hard_bounce')
+        assert row.expires_at > datetime.now() + timedelta(days=29)
+
+    def test_unreadable_table_lets_everything_through(self, suppressions):
+        """Test a database error doesn't block sending"""
+        with patch.object(Suppression, 'select', side_effect=Exception("database is down")):
+            assert suppressions.suppressed(['a@example.com']) == []
+
+
+class TestSuppressedRecipients:
+    def test_create_email_leaves_out_suppressed(self, db, smtp_config):
+        """Test suppressed recipients are dropped when an email is created"""
+        EmailService().add_suppressions([{'address': 'gone@example.com'}])
+
+        email_id = EmailService().create_email(
+            subject="S", recipients=['ok@example.com', 'gone@example.com'], html_content="<p>x</p>",
+            smtp_config_id=smtp_config.id, cc=['Gone@example.com']
+        )
+
+        email = EmailMessage.get_by_id(email_id)
+        assert email.get_recipients_list() == ['ok@example.com']
+        assert email.get_cc_list() == []
+        assert EmailRecipient.select().count() == 1
+
+    def test_create_email_all_suppressed(self, db, smtp_config):
+        EmailService().add_suppressions([{'address': 'example.com'}])
+
+        with pytest.raises(RecipientsSuppressedError) as error:
+            EmailService().create_email(subject="S", recipients=['a@example.com'], html_content="<p>x</p>",
+                                        smtp_config_id=smtp_config.id)
+        assert error.value.addresses == ['a@example.com']
+        assert EmailMessage.select().count() == 0
+
+    def test_batch_reports_suppressed_items(self, db, smtp_config):
+        EmailService().add_suppressions([{'address': 'gone@example.com'}])
+
+        results = EmailService().create_emails_batch([
+            {'subject': 'S', 'recipients': ['gone@example.com'], 'html_content': '<p>x</p>'},
+            {'subject': 'S', 'recipients': ['ok@example.com'], 'html_content': '<p>x</p>'}
+        ])
+
+        assert 'All recipients are suppressed' in results[0]['error']
+        assert 'email_id' in results[1]
+
+    @patch('smtplib.SMTP')
+    def test_send_skips_addresses_suppressed_after_queueing(self, mock_smtp, db, smtp_config):
+        email_id = EmailService().create_email(
+            subject="S", recipients=['ok@example.com', 'gone@example.com'], html_content="<p>x</p>",
+            smtp_config_id=smtp_config.id
+        )
+        EmailService().add_suppressions([{'address': 'gone@example.com'}])
+
+        success, _ = EmailSender.send_email(email_id)
+
+        assert success is True
+        assert mock_smtp.return_value.sendmail.call_args[0][1] == ['ok@example.com']
+        rows = {r.address: r.status for r in EmailRecipient.select()}
+        assert rows == {'ok@example.com': 'accepted', 'gone@example.com': 'suppressed'}
+
+    @patch('smtplib.SMTP')
+    def test_send_fails_without_quota_when_all_suppressed(self, mock_smtp, db, smtp_config):
+        email_id = EmailService().create_email(
+            subject="S", recipients=['gone@example.com'], html_content="<p>x</p>", smtp_config_id=smtp_config.id
+        )
+        EmailService().add_suppressions([{'address': 'gone@example.com'}])
+
+        success, message = EmailSender.send_email(email_id)
+
+        assert success is False
+        mock_smtp.assert_not_called()
+        email = EmailMessage.get_by_id(email_id)
+        assert (email.status, email.error_code) == ('failed', 'suppressed')
+        assert smtp_config.__class__.get_by_id(smtp_config.id).sent_count_hour == 0
+
+    @patch('smtplib.SMTP')
+    def test_hard_bounce_suppresses_address(self, mock_smtp, db, smtp_config):
+        email_id = EmailService().create_email(
+            subject="S", recipients=['ok@example.com', 'Gone@example.com'], html_content="<p>x</p>",
+            smtp_config_id=smtp_config.id
+        )
+        mock_smtp.return_value.sendmail.return_value = {'Gone@example.com': (550, b'No such user')}
+
+        EmailSender.send_email(email_id)
+
+        with pytest.raises(RecipientsSuppressedError):
+            EmailService().create_email(subject="S", recipients=['gone@example.com'], html_content="<p>x</p>",
+                                        smtp_config_id=smtp_config.id)
@@ -0,0 +1,91 @@
+import pytest
+import json
+from datetime import datetime
+from flask import Flask, Blueprint
+from unittest.mock import MagicMock
+
+from controllers.suppression_controller import SuppressionController
+
+@pytest.fixture
+def mock_email_service():
+    service = MagicMock()
+    service.add_suppressions.side_effect = lambda entries: len(entries)
+    return service
+
+@pytest.fixture
+def app(mock_email_service):
+    """Create a test app with the suppression controller on a fresh blueprint"""
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    app.config['STREAM_CHUNK_SIZE'] = 2
+    blueprint = Blueprint('suppression', __name__)
+    SuppressionController(mock_email_service).register_routes(blueprint)
+    app.register_blueprint(blueprint)
+    return app
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+class TestSuppressionController:
+    def test_add_one(self, client, mock_email_service):
+        response = client.post('/suppressions', json={'address': 'a@example.com', 'reason': 'unsubscribe',
+                                                      'expires_at': '2026-12-01T00:00:00'})
+
+        assert response.status_code == 201
+        assert response.json['suppressed'] == 1
+        entry = mock_email_service.add_suppressions.call_args[0][0][0]
+        assert entry['expires_at'] == datetime(2026, 12, 1)
+
+    def test_add_rejects_invalid_entries(self, client, mock_email_service):
+        response = client.post('/suppressions', json=[{'address': 'example.com'}, {'address': 'not an address'}])
+        assert response.status_code == 400
+        assert response.json['index'] == 1
+
+        response = client.post('/suppressions', json={'address': 'a@example.com', 'reason': 'bored'})
+        assert response.status_code == 400
+        assert 'Reason' in response.json['error']
+        mock_email_service.add_suppressions.assert_not_called()
+
+    def test_import_in_chunks(self, client, mock_email_service):
+        """Test an NDJSON import is written in chunks and reports bad lines"""
+        body = '\n'.join([
+            json.dumps({'address': 'a@example.com'}),
+            json.dumps({'address': 'b@example.com', 'reason': 'complaint'}),
+            '{not json',
+            json.dumps({'address': 'example.org'}),
+            json.dumps({'address': 'nope'})
+        ])
+        response = client.post('/suppressions/import', data=body, content_type='application/x-ndjson')
+
+        assert response.status_code == 207
+        assert response.json['imported'] == 3
+        assert [error['line'] for error in response.json['errors']] == [3, 5]
+        assert mock_email_service.add_suppressions.call_count == 2
+
+    def test_export(self, client, mock_email_service):
+        mock_email_service.export_suppressions.return_value = iter([
+            {'address': 'a@example.com', 'scope': 'address', 'reason': 'manual'},
+            {'address': 'example.org', 'scope': 'domain', 'reason': 'complaint'}
+        ])
+
+        response = client.get('/suppressions/export')
+
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert [line['address'] for line in lines] == ['a@example.com', 'example.org']
+
+    def test_get_and_remove(self, client, mock_email_service):
+        mock_email_service.get_suppression.return_value = {'address': 'a@example.com', 'reason': 'manual'}
+        assert client.get('/suppressions/a@example.com').json['reason'] == 'manual'
+
+        mock_email_service.get_suppression.return_value = None
+        assert client.get('/suppressions/b@example.com').status_code == 404
+
+        mock_email_service.remove_suppression.return_value = True
+        assert client.delete('/suppressions/a@example.com').status_code == 200
+        mock_email_service.remove_suppression.assert_called_once_with('a@example.com')
+
+        mock_email_service.remove_suppression.return_value = False
+        assert client.delete('/suppressions/a@example.com').status_code == 404
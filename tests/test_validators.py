@@ -1,5 +1,6 @@
 import pytest
-from utils.validators import validate_email_input, validate_smtp_config, is_valid_email
+from datetime import datetime, timedelta
+from utils.validators import validate_email_input, validate_smtp_config, validate_suppression, is_valid_email
 
 class TestValidators:
     def test_is_valid_email(self):
@@ -94,6 +95,107 @@ class TestValidators:
         assert result['valid'] is False
         assert 'Invalid BCC email format' in result['message']
     
+    def test_validate_email_input_reports_all_invalid_addresses(self):
+        """Test that every invalid address is reported at once"""
+        result = validate_email_input({
+            'subject': 'Test Subject',
+            'recipients': ['bad-one', 'test@example.com', 'bad-two', 42],
+            'html_content': '<p>Test content</p>',
+            'bcc': ['bad-bcc']
+        })
+        assert result['valid'] is False
+        assert result['message'] == ("Invalid recipient email format: bad-one, bad-two, 42; "
+                                     "Invalid BCC email format: bad-bcc")
+        assert [item['address'] for item in result['invalid_addresses']] == ['bad-one', 'bad-two', '42', 'bad-bcc']
+    
+    def test_validate_email_input_normalizes_addresses(self):
+        """Test that addresses are stripped, domains lowercased and duplicates dropped across fields"""
+        data = {
+            'subject': 'Test Subject',
+            'recipients': [' John@Example.COM ', 'jane@example.com', 'john@example.com'],
+            'html_content': '<p>Test content</p>',
+            'cc': ['JANE@example.com', 'cc@example.com'],
+            'bcc': ['cc@EXAMPLE.com\t']
+        }
+        result = validate_email_input(data)
+        
+        assert result['valid'] is True
+        assert data['recipients'] == ['John@example.com', 'jane@example.com']
+        assert data['cc'] == ['cc@example.com']
+        assert data['bcc'] == []
+    
+    def test_validate_email_input_embedded_newline(self):
+        """Test that an address with a line break is not accepted as two addresses"""
+        result = validate_email_input({
+            'subject': 'Test Subject',
+            'recipients': ['a@example.com\nb@example.com', 'invalid-email'],
+            'html_content': '<p>Test content</p>'
+        })
+        assert result['valid'] is False
+        assert len(result['invalid_addresses']) == 2
+    
+    def test_validate_email_input_address_list_too_long(self):
+        """Test address lists that don't fit their column are rejected rather than failing at insert"""
+        many = [f'user{i}@example.com' for i in range(100)]
+        for field in ('recipients', 'cc', 'bcc'):
+            data = {
+                'subject': 'Test Subject',
+                'recipients': ['test@example.com'],
+                'html_content': '<p>Test content</p>'
+            }
+            data[field] = many
+            result = validate_email_input(data)
+            assert result['valid'] is False
+            assert 'Too many' in result['message']
+        
+        data['bcc'] = many[:50]
+        assert validate_email_input(data)['valid'] is True
+    
+    def test_validate_email_input_idempotency_key(self):
+        """Test idempotency keys must be short strings"""
+        for key in ('', 'k' * 256, 42):
+            result = validate_email_input({
+                'subject': 'Test Subject',
+                'recipients': ['test@example.com'],
+                'html_content': '<p>Test content</p>',
+                'idempotency_key': key
+            })
+            assert result['valid'] is False
+            assert 'Idempotency key' in result['message']
+    
+    def test_validate_email_input_send_at(self):
+        """Test send_at is parsed in place, with offsets converted to local time"""
+        data = {
+            'subject': 'Test Subject',
+            'recipients': ['test@example.com'],
+            'html_content': '<p>Test content</p>',
+            'send_at': '2026-06-01T12:30:00'
+        }
+        assert validate_email_input(data)['valid'] is True
+        assert data['send_at'] == datetime(2026, 6, 1, 12, 30)
+        
+        local = datetime(2026, 6, 1, 12, 30).astimezone()
+        data['send_at'] = local.isoformat()
+        assert validate_email_input(data)['valid'] is True
+        assert data['send_at'] == datetime(2026, 6, 1, 12, 30)
+        
+        data['send_at'] = 'next tuesday'
+        result = validate_email_input(data)
+        assert result['valid'] is False
+        assert 'send_at' in result['message']
+    
+    def test_validate_suppression_expires_at(self):
+        """Test expires_at with an offset is converted to local time like send_at"""
+        local = datetime(2026, 6, 1, 12, 30).astimezone()
+        data = {'address': 'user@example.com', 'expires_at': local.isoformat()}
+        
+        assert validate_suppression(data)['valid'] is True
+        assert data['expires_at'] == datetime(2026, 6, 1, 12, 30)
+        assert data['expires_at'].tzinfo is None
+        
+        data['expires_at'] = 'soon'
+        assert validate_suppression(data)['valid'] is False
+    
     def test_validate_email_input_invalid_priority(self):
         """Test email validation with invalid priority"""
         # Priority too low
@@ -0,0 +1,117 @@
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+class IndexedHeap:
+    """Binary min-heap of unique keys with a key -> slot index.
+
+    Besides the usual push/pop it can change the priority of a key or remove it in
+    O(log n), which heapq and queue.PriorityQueue cannot do. Priorities only need
+    to be comparable; use tuples to break ties.
+    """
+
+    def __init__(self):
+        self._heap: List[List[Any]] = []  # [priority, key] pairs
+        self._index: Dict[Hashable, int] = {}  # key -> position in self._heap
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._index
+
+    def __iter__(self) -> Iterator[Tuple[Hashable, Any]]:
+        """Iterate over (key, priority) pairs in no particular order"""
+        return ((key, priority) for priority, key in self._heap)
+
+    def clear(self):
+        self._heap.clear()
+        self._index.clear()
+
+    def priority(self, key: Hashable) -> Any:
+        """Current priority of a key (KeyError if absent)"""
+        return self._heap[self._index[key]][0]
+
+    def push(self, key: Hashable, priority: Any):
+        """Insert a key, or change its priority if it is already present"""
+        pos = self._index.get(key)
+        if pos is None:
+            self._heap.append([priority, key])
+            self._index[key] = len(self._heap) - 1
+            self._sift_up(len(self._heap) - 1)
+            return
+
+        old = self._heap[pos][0]
+        self._heap[pos][0] = priority
+        if priority < old:
+            self._sift_up(pos)
+        else:
+            self._sift_down(pos)
+
+    def remove(self, key: Hashable) -> Any:
+        """Remove a key and return its priority (KeyError if absent)"""
+        pos = self._index.pop(key)
+        priority = self._heap[pos][0]
+
+        last = self._heap.pop()
+        if pos < len(self._heap):
+            # Move the last entry into the hole and restore the heap property
+            self._heap[pos] = last
+            self._index[last[1]] = pos
+            self._sift_up(pos)
+            self._sift_down(self._index[last[1]])
+
+        return priority
+
+    def peek(self, exclude: Optional[Hashable] = None) -> Optional[Tuple[Hashable, Any]]:
+        """Smallest (key, priority) without removing it, optionally skipping one key"""
+        if not self._heap:
+            return None
+
+        priority, key = self._heap[0]
+        if exclude is None or key != exclude:
+            return key, priority
+
+        # The second smallest entry is always one of the root's children
+        children = self._heap[1:3]
+        if not children:
+            return None
+        priority, key = min(children, key=lambda entry: entry[0])
+        return key, priority
+
+    def pop(self) -> Tuple[Hashable, Any]:
+        """Remove and return the smallest (key, priority) (IndexError if empty)"""
+        if not self._heap:
+            raise IndexError("pop from an empty heap")
+
+        priority, key = self._heap[0]
+        self.remove(key)
+        return key, priority
+
+    def _swap(self, i: int, j: int):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._index[heap[i][1]] = i
+        self._index[heap[j][1]] = j
+
+    def _sift_up(self, pos: int):
+        heap = self._heap
+        while pos > 0:
+            parent = (pos - 1) // 2
+            if heap[pos][0] < heap[parent][0]:
+                self._swap(pos, parent)
+                pos = parent
+            else:
+                break
+
+    def _sift_down(self, pos: int):
+        heap = self._heap
+        size = len(heap)
+        while True:
+            smallest = pos
+            for child in (2 * pos + 1, 2 * pos + 2):
+                if child < size and heap[child][0] < heap[smallest][0]:
+                    smallest = child
+            if smallest == pos:
+                break
+            self._swap(pos, smallest)
+            pos = smallest
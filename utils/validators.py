@@ -1,13 +1,92 @@
 import re
-from typing import Dict, Any
+import json
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from models.email_model import EmailMessage, Suppression
+
+# Compiled once instead of looked up in re's cache on every call
+EMAIL_PATTERN = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+
+# Domain part of the pattern, for domain-wide suppressions
+DOMAIN_PATTERN = re.compile(r'[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+
+# The same pattern applied to a whole newline-joined list at once, one address per line
+ADDRESS_LINE_PATTERN = re.compile(r'^[ \t]*(' + EMAIL_PATTERN.pattern + r')[ \t]*$', re.MULTILINE)
+
+# Address fields in the order duplicates are resolved: an address keeps its first field
+ADDRESS_FIELDS = (('recipients', 'recipient'), ('cc', 'CC'), ('bcc', 'BCC'))
 
 def is_valid_email(email: str) -> bool:
     """Validate email format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return isinstance(email, str) and EMAIL_PATTERN.fullmatch(email) is not None
+
+def _match_all(addresses: List[Any]) -> Optional[List[str]]:
+    """The stripped addresses when every entry is valid, matched in a single regex scan, else None"""
+    try:
+        text = '\n'.join(addresses)
+    except TypeError:
+        return None
+    found = ADDRESS_LINE_PATTERN.findall(text)
+    # An entry with an embedded newline could make up for an invalid one
+    if len(found) != len(addresses) or text.count('\n') != len(addresses) - 1:
+        return None
+    return found
+
+def normalize_addresses(data: Dict[str, Any]) -> Tuple[Dict[str, List[str]], List[Dict[str, str]]]:
+    """Validate recipients, cc and bcc in one pass.
+    
+    Returns the normalized lists (whitespace stripped, domain lowercased, duplicates
+    across all three fields dropped) and every invalid address with its field."""
+    fullmatch = EMAIL_PATTERN.fullmatch
+    seen = set()
+    normalized: Dict[str, List[str]] = {}
+    invalid: List[Dict[str, str]] = []
+    for field, _ in ADDRESS_FIELDS:
+        if not data.get(field):
+            continue
+        
+        addresses = normalized[field] = []
+        matched = _match_all(data[field])
+        for raw in matched if matched is not None else data[field]:
+            if matched is not None:
+                address = raw
+            else:
+                # Some entry is invalid, find out which ones
+                address = raw.strip() if isinstance(raw, str) else None
+                if address is None or fullmatch(address) is None:
+                    invalid.append({'field': field, 'address': str(raw)})
+                    continue
+            
+            key = address.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            if key != address:
+                local_part, _, domain = address.rpartition('@')
+                address = f"{local_part}@{domain.lower()}"
+            addresses.append(address)
+    return normalized, invalid
+
+def _invalid_address_message(invalid: List[Dict[str, str]]) -> str:
+    """One message listing every invalid address, grouped by field"""
+    parts = []
+    for field, label in ADDRESS_FIELDS:
+        addresses = [item['address'] for item in invalid if item['field'] == field]
+        if addresses:
+            parts.append(f"Invalid {label} email format: {', '.join(addresses)}")
+    return '; '.join(parts)
+
+def _parse_local_datetime(value) -> datetime:
+    """Parse an ISO date into a naive local datetime, converting one with an offset"""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
 
 def validate_email_input(data: Dict[str, Any]) -> Dict[str, Any]:
-    """Validate email input data"""
+    """Validate email input data, normalizing its address lists and parsing send_at in place"""
     # Check required fields
     required_fields = ['subject', 'recipients', 'html_content']
     for field in required_fields:
@@ -24,42 +103,31 @@ def validate_email_input(data: Dict[str, Any]) -> Dict[str, Any]:
             'message': "Recipients must be a non-empty list"
         }
     
-    for recipient in data['recipients']:
-        if not is_valid_email(recipient):
+    # CC and BCC are optional but must be lists
+    for field, label in (('cc', 'CC'), ('bcc', 'BCC')):
+        if data.get(field) and not isinstance(data[field], list):
             return {
                 'valid': False,
-                'message': f"Invalid recipient email format: {recipient}"
+                'message': f"{label} must be a list"
             }
     
-    # Validate CC if present
-    if 'cc' in data and data['cc']:
-        if not isinstance(data['cc'], list):
-            return {
-                'valid': False,
-                'message': "CC must be a list"
-            }
-        
-        for cc in data['cc']:
-            if not is_valid_email(cc):
-                return {
-                    'valid': False,
-                    'message': f"Invalid CC email format: {cc}"
-                }
+    # Check every address at once and report all the invalid ones
+    addresses, invalid = normalize_addresses(data)
+    if invalid:
+        return {
+            'valid': False,
+            'message': _invalid_address_message(invalid),
+            'invalid_addresses': invalid
+        }
     
-    # Validate BCC if present
-    if 'bcc' in data and data['bcc']:
-        if not isinstance(data['bcc'], list):
+    # Each list is stored as JSON in a column of limited size
+    for field, label in ADDRESS_FIELDS:
+        max_length = getattr(EmailMessage, field).max_length
+        if field in addresses and len(json.dumps(addresses[field])) > max_length:
             return {
                 'valid': False,
-                'message': "BCC must be a list"
+                'message': f"Too many {label} addresses: the list must fit in {max_length} characters"
             }
-        
-        for bcc in data['bcc']:
-            if not is_valid_email(bcc):
-                return {
-                    'valid': False,
-                    'message': f"Invalid BCC email format: {bcc}"
-                }
     
     # Validate priority if present
     if 'priority' in data:
@@ -76,6 +144,66 @@ def validate_email_input(data: Dict[str, Any]) -> Dict[str, Any]:
                 'message': "Priority must be an integer"
             }
     
+    # Validate campaign if present
+    if data.get('campaign') is not None:
+        if not isinstance(data['campaign'], str) or not 0 < len(data['campaign']) <= 255:
+            return {
+                'valid': False,
+                'message': "Campaign must be a string of 1 to 255 characters"
+            }
+    
+    # Validate send time if present, keeping it as a local datetime like every other timestamp
+    if data.get('send_at') is not None:
+        try:
+            data['send_at'] = _parse_local_datetime(data['send_at'])
+        except (ValueError, TypeError):
+            return {
+                'valid': False,
+                'message': "send_at must be an ISO date"
+            }
+    
+    # Validate idempotency key if present
+    if data.get('idempotency_key') is not None:
+        if not isinstance(data['idempotency_key'], str) or not 0 < len(data['idempotency_key']) <= 255:
+            return {
+                'valid': False,
+                'message': "Idempotency key must be a string of 1 to 255 characters"
+            }
+    
+    # Hand the normalized, deduplicated lists on to the caller
+    data.update(addresses)
+    
+    return {
+        'valid': True
+    }
+
+def validate_email_update(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate changes to a pending email, of which only the priority can be changed, parsing it in place"""
+    if not isinstance(data, dict) or 'priority' not in data:
+        return {
+            'valid': False,
+            'message': "Body must be an object with a priority"
+        }
+    
+    if set(data) != {'priority'}:
+        return {
+            'valid': False,
+            'message': "Only the priority of an email can be changed"
+        }
+    
+    try:
+        data['priority'] = int(data['priority'])
+    except (ValueError, TypeError):
+        return {
+            'valid': False,
+            'message': "Priority must be an integer"
+        }
+    if data['priority'] < 1 or data['priority'] > 5:
+        return {
+            'valid': False,
+            'message': "Priority must be between 1 and 5"
+        }
+    
     return {
         'valid': True
     }
@@ -141,6 +269,57 @@ def validate_smtp_config(data: Dict[str, Any]) -> Dict[str, Any]:
                 'message': "Hourly limit must be an integer"
             }
     
+    for field in ('connect_timeout', 'command_timeout', 'data_timeout'):
+        if field in data:
+            try:
+                timeout = int(data[field])
+                if timeout < 1:
+                    return {
+                        'valid': False,
+                        'message': f"{field} must be at least 1 second"
+                    }
+            except (ValueError, TypeError):
+                return {
+                    'valid': False,
+                    'message': f"{field} must be an integer"
+                }
+    
+    return {
+        'valid': True
+    }
+
+def validate_suppression(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a suppression entry, parsing its expires_at in place"""
+    if not isinstance(data, dict):
+        return {
+            'valid': False,
+            'message': "Suppression must be an object"
+        }
+    
+    address = data.get('address')
+    if not isinstance(address, str) or not (EMAIL_PATTERN.fullmatch(address.strip()) or
+                                            DOMAIN_PATTERN.fullmatch(address.strip())):
+        return {
+            'valid': False,
+            'message': "Address must be an email address or a domain"
+        }
+    
+    if data.get('reason') is not None and data['reason'] not in Suppression.REASONS:
+        return {
+            'valid': False,
+            'message': f"Reason must be one of {', '.join(Suppression.REASONS)}"
+        }
+    
+    # Kept as a local datetime, like send_at, so it compares with datetime.now()
+    if data.get('expires_at') is not None:
+        try:
+            data['expires_at'] = _parse_local_datetime(data['expires_at'])
+        except (ValueError, TypeError):
+            return {
+                'valid': False,
+                'message': "expires_at must be an ISO date"
+            }
+    
     return {
         'valid': True
-    }
\ No newline at end of file
+    }